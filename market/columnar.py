@@ -0,0 +1,192 @@
+import numpy as np
+
+
+def percent_change(previous_close, price):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (price - previous_close) / previous_close * 100
+
+
+class SnapshotFrame:
+    # Column-oriented market snapshot: one array per field instead of one dict
+    # per symbol. Ranking and aggregates are vectorized, and rows are only
+    # materialized as dicts when a template needs them.
+
+    __slots__ = ("symbols", "price", "previous_close", "change_pct")
+
+    def __init__(self, symbols, price, previous_close, change_pct=None):
+        symbols = np.asarray(symbols, dtype=str)
+        price = np.asarray(price, dtype=np.float64)
+        previous_close = np.asarray(previous_close, dtype=np.float64)
+        if change_pct is None:
+            change_pct = percent_change(previous_close, price)
+        change_pct = np.asarray(change_pct, dtype=np.float64)
+
+        valid = (
+            np.isfinite(price)
+            & np.isfinite(previous_close)
+            & (previous_close != 0)
+            & np.isfinite(change_pct)
+        )
+        self.symbols = symbols[valid]
+        self.price = np.round(price[valid], 2)
+        self.previous_close = np.round(previous_close[valid], 2)
+        self.change_pct = np.round(change_pct[valid], 2)
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], [])
+
+    @classmethod
+    def from_closes(cls, symbols, closes):
+        present = [symbol for symbol in symbols if closes.get(symbol)]
+        values = np.array([closes[symbol] for symbol in present], dtype=np.float64)
+        values = values.reshape(-1, 2)
+        return cls(present, values[:, 1], values[:, 0])
+
+    @classmethod
+    def _from_columns(cls, symbols, price, previous_close, change_pct):
+        # Columns already validated and rounded by another frame.
+        frame = cls.__new__(cls)
+        frame.symbols = symbols
+        frame.price = price
+        frame.previous_close = previous_close
+        frame.change_pct = change_pct
+        return frame
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __getstate__(self):
+        # Compact cache form: a single string for the symbols and raw float
+        # buffers for the columns pickle far smaller than a list of dicts.
+        return (
+            "\n".join(self.symbols.tolist()),
+            self.price.tobytes(),
+            self.previous_close.tobytes(),
+            self.change_pct.tobytes(),
+        )
+
+    def __setstate__(self, state):
+        symbols, price, previous_close, change_pct = state
+        self.symbols = np.array(symbols.split("\n") if symbols else [], dtype=str)
+        self.price = np.frombuffer(price, dtype=np.float64)
+        self.previous_close = np.frombuffer(previous_close, dtype=np.float64)
+        self.change_pct = np.frombuffer(change_pct, dtype=np.float64)
+
+    def merged(self, other):
+        # Rows of `other` fill symbols this frame lacks; existing rows win.
+        if not len(other):
+            return self
+        extra = ~np.isin(other.symbols, self.symbols)
+        return self._from_columns(
+            np.concatenate([self.symbols, other.symbols[extra]]),
+            np.concatenate([self.price, other.price[extra]]),
+            np.concatenate([self.previous_close, other.previous_close[extra]]),
+            np.concatenate([self.change_pct, other.change_pct[extra]]),
+        )
+
+    def ordered(self, symbols):
+        # Rows reordered to follow `symbols`; unknown symbols go last.
+        position = {symbol: i for i, symbol in enumerate(symbols)}
+        keys = np.array([position.get(s, len(position)) for s in self.symbols.tolist()])
+        order = np.argsort(keys, kind="stable")
+        return self._from_columns(
+            self.symbols[order],
+            self.price[order],
+            self.previous_close[order],
+            self.change_pct[order],
+        )
+
+    def _select(self, keys, n):
+        # The n smallest keys in O(len) plus a sort of n. Ties, including
+        # those at the cut-off, go to the earlier row (universe order).
+        n = min(n, len(self))
+        if n <= 0:
+            return np.empty(0, dtype=np.intp)
+        cutoff = np.partition(keys, n - 1)[n - 1]
+        below = np.flatnonzero(keys < cutoff)
+        tied = np.flatnonzero(keys == cutoff)[: n - len(below)]
+        candidates = np.concatenate([below, tied])
+        return candidates[np.argsort(keys[candidates], kind="stable")]
+
+    def top(self, n):
+        return self._select(-self.change_pct, n)
+
+    def bottom(self, n):
+        return self._select(self.change_pct, n)
+
+    def to_rows(self, names, indices=None):
+        if indices is None:
+            indices = range(len(self))
+        symbols = self.symbols
+        price = self.price
+        previous_close = self.previous_close
+        change_pct = self.change_pct
+        return [
+            {
+                "symbol": str(symbols[i]),
+                "company_name": names.get(str(symbols[i]), str(symbols[i])),
+                "price": float(price[i]),
+                "previous_close": float(previous_close[i]),
+                "change_pct": float(change_pct[i]),
+            }
+            for i in indices
+        ]
+
+    def changed_since(self, base):
+        # Rows that are new or moved since `base`, plus symbols that dropped
+        # out, matched by symbol with a sorted search rather than a dict.
+        if not len(base):
+            return np.arange(len(self)), []
+        order = np.argsort(base.symbols)
+        sorted_symbols = base.symbols[order]
+        positions = np.searchsorted(sorted_symbols, self.symbols)
+        positions = np.minimum(positions, len(sorted_symbols) - 1)
+        matched = sorted_symbols[positions] == self.symbols
+        base_rows = order[positions]
+        changed = (
+            ~matched
+            | (self.price != base.price[base_rows])
+            | (self.previous_close != base.previous_close[base_rows])
+            | (self.change_pct != base.change_pct[base_rows])
+        )
+        removed = base.symbols[~np.isin(base.symbols, self.symbols)]
+        return np.flatnonzero(changed), removed.tolist()
+
+    def breadth(self):
+        if not len(self):
+            return {"advancers": 0, "decliners": 0, "unchanged": 0, "median_change": None}
+        return {
+            "advancers": int(np.count_nonzero(self.change_pct > 0)),
+            "decliners": int(np.count_nonzero(self.change_pct < 0)),
+            "unchanged": int(np.count_nonzero(self.change_pct == 0)),
+            "median_change": round(float(np.median(self.change_pct)), 2),
+        }
+
+    def sector_breadth(self, sectors):
+        if not len(self):
+            return []
+        labels = np.array([sectors.get(symbol) or "Other" for symbol in self.symbols.tolist()])
+        keys, inverse = np.unique(labels, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(keys))
+        advancers = np.bincount(inverse, weights=self.change_pct > 0, minlength=len(keys))
+        decliners = np.bincount(inverse, weights=self.change_pct < 0, minlength=len(keys))
+        means = np.bincount(inverse, weights=self.change_pct, minlength=len(keys)) / counts
+
+        # Medians per group from one sort: order by (group, change) and split.
+        ordered = self.change_pct[np.lexsort((self.change_pct, inverse))]
+        groups = np.split(ordered, np.cumsum(counts)[:-1])
+
+        summary = [
+            {
+                "sector": str(keys[i]),
+                "count": int(counts[i]),
+                "advancers": int(advancers[i]),
+                "decliners": int(decliners[i]),
+                "avg_change": round(float(means[i]), 2),
+                "median_change": round(float(np.median(groups[i])), 2),
+            }
+            for i in range(len(keys))
+        ]
+        summary.sort(key=lambda item: item["avg_change"], reverse=True)
+        return summary
@@ -0,0 +1,154 @@
+import csv
+import io
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+from .models import DailyLeaderSnapshot
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # optional: only the columnar formats need it
+    pa = None
+
+EXPORT_FIELDS = (
+    "snapshot_date",
+    "symbol",
+    "company_name",
+    "group",
+    "close_price",
+    "change_pct",
+    "captured_at",
+)
+EXPORT_CHUNK_SIZE = 5000
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+COLUMNAR_FORMATS = ("parquet", "arrow")
+
+
+def export_queryset(start=None, end=None, symbols=None, group=None):
+    # Ordered like the (snapshot_date, symbol, group) unique index so the
+    # database can stream rows without a sort.
+    queryset = DailyLeaderSnapshot.objects.all()
+    if start:
+        queryset = queryset.filter(snapshot_date__gte=start)
+    if end:
+        queryset = queryset.filter(snapshot_date__lte=end)
+    if symbols:
+        queryset = queryset.filter(symbol__in=[symbol.upper() for symbol in symbols])
+    if group:
+        queryset = queryset.filter(group=group)
+    return queryset.order_by("snapshot_date", "symbol", "group").values_list(*EXPORT_FIELDS)
+
+
+def _batches(queryset, chunk_size):
+    # .iterator() fetches chunk_size rows at a time (a server-side cursor on
+    # PostgreSQL) and never fills the queryset cache, so memory stays flat.
+    rows = queryset.iterator(chunk_size=chunk_size)
+    while True:
+        batch = list(islice(rows, chunk_size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_csv(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for batch in _batches(queryset, chunk_size):
+        writer.writerows(
+            (day.isoformat(), symbol, name, group, price, change, captured.isoformat())
+            for day, symbol, name, group, price, change, captured in batch
+        )
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _schema():
+    return pa.schema(
+        [
+            ("snapshot_date", pa.date32()),
+            ("symbol", pa.string()),
+            ("company_name", pa.string()),
+            ("group", pa.string()),
+            ("close_price", pa.decimal128(12, 2)),
+            ("change_pct", pa.decimal128(7, 2)),
+            ("captured_at", pa.timestamp("us", tz="UTC")),
+        ]
+    )
+
+
+class _ChunkSink(io.RawIOBase):
+    # Write-only file object for the Arrow writers; the export drains what
+    # has been written so far after every batch.
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def iter_columnar(queryset, export_format, chunk_size=EXPORT_CHUNK_SIZE):
+    # One Parquet row group (or Arrow IPC record batch) per chunk of rows.
+    schema = _schema()
+    sink = _ChunkSink()
+    if export_format == "parquet":
+        writer = pa.parquet.ParquetWriter(sink, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    for batch in _batches(queryset, chunk_size):
+        columns = list(zip(*batch))
+        writer.write_batch(
+            pa.record_batch(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema,
+            )
+        )
+        data = sink.drain()
+        if data:
+            yield data
+    writer.close()
+    yield sink.drain()
+
+
+def iter_export(queryset, export_format, chunk_size=EXPORT_CHUNK_SIZE):
+    if export_format in COLUMNAR_FORMATS:
+        return iter_columnar(queryset, export_format, chunk_size)
+    return iter_csv(queryset, chunk_size)
+
+
+async def aiter_chunks(chunks):
+    # Under ASGI, Django would buffer a sync iterator completely before
+    # streaming it; step it in the (single) sync thread instead.
+    chunks = iter(chunks)
+    done = object()
+    while True:
+        chunk = await sync_to_async(next)(chunks, done)
+        if chunk is done:
+            return
+        yield chunk
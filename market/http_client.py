@@ -0,0 +1,487 @@
+import asyncio
+from collections import OrderedDict
+import gzip
+import http.client
+import socket
+import ssl
+import threading
+import time
+from urllib.error import HTTPError, URLError
+from urllib.parse import urljoin, urlsplit
+import zlib
+
+from django.conf import settings
+
+from . import metrics
+
+DEFAULT_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (X11; Linux x86_64) "
+        "AppleWebKit/537.36 Safari/537.36"
+    ),
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+MAX_CONNECTIONS_PER_HOST = 8
+IDLE_TIMEOUT_SECONDS = 30
+MAX_REDIRECTS = 3
+# Revalidation keeps the last body per URL; both the entry count and the
+# bytes held are capped (least recently used first out), and a body larger
+# than a tenth of the byte cap is not kept at all.
+MAX_VALIDATOR_ENTRIES = 4096
+MAX_VALIDATOR_BYTES = 32 * 1024 * 1024
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+# Errors on a reused keep-alive socket usually mean the server already closed
+# it; those requests are retried once on a fresh connection.
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+
+class _HostPool:
+    def __init__(self, scheme, host, port, max_connections, requests_per_second):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._next_request_at = 0.0
+
+    def _connect(self, timeout):
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(
+                self.host, self.port, timeout=timeout, context=ssl.create_default_context()
+            )
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def _wait_for_rate_limit(self):
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_request_at)
+            self._next_request_at = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def acquire(self, timeout):
+        if not self._slots.acquire(timeout=timeout):
+            raise socket.timeout("No free connection to {}".format(self.host))
+        self._wait_for_rate_limit()
+
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if now - last_used < IDLE_TIMEOUT_SECONDS:
+                    if conn.sock is not None:
+                        conn.sock.settimeout(timeout)
+                    conn.timeout = timeout
+                    return conn, True
+                conn.close()
+        return self._connect(timeout), False
+
+    def release(self, conn, reusable):
+        if reusable:
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        else:
+            conn.close()
+        self._slots.release()
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._idle.pop()[0].close()
+
+
+def _decode_body(body, encoding):
+    encoding = (encoding or "").lower()
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "deflate":
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+
+class HttpClient:
+    # Shared client for the market data providers: one keep-alive connection
+    # pool per host, gzip/deflate decoding, ETag/Last-Modified revalidation and
+    # an optional per-host request rate limit.
+
+    def __init__(self, max_connections_per_host=MAX_CONNECTIONS_PER_HOST, rate_limits=None):
+        self.max_connections_per_host = max_connections_per_host
+        self.rate_limits = dict(rate_limits or {})
+        self._pools = {}
+        self._validators = OrderedDict()
+        self._validator_bytes = 0
+        self._lock = threading.Lock()
+
+    def _pool(self, scheme, host, port):
+        key = (scheme, host, port)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = _HostPool(
+                    scheme,
+                    host,
+                    port,
+                    self.max_connections_per_host,
+                    self.rate_limits.get(host),
+                )
+                self._pools[key] = pool
+            return pool
+
+    def _cached(self, url):
+        with self._lock:
+            entry = self._validators.get(url)
+            if entry is not None:
+                self._validators.move_to_end(url)
+            return entry
+
+    def _remember(self, url, etag, last_modified, body):
+        with self._lock:
+            previous = self._validators.pop(url, None)
+            if previous is not None:
+                self._validator_bytes -= len(previous[2])
+            if len(body) > MAX_VALIDATOR_BYTES // 10:
+                return
+            self._validators[url] = (etag, last_modified, body)
+            self._validator_bytes += len(body)
+            while (
+                len(self._validators) > MAX_VALIDATOR_ENTRIES
+                or self._validator_bytes > MAX_VALIDATOR_BYTES
+            ):
+                self._validator_bytes -= len(self._validators.popitem(last=False)[1][2])
+
+    def _request(self, url, headers, timeout):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise URLError("Unsupported URL: {}".format(url))
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        path = parts.path or "/"
+        if parts.query:
+            path = "{}?{}".format(path, parts.query)
+        pool = self._pool(parts.scheme, parts.hostname, port)
+
+        for attempt in range(2):
+            conn, reused = pool.acquire(timeout)
+            try:
+                conn.request("GET", path, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()
+            except STALE_CONNECTION_ERRORS as exc:
+                pool.release(conn, False)
+                if reused and attempt == 0:
+                    continue
+                raise URLError(exc)
+            except (socket.timeout, ssl.SSLError):
+                pool.release(conn, False)
+                raise
+            except (OSError, http.client.HTTPException) as exc:
+                pool.release(conn, False)
+                raise URLError(exc)
+            pool.release(conn, not resp.will_close)
+            return resp, body
+
+    def get(self, url, headers=None, timeout=10):
+        for _ in range(MAX_REDIRECTS + 1):
+            request_headers = dict(DEFAULT_HEADERS)
+            request_headers.update(headers or {})
+            cached = self._cached(url)
+            if cached is not None:
+                etag, last_modified, _ = cached
+                if etag:
+                    request_headers["If-None-Match"] = etag
+                if last_modified:
+                    request_headers["If-Modified-Since"] = last_modified
+
+            resp, body = self._request(url, request_headers, timeout)
+            if resp.status in REDIRECT_STATUSES and resp.getheader("Location"):
+                url = urljoin(url, resp.getheader("Location"))
+                continue
+            if resp.status == 304 and cached is not None:
+                return cached[2]
+            if resp.status >= 400:
+                raise HTTPError(url, resp.status, resp.reason, resp.headers, None)
+
+            try:
+                body = _decode_body(body, resp.getheader("Content-Encoding"))
+            except (OSError, EOFError, zlib.error) as exc:
+                raise ValueError("Could not decode response from {}: {}".format(url, exc))
+
+            etag = resp.getheader("ETag")
+            last_modified = resp.getheader("Last-Modified")
+            if etag or last_modified:
+                self._remember(url, etag, last_modified, body)
+            return body
+        raise URLError("Too many redirects for {}".format(url))
+
+    def close(self):
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.close()
+
+
+class _AsyncHostPool:
+    # asyncio counterpart of _HostPool. Lives inside one event loop only.
+
+    def __init__(self, scheme, host, port, max_connections, requests_per_second):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.slots = asyncio.Semaphore(max_connections)
+        self._idle = []
+        self._interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._next_request_at = 0.0
+
+    async def wait_for_rate_limit(self):
+        if not self._interval:
+            return
+        now = time.monotonic()
+        slot = max(now, self._next_request_at)
+        self._next_request_at = slot + self._interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def connect(self):
+        while self._idle:
+            reader, writer, last_used = self._idle.pop()
+            if time.monotonic() - last_used < IDLE_TIMEOUT_SECONDS and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        if self.scheme == "https":
+            reader, writer = await asyncio.open_connection(
+                self.host,
+                self.port,
+                ssl=ssl.create_default_context(),
+                server_hostname=self.host,
+            )
+        else:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        return reader, writer, False
+
+    def release(self, reader, writer, reusable):
+        if reusable:
+            self._idle.append((reader, writer, time.monotonic()))
+        else:
+            writer.close()
+
+    def close(self):
+        while self._idle:
+            self._idle.pop()[1].close()
+
+
+async def _read_body(reader, headers, status):
+    # Returns (body, reusable) for one HTTP/1.1 response.
+    if status in (204, 304) or 100 <= status < 200:
+        return b"", True
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+            if not size:
+                while (await reader.readline()).strip():
+                    pass  # trailers
+                return b"".join(chunks), True
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+    if "content-length" in headers:
+        return await reader.readexactly(int(headers["content-length"])), True
+    return await reader.read(), False
+
+
+async def _exchange(reader, writer, host_header, path, headers):
+    lines = ["GET {} HTTP/1.1".format(path), "Host: {}".format(host_header)]
+    lines += ["{}: {}".format(name, value) for name, value in headers.items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    await writer.drain()
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError("Connection closed before the response")
+    fields = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+    version, status, reason = (fields + [""])[:3]
+    response_headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").rstrip("\r\n")
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        response_headers[name.strip().lower()] = value.strip()
+
+    status = int(status)
+    body, reusable = await _read_body(reader, response_headers, status)
+    reusable = (
+        reusable
+        and version == "HTTP/1.1"
+        and response_headers.get("connection", "").lower() != "close"
+    )
+    return status, reason, response_headers, body, reusable
+
+
+class AsyncHttpClient:
+    # Minimal HTTP/1.1 GET over asyncio streams for the async refresh path:
+    # keep-alive per host, the same connection and rate limits as HttpClient,
+    # gzip/deflate decoding, redirects and ETag/Last-Modified revalidation
+    # (validators come from the process-wide HttpClient). Create one per
+    # event loop, e.g. per refresh, and close it afterwards.
+
+    def __init__(self, max_connections_per_host=MAX_CONNECTIONS_PER_HOST, rate_limits=None):
+        self.max_connections_per_host = max_connections_per_host
+        self.rate_limits = dict(rate_limits or {})
+        self._pools = {}
+        self._shared = get_client()
+
+    def _pool(self, scheme, host, port):
+        key = (scheme, host, port)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = _AsyncHostPool(
+                scheme, host, port, self.max_connections_per_host, self.rate_limits.get(host)
+            )
+        return pool
+
+    async def _request(self, url, headers, timeout):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise URLError("Unsupported URL: {}".format(url))
+        default_port = 443 if parts.scheme == "https" else 80
+        port = parts.port or default_port
+        host_header = parts.hostname if port == default_port else "{}:{}".format(
+            parts.hostname, port
+        )
+        path = parts.path or "/"
+        if parts.query:
+            path = "{}?{}".format(path, parts.query)
+        pool = self._pool(parts.scheme, parts.hostname, port)
+
+        async with pool.slots:
+            await pool.wait_for_rate_limit()
+            for _ in range(2):
+                try:
+                    response = await asyncio.wait_for(
+                        self._attempt(pool, host_header, path, headers), timeout
+                    )
+                except asyncio.TimeoutError:
+                    raise socket.timeout("Timed out fetching {}".format(url))
+                except ssl.SSLError:
+                    raise
+                except (OSError, ValueError, asyncio.IncompleteReadError) as exc:
+                    raise URLError(exc)
+                if response is not None:
+                    return response
+        raise URLError("Connection to {} kept closing".format(parts.hostname))
+
+    async def _attempt(self, pool, host_header, path, headers):
+        # None means a reused keep-alive connection had already been closed by
+        # the server; the caller retries on another connection.
+        reader, writer, reused = await pool.connect()
+        try:
+            response = await _exchange(reader, writer, host_header, path, headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            if reused:
+                return None
+            raise
+        except BaseException:
+            writer.close()
+            raise
+        pool.release(reader, writer, response[4])
+        return response[:4]
+
+    async def get(self, url, headers=None, timeout=10):
+        host = urlsplit(url).hostname or ""
+        started = time.perf_counter()
+        try:
+            return await self._get(url, headers, timeout)
+        except Exception:
+            metrics.inc("market_http_errors_total", host=host)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe("market_http_request_seconds", elapsed, host=host)
+
+    async def _get(self, url, headers, timeout):
+        for _ in range(MAX_REDIRECTS + 1):
+            request_headers = dict(DEFAULT_HEADERS)
+            request_headers.update(headers or {})
+            cached = self._shared._cached(url)
+            if cached is not None:
+                etag, last_modified, _ = cached
+                if etag:
+                    request_headers["If-None-Match"] = etag
+                if last_modified:
+                    request_headers["If-Modified-Since"] = last_modified
+
+            status, reason, response_headers, body = await self._request(
+                url, request_headers, timeout
+            )
+            if status in REDIRECT_STATUSES and response_headers.get("location"):
+                url = urljoin(url, response_headers["location"])
+                continue
+            if status == 304 and cached is not None:
+                return cached[2]
+            if status >= 400:
+                raise HTTPError(url, status, reason, response_headers, None)
+
+            try:
+                body = _decode_body(body, response_headers.get("content-encoding"))
+            except (OSError, EOFError, zlib.error) as exc:
+                raise ValueError("Could not decode response from {}: {}".format(url, exc))
+
+            etag = response_headers.get("etag")
+            last_modified = response_headers.get("last-modified")
+            if etag or last_modified:
+                self._shared._remember(url, etag, last_modified, body)
+            return body
+        raise URLError("Too many redirects for {}".format(url))
+
+    def close(self):
+        for pool in self._pools.values():
+            pool.close()
+        self._pools.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_client():
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HttpClient(
+                rate_limits=getattr(settings, "MARKET_HTTP_RATE_LIMITS", None)
+            )
+        return _default_client
+
+
+def get(url, headers=None, timeout=10):
+    host = urlsplit(url).hostname or ""
+    started = time.perf_counter()
+    try:
+        return get_client().get(url, headers=headers, timeout=timeout)
+    except Exception:
+        metrics.inc("market_http_errors_total", host=host)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe("market_http_request_seconds", elapsed, host=host)
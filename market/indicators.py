@@ -0,0 +1,315 @@
+from datetime import date
+import math
+import os
+from pathlib import Path
+import threading
+
+import numpy as np
+
+# Daily technical indicators for the whole universe at once. The engine keeps
+# a (symbols x WINDOW_DAYS) matrix of committed daily closes and, derived from
+# it, the running state each indicator needs (partial sums, smoothed
+# averages, range extremes). A refresh only combines that state with the
+# live price, O(1) per symbol; the full window is recomputed once per session
+# when the day's closing prices are committed, or when a symbol is seeded.
+# Only the holder of the refresh lock drives the engine, but the holder can
+# be a different process each time, so every process picks up the files
+# written by the last one before using its own state.
+WINDOW_DAYS = 252
+SMA_SHORT_DAYS = 20
+SMA_LONG_DAYS = 50
+EMA_SPAN_DAYS = 20
+RSI_DAYS = 14
+VOLATILITY_DAYS = 20
+# Roughly 52 weeks of sessions; holidays make the exact count vary.
+RANGE_MIN_DAYS = 240
+TRADING_DAYS_PER_YEAR = 252
+INDICATOR_FIELDS = ("sma_20", "sma_50", "ema_20", "rsi_14", "volatility_20", "range_52w_pct")
+DISPLAY_DECIMALS = {
+    "sma_20": 2,
+    "sma_50": 2,
+    "ema_20": 2,
+    "rsi_14": 1,
+    "volatility_20": 1,
+    "range_52w_pct": 0,
+}
+
+
+def _smooth(columns, alpha):
+    # Exponential smoothing across the columns (oldest first), starting at
+    # each row's first value and skipping missing ones. Returns the last value.
+    value = np.full(columns.shape[0], np.nan)
+    for column in columns.T:
+        updated = np.where(np.isnan(value), column, value + alpha * (column - value))
+        value = np.where(np.isnan(column), value, updated)
+    return value
+
+
+def _sum_last(columns, n):
+    # NaN unless all of the last n values are present.
+    if n <= 0:
+        return np.zeros(columns.shape[0])
+    return columns[:, -n:].sum(axis=1)
+
+
+class IndicatorEngine:
+    def __init__(self, root=None):
+        self.root = Path(root) if root else None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._seed_attempts = {}
+        self._disk_stamp = None
+        self._load()
+
+    # -- persistence -------------------------------------------------------
+
+    def _files_stamp(self):
+        # Files are replaced, never rewritten in place, so a new inode or
+        # mtime means another process saved them.
+        if self.root is None:
+            return None
+        stamp = []
+        for name in ("history.npz", "session.npz"):
+            try:
+                stat = os.stat(self.root / name)
+            except FileNotFoundError:
+                stamp.append(None)
+            else:
+                stamp.append((stat.st_ino, stat.st_mtime_ns))
+        return tuple(stamp)
+
+    def _sync_from_disk(self):
+        # Pending seeds and today's seed attempts are kept; everything else
+        # comes from the files.
+        if self._files_stamp() != self._disk_stamp:
+            self._load()
+
+    def _save(self, name, **arrays):
+        if self.root is None:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.root / name
+        temporary = path.with_suffix(".tmp")
+        with open(temporary, "wb") as handle:
+            np.savez(handle, **arrays)
+        os.replace(temporary, path)
+        self._disk_stamp = self._files_stamp()
+
+    def _save_history(self):
+        self._save(
+            "history.npz", symbols=np.array(self.symbols, dtype=str), closes=self.closes
+        )
+
+    def _save_session(self):
+        # Small and written every refresh, so a restart does not lose the
+        # prices of a session that has not been committed yet.
+        self._save(
+            "session.npz",
+            symbols=np.array(self.symbols, dtype=str),
+            current=self.current,
+            day=np.array([self.session_day.toordinal() if self.session_day else 0]),
+        )
+
+    def _load(self):
+        self.symbols = []
+        self.closes = np.full((0, WINDOW_DAYS), np.nan)
+        self.session_day = None
+        self._frame_symbols = None
+        self._frame_rows = None
+        self._disk_stamp = self._files_stamp()
+        if self.root is not None and (self.root / "history.npz").exists():
+            with np.load(self.root / "history.npz") as history:
+                self.symbols = history["symbols"].tolist()
+                self.closes = history["closes"]
+        self._rows = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.current = np.full(len(self.symbols), np.nan)
+        self._state = self._compute(self.closes)
+        if self.root is None or not (self.root / "session.npz").exists():
+            return
+        with np.load(self.root / "session.npz") as session:
+            day = int(session["day"][0])
+            self.session_day = date.fromordinal(day) if day else None
+            symbols = session["symbols"].tolist()
+            # Symbols first priced this session are not in the history yet.
+            self._add_symbols(symbols)
+            rows = np.array([self._rows[symbol] for symbol in symbols], dtype=np.intp)
+            self.current[rows] = session["current"]
+
+    # -- committed state ---------------------------------------------------
+
+    def _add_symbols(self, symbols):
+        new = [symbol for symbol in symbols if symbol not in self._rows]
+        if not new:
+            return
+        for symbol in new:
+            self._rows[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        empty = np.full((len(new), WINDOW_DAYS), np.nan)
+        self.closes = np.vstack([self.closes, empty])
+        self.current = np.append(self.current, np.full(len(new), np.nan))
+        added = self._compute(empty)
+        self._state = {
+            name: np.concatenate([values, added[name]]) for name, values in self._state.items()
+        }
+        self._frame_symbols = None
+
+    def _compute(self, closes):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            returns = np.log(closes[:, 1:] / closes[:, :-1])
+            changes = np.diff(closes, axis=1)
+        return {
+            "count": np.count_nonzero(~np.isnan(closes), axis=1),
+            "last": closes[:, -1].copy(),
+            "sum_short": _sum_last(closes, SMA_SHORT_DAYS - 1),
+            "sum_long": _sum_last(closes, SMA_LONG_DAYS - 1),
+            "ema": _smooth(closes, 2 / (EMA_SPAN_DAYS + 1)),
+            "avg_gain": _smooth(np.maximum(changes, 0), 1 / RSI_DAYS),
+            "avg_loss": _smooth(np.maximum(-changes, 0), 1 / RSI_DAYS),
+            "return_sum": _sum_last(returns, VOLATILITY_DAYS - 1),
+            "return_squares": _sum_last(returns * returns, VOLATILITY_DAYS - 1),
+            "high": np.fmax.reduce(closes[:, 1:], axis=1),
+            "low": np.fmin.reduce(closes[:, 1:], axis=1),
+        }
+
+    def _close_session(self):
+        priced = ~np.isnan(self.current)
+        if priced.any():
+            self.closes[:, :-1] = self.closes[:, 1:]
+            self.closes[:, -1] = np.where(priced, self.current, self.closes[:, -2])
+            self._state = self._compute(self.closes)
+            self._save_history()
+        self.current[:] = np.nan
+
+    # -- seeding -----------------------------------------------------------
+
+    def needs_history(self, symbols, limit, today):
+        # Symbols without a year of closes that were not tried today.
+        with self._lock:
+            self._sync_from_disk()
+            wanted = []
+            for symbol in symbols:
+                if self._has_history(symbol) or self._seed_attempts.get(symbol) == today:
+                    continue
+                self._seed_attempts[symbol] = today
+                wanted.append(symbol)
+                if len(wanted) >= limit:
+                    break
+            return wanted
+
+    def _has_history(self, symbol):
+        if symbol in self._pending:
+            return True
+        row = self._rows.get(symbol)
+        return row is not None and self._state["count"][row] >= RANGE_MIN_DAYS - 1
+
+    def seed(self, symbol, closes):
+        # `closes`: completed daily closes before today, oldest first. Applied
+        # on the next update, after any session roll, so they line up with
+        # the committed columns.
+        closes = np.asarray(closes, dtype=np.float64)[-WINDOW_DAYS:]
+        if not len(closes):
+            return
+        with self._lock:
+            self._pending[symbol] = closes
+
+    def apply_seeds(self, today):
+        # Commits pending seeds right away when the engine is already on
+        # `today`'s session; otherwise the next update applies them after
+        # its session roll.
+        with self._lock:
+            self._sync_from_disk()
+            if self.session_day == today:
+                self._apply_seeds()
+
+    def _apply_seeds(self):
+        if not self._pending:
+            return
+        self._add_symbols(list(self._pending))
+        rows = np.array([self._rows[symbol] for symbol in self._pending], dtype=np.intp)
+        for row, closes in zip(rows, self._pending.values()):
+            self.closes[row] = np.nan
+            self.closes[row, -len(closes):] = closes
+        self._pending = {}
+        for name, values in self._compute(self.closes[rows]).items():
+            self._state[name][rows] = values
+        self._save_history()
+
+    # -- refresh -----------------------------------------------------------
+
+    def _rows_for(self, symbols):
+        if self._frame_symbols is None or not np.array_equal(symbols, self._frame_symbols):
+            self._add_symbols(symbols.tolist())
+            self._frame_symbols = symbols.copy()
+            self._frame_rows = np.array(
+                [self._rows[symbol] for symbol in symbols.tolist()], dtype=np.intp
+            )
+        return self._frame_rows
+
+    def update(self, frame, today):
+        # Indicators for every row of `frame`, as arrays aligned with it.
+        # `today` is the trading session the prices belong to; a later one
+        # commits the previous session's last prices as its closes.
+        with self._lock:
+            self._sync_from_disk()
+            rows = self._rows_for(frame.symbols)
+            if self.session_day is None:
+                self.session_day = today
+            elif today > self.session_day:
+                self._close_session()
+                self.session_day = today
+            self._apply_seeds()
+            self.current[rows] = frame.price
+            self._save_session()
+            state = {name: values[rows] for name, values in self._state.items()}
+        return self._indicators(state, frame.price)
+
+    def _indicators(self, state, price):
+        count = state["count"]
+        change = price - state["last"]
+        gain = np.maximum(change, 0)
+        loss = np.maximum(-change, 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            avg_gain = state["avg_gain"] + (gain - state["avg_gain"]) / RSI_DAYS
+            avg_loss = state["avg_loss"] + (loss - state["avg_loss"]) / RSI_DAYS
+            rsi = np.where(avg_loss > 0, 100 - 100 / (1 + avg_gain / avg_loss), 100.0)
+            rsi[count < RSI_DAYS] = np.nan
+
+            ema = state["ema"] + 2 / (EMA_SPAN_DAYS + 1) * (price - state["ema"])
+            ema[count < EMA_SPAN_DAYS - 1] = np.nan
+
+            log_return = np.log(price / state["last"])
+            return_sum = state["return_sum"] + log_return
+            return_squares = state["return_squares"] + log_return * log_return
+            variance = (return_squares - return_sum * return_sum / VOLATILITY_DAYS) / (
+                VOLATILITY_DAYS - 1
+            )
+            volatility = np.sqrt(np.maximum(variance, 0) * TRADING_DAYS_PER_YEAR) * 100
+
+            high = np.fmax(state["high"], price)
+            low = np.fmin(state["low"], price)
+            position = np.where(high > low, (price - low) / (high - low) * 100, np.nan)
+            position[count < RANGE_MIN_DAYS - 1] = np.nan
+
+        return {
+            "sma_20": (state["sum_short"] + price) / SMA_SHORT_DAYS,
+            "sma_50": (state["sum_long"] + price) / SMA_LONG_DAYS,
+            "ema_20": ema,
+            "rsi_14": rsi,
+            "volatility_20": volatility,
+            "range_52w_pct": position,
+        }
+
+
+def add_indicators(rows, indicators, indices=None):
+    # Attach display-rounded indicator values (None when unknown) to rows
+    # built by SnapshotFrame.to_rows with the same indices.
+    if not indicators:
+        return rows
+    if indices is None:
+        indices = range(len(rows))
+    columns = {field: indicators[field] for field in INDICATOR_FIELDS if field in indicators}
+    for row, i in zip(rows, indices):
+        for field, values in columns.items():
+            value = float(values[i])
+            row[field] = None if math.isnan(value) else round(value, DISPLAY_DECIMALS[field])
+    return rows
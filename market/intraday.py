@@ -0,0 +1,251 @@
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+import shutil
+import threading
+
+import numpy as np
+
+# Per-day directory layout:
+#   symbols.txt    column order, one symbol per line (append-only)
+#   times.bin      int64 epoch seconds, one per refresh
+#   prices.bin     float32 row of len(symbols) prices per refresh, NaN = missing
+#   bars_<secs>/   materialized OHLC rollups (times/open/high/low/close .npy)
+# Raw ticks are rolled up and dropped after RAW_RETENTION_DAYS; 5-minute bars
+# are kept for BAR_5M_RETENTION_DAYS and hourly bars for BAR_1H_RETENTION_DAYS.
+TIME_DTYPE = np.dtype("<i8")
+PRICE_DTYPE = np.dtype("<f4")
+BAR_5M_SECONDS = 300
+BAR_1H_SECONDS = 3600
+BAR_FIELDS = ("times", "open", "high", "low", "close")
+RAW_RETENTION_DAYS = 7
+BAR_5M_RETENTION_DAYS = 90
+BAR_1H_RETENTION_DAYS = 730
+
+
+def rollup(times, prices, interval):
+    # OHLC bars from tick rows; `prices` is (ticks, columns). Buckets with no
+    # tick at all are skipped, missing prices inside a bucket are ignored.
+    if not len(times):
+        empty = np.empty((0,) + prices.shape[1:], dtype=PRICE_DTYPE)
+        bars = {field: empty for field in BAR_FIELDS}
+        bars["times"] = np.empty(0, dtype=TIME_DTYPE)
+        return bars
+    buckets = times // interval
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+
+    with np.errstate(invalid="ignore"):
+        high = np.fmax.reduceat(prices, starts, axis=0)
+        low = np.fmin.reduceat(prices, starts, axis=0)
+
+    # First/last non-missing price per bucket and column.
+    valid = ~np.isnan(prices)
+    rows = np.arange(len(times))[:, None]
+    first_row = np.minimum.reduceat(np.where(valid, rows, len(times)), starts, axis=0)
+    last_row = np.maximum.reduceat(np.where(valid, rows, -1), starts, axis=0)
+    columns = np.arange(prices.shape[1])[None, :]
+    first_price = prices[np.minimum(first_row, len(times) - 1), columns]
+    last_price = prices[np.maximum(last_row, 0), columns]
+    open_ = np.where(first_row < len(times), first_price, np.nan)
+    close = np.where(last_row >= 0, last_price, np.nan)
+
+    return {
+        "times": buckets[starts] * interval,
+        "open": open_.astype(PRICE_DTYPE),
+        "high": high.astype(PRICE_DTYPE),
+        "low": low.astype(PRICE_DTYPE),
+        "close": close.astype(PRICE_DTYPE),
+    }
+
+
+class IntradayStore:
+    def __init__(self, root):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+
+    def day_dir(self, day):
+        return self.root / day.isoformat()
+
+    def _symbols(self, day_dir):
+        path = day_dir / "symbols.txt"
+        if not path.exists():
+            return []
+        return path.read_text().split()
+
+    def _tick_count(self, day_dir, width):
+        times = day_dir / "times.bin"
+        prices = day_dir / "prices.bin"
+        if not times.exists() or not width:
+            return 0
+        return min(
+            times.stat().st_size // TIME_DTYPE.itemsize,
+            prices.stat().st_size // (PRICE_DTYPE.itemsize * width),
+        )
+
+    def append(self, frame, captured_at=None):
+        captured_at = captured_at or datetime.now(timezone.utc)
+        day_dir = self.day_dir(captured_at.date())
+        with self._lock:
+            day_dir.mkdir(parents=True, exist_ok=True)
+            symbols = self._symbols(day_dir)
+            width = len(symbols)
+            ticks = self._tick_count(day_dir, width)
+
+            columns = {symbol: i for i, symbol in enumerate(symbols)}
+            new_symbols = [s for s in frame.symbols.tolist() if s not in columns]
+            if new_symbols:
+                # Rare (universe changes): widen the existing rows with NaN.
+                if ticks:
+                    old = np.fromfile(
+                        day_dir / "prices.bin", dtype=PRICE_DTYPE, count=ticks * width
+                    ).reshape(ticks, width)
+                    widened = np.full(
+                        (ticks, width + len(new_symbols)), np.nan, dtype=PRICE_DTYPE
+                    )
+                    widened[:, :width] = old
+                    widened.tofile(day_dir / "prices.bin")
+                for symbol in new_symbols:
+                    columns[symbol] = len(columns)
+                symbols += new_symbols
+                (day_dir / "symbols.txt").write_text("\n".join(symbols) + "\n")
+                width = len(symbols)
+
+            row = np.full(width, np.nan, dtype=PRICE_DTYPE)
+            row[[columns[s] for s in frame.symbols.tolist()]] = frame.price
+            with open(day_dir / "prices.bin", "r+b" if ticks else "wb") as handle:
+                handle.seek(ticks * width * PRICE_DTYPE.itemsize)
+                handle.write(row.tobytes())
+                handle.truncate()
+            with open(day_dir / "times.bin", "r+b" if ticks else "wb") as handle:
+                handle.seek(ticks * TIME_DTYPE.itemsize)
+                stamp = np.array([int(captured_at.timestamp())], dtype=TIME_DTYPE)
+                handle.write(stamp.tobytes())
+                handle.truncate()
+
+    def _raw(self, day):
+        day_dir = self.day_dir(day)
+        symbols = self._symbols(day_dir)
+        ticks = self._tick_count(day_dir, len(symbols))
+        if not ticks:
+            empty = np.empty((0, len(symbols)), dtype=PRICE_DTYPE)
+            return symbols, np.empty(0, dtype=TIME_DTYPE), empty
+        times = np.memmap(day_dir / "times.bin", dtype=TIME_DTYPE, mode="r", shape=(ticks,))
+        prices = np.memmap(
+            day_dir / "prices.bin", dtype=PRICE_DTYPE, mode="r", shape=(ticks, len(symbols))
+        )
+        return symbols, times, prices
+
+    def read_ticks(self, symbol, day):
+        symbols, times, prices = self._raw(day)
+        if symbol not in symbols:
+            return np.empty(0, dtype=TIME_DTYPE), np.empty(0, dtype=PRICE_DTYPE)
+        column = np.asarray(prices[:, symbols.index(symbol)])
+        keep = ~np.isnan(column)
+        return np.asarray(times)[keep], column[keep]
+
+    def _stored_bars(self, day_dir, interval):
+        bar_dir = day_dir / "bars_{}".format(interval)
+        if not (bar_dir / "close.npy").exists():
+            return None
+        return {
+            field: np.load(bar_dir / "{}.npy".format(field), mmap_mode="r")
+            for field in BAR_FIELDS
+        }
+
+    def _day_bars(self, symbol, day, interval):
+        day_dir = self.day_dir(day)
+        symbols = self._symbols(day_dir)
+        if symbol not in symbols:
+            return None
+        column = symbols.index(symbol)
+        bars = self._stored_bars(day_dir, interval)
+        if bars is not None:
+            return {
+                field: np.asarray(values if field == "times" else values[:, column])
+                for field, values in bars.items()
+            }
+        # Not rolled up yet: aggregate just this symbol's raw column.
+        _, times, prices = self._raw(day)
+        bars = rollup(np.asarray(times), np.asarray(prices[:, column : column + 1]), interval)
+        return {
+            field: values if field == "times" else values[:, 0]
+            for field, values in bars.items()
+        }
+
+    def read_bars(self, symbol, start, end, interval=BAR_5M_SECONDS):
+        chunks = {field: [] for field in BAR_FIELDS}
+        day = start
+        while day <= end:
+            bars = self._day_bars(symbol, day, interval)
+            if bars is not None and len(bars["times"]):
+                for field in BAR_FIELDS:
+                    chunks[field].append(bars[field])
+            day += timedelta(days=1)
+
+        result = {}
+        for field in BAR_FIELDS:
+            dtype = TIME_DTYPE if field == "times" else PRICE_DTYPE
+            if chunks[field]:
+                result[field] = np.concatenate(chunks[field])
+            else:
+                result[field] = np.empty(0, dtype=dtype)
+        keep = ~np.isnan(result["close"])
+        return {field: values[keep] for field, values in result.items()}
+
+    def first_prices(self, day):
+        # Earliest captured price per symbol for the day ("move since open").
+        symbols, times, prices = self._raw(day)
+        if not len(times):
+            return {}
+        prices = np.asarray(prices)
+        valid = ~np.isnan(prices)
+        first_row = np.argmax(valid, axis=0)
+        firsts = prices[first_row, np.arange(len(symbols))]
+        return {
+            symbol: float(firsts[i]) for i, symbol in enumerate(symbols) if valid[:, i].any()
+        }
+
+    def _write_bars(self, day_dir, interval, bars):
+        bar_dir = day_dir / "bars_{}".format(interval)
+        bar_dir.mkdir(exist_ok=True)
+        for field in BAR_FIELDS:
+            np.save(bar_dir / "{}.npy".format(field), bars[field])
+
+    def prune(
+        self,
+        today,
+        raw_days=RAW_RETENTION_DAYS,
+        bar_5m_days=BAR_5M_RETENTION_DAYS,
+        bar_1h_days=BAR_1H_RETENTION_DAYS,
+    ):
+        removed = {"raw": 0, "bars_5m": 0, "days": 0}
+        if not self.root.exists():
+            return removed
+
+        for day_dir in sorted(self.root.iterdir()):
+            try:
+                day = date.fromisoformat(day_dir.name)
+            except ValueError:
+                continue
+            age = (today - day).days
+
+            if age > bar_1h_days:
+                shutil.rmtree(day_dir)
+                removed["days"] += 1
+                continue
+
+            if age > raw_days and (day_dir / "times.bin").exists():
+                with self._lock:
+                    _, times, prices = self._raw(day)
+                    times, prices = np.asarray(times), np.asarray(prices)
+                    for interval in (BAR_5M_SECONDS, BAR_1H_SECONDS):
+                        if self._stored_bars(day_dir, interval) is None:
+                            self._write_bars(day_dir, interval, rollup(times, prices, interval))
+                    (day_dir / "times.bin").unlink()
+                    (day_dir / "prices.bin").unlink(missing_ok=True)
+                removed["raw"] += 1
+
+            bar_5m_dir = day_dir / "bars_{}".format(BAR_5M_SECONDS)
+            if age > bar_5m_days and bar_5m_dir.exists():
+                shutil.rmtree(bar_5m_dir)
+                removed["bars_5m"] += 1
+        return removed
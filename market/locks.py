@@ -0,0 +1,101 @@
+import os
+import time
+import uuid
+
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.core.cache.backends.redis import RedisCache
+
+# Mutual exclusion for work that must run once at a time. With Redis or
+# Memcached as the shared cache the lock is a cache key taken with add(),
+# which those servers perform atomically (SET NX / add), so it spans hosts.
+# Otherwise it is an O_CREAT | O_EXCL lock file, atomic on any local
+# filesystem but only per host (FileBasedCache.add is a check-then-set and
+# cannot be used). A holder that died is recognised by the key's TTL or the
+# file's age, and its lock is broken after `timeout` seconds.
+POLL_SECONDS = 0.05
+ATOMIC_ADD_BACKENDS = (RedisCache, BaseMemcachedCache)
+
+
+def supports_atomic_add(cache):
+    return isinstance(cache, ATOMIC_ADD_BACKENDS)
+
+
+def _poll(try_acquire, wait):
+    give_up_at = time.monotonic() + wait
+    while not try_acquire():
+        if time.monotonic() >= give_up_at:
+            return False
+        time.sleep(POLL_SECONDS)
+    return True
+
+
+def acquire_cache_lock(cache, key, timeout, wait=0):
+    token = uuid.uuid4().hex
+    return token if _poll(lambda: cache.add(key, token, timeout), wait) else None
+
+
+def release_cache_lock(cache, key, token):
+    # Not a compare-and-delete; the TTL is far longer than a holder keeps
+    # the lock, so the key cannot have expired and been re-taken in between.
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+def _create(path, token):
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w") as handle:
+        handle.write(token)
+    return True
+
+
+def _is_stale(path, timeout):
+    try:
+        return time.time() - os.stat(path).st_mtime > timeout
+    except FileNotFoundError:
+        return True
+
+
+def _break_stale(path, timeout):
+    # Move the stale file aside first so only one process breaks it; if a
+    # fresh lock was created in between, put that one back.
+    aside = "{}.{}.stale".format(path, uuid.uuid4().hex)
+    try:
+        os.rename(path, aside)
+    except FileNotFoundError:
+        return
+    if not _is_stale(aside, timeout):
+        try:
+            os.link(aside, path)
+        except FileExistsError:
+            pass
+    os.unlink(aside)
+
+
+def _try_acquire(path, timeout, token):
+    if _create(path, token):
+        return True
+    if not _is_stale(path, timeout):
+        return False
+    _break_stale(path, timeout)
+    return _create(path, token)
+
+
+def acquire_file_lock(path, timeout, wait=0):
+    # Returns a token to release the lock with, or None when it is still
+    # held after `wait` seconds.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    token = uuid.uuid4().hex
+    return token if _poll(lambda: _try_acquire(path, timeout, token), wait) else None
+
+
+def release_file_lock(path, token):
+    try:
+        with open(path) as handle:
+            if handle.read() != token:
+                return
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,143 @@
+from datetime import date
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+import numpy as np
+import pandas as pd
+
+from market.models import DailyLeaderSnapshot
+from market.services import get_universe, leader_snapshot, save_leader_snapshots
+
+# Stooq ships two daily layouts: the per-symbol download
+# (Date,Open,High,Low,Close,Volume with ISO dates) and the bulk ASCII dump
+# (<TICKER>,<PER>,<DATE>,<TIME>,<OPEN>,...,<CLOSE>,... with YYYYMMDD dates).
+CSV_SUFFIXES = (".csv", ".txt")
+MAX_ABS_CHANGE_PCT = 99999.99
+
+
+def _csv_paths(paths):
+    for raw in paths:
+        path = Path(raw)
+        if path.is_dir():
+            yield from sorted(p for p in path.rglob("*") if p.suffix.lower() in CSV_SUFFIXES)
+        elif path.exists():
+            yield path
+        else:
+            raise CommandError("No such file or directory: {}".format(path))
+
+
+def _read_closes(path):
+    frame = pd.read_csv(path, na_values=["N/D"], dtype={"<DATE>": str, "Date": str})
+    frame.columns = [column.strip().strip("<>").lower() for column in frame.columns]
+    if "date" not in frame or "close" not in frame or frame.empty:
+        return None, None
+
+    if "per" in frame:
+        frame = frame[frame["per"].astype(str).str.upper() == "D"]
+    if "ticker" in frame and not frame.empty:
+        symbol = str(frame["ticker"].iloc[0]).split(".")[0].upper()
+    else:
+        symbol = path.name.split(".")[0].upper()
+
+    raw_dates = frame["date"].astype(str)
+    date_format = "%Y%m%d" if raw_dates.str.len().iloc[0] == 8 else "%Y-%m-%d"
+    closes = pd.Series(
+        frame["close"].to_numpy(dtype="float64"),
+        index=pd.to_datetime(raw_dates, format=date_format).dt.date,
+    )
+    closes = closes[~closes.index.duplicated(keep="last")].sort_index().dropna()
+    return symbol, closes
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill DailyLeaderSnapshot (and the daily aggregates) from Stooq-format "
+        "daily CSV files, one file per symbol."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="CSV files or directories of CSV files.")
+        parser.add_argument("--top", type=int, default=10, help="Winners/losers kept per day.")
+        parser.add_argument(
+            "--batch-days",
+            type=int,
+            default=250,
+            help="Trading days written per transaction.",
+        )
+        parser.add_argument("--since", type=parse_date, help="First day to load (YYYY-MM-DD).")
+        parser.add_argument("--until", type=parse_date, help="Last day to load (YYYY-MM-DD).")
+
+    def handle(self, *args, **options):
+        closes = {}
+        changes = {}
+        for path in _csv_paths(options["paths"]):
+            symbol, series = _read_closes(path)
+            if symbol is None or len(series) < 2:
+                self.stderr.write("Skipping {}: no usable daily closes.".format(path))
+                continue
+            previous = series.shift(1)
+            closes[symbol] = series
+            changes[symbol] = ((series - previous) / previous.where(previous != 0)) * 100
+
+        if not closes:
+            raise CommandError("No daily closes found.")
+
+        # Wide (day x symbol) frames so each day is ranked with one vector op.
+        close_frame = pd.DataFrame(closes).sort_index()
+        change_frame = pd.DataFrame(changes).reindex(close_frame.index)
+        since = options["since"] or date.min
+        until = options["until"] or date.max
+        in_range = [since <= day <= until for day in change_frame.index]
+        close_frame = close_frame[in_range]
+        change_frame = change_frame[in_range]
+
+        names = {item["symbol"]: item["name"] for item in get_universe()}
+        symbols = list(change_frame.columns)
+        days = list(change_frame.index)
+        change_values = change_frame.to_numpy(dtype="float64")
+        close_values = close_frame.to_numpy(dtype="float64")
+        top = options["top"]
+        batch_days = max(1, options["batch_days"])
+
+        total = 0
+        for start in range(0, len(days), batch_days):
+            snapshots = []
+            for offset, day in enumerate(days[start:start + batch_days]):
+                day_changes = change_values[start + offset]
+                valid = np.flatnonzero(
+                    ~np.isnan(day_changes) & (np.abs(day_changes) <= MAX_ABS_CHANGE_PCT)
+                )
+                if not len(valid):
+                    continue
+                ordered = valid[np.argsort(day_changes[valid], kind="stable")]
+                groups = (
+                    (DailyLeaderSnapshot.GROUP_WINNER, ordered[::-1][:top]),
+                    (DailyLeaderSnapshot.GROUP_LOSER, ordered[:top]),
+                )
+                for group, columns in groups:
+                    for column in columns:
+                        symbol = symbols[column]
+                        row = {
+                            "symbol": symbol,
+                            "company_name": names.get(symbol, symbol),
+                            "price": round(float(close_values[start + offset, column]), 2),
+                            "change_pct": round(float(day_changes[column]), 2),
+                        }
+                        snapshots.append(leader_snapshot(day, group, row))
+
+            save_leader_snapshots(snapshots)
+            total += len(snapshots)
+            self.stdout.write(
+                "Loaded {} of {} days ({} snapshots).".format(
+                    min(start + batch_days, len(days)), len(days), total
+                )
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Backfilled {} snapshots for {} symbols over {} days.".format(
+                    total, len(symbols), len(days)
+                )
+            )
+        )
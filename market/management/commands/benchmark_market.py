@@ -0,0 +1,371 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+import json
+from pathlib import Path
+import platform
+import statistics
+import tempfile
+import time
+from unittest import mock
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext,
+    override_settings,
+    setup_databases,
+    teardown_databases,
+)
+from django.utils import timezone as dj_timezone
+
+from market import http_client, metrics, services, trading_calendar
+from market.models import DailyLeaderAggregate, DailyLeaderSnapshot, TrackedSymbol
+from market.providers import ProviderStats
+from market.stub_market import ENDPOINTS, StubMarketServer
+
+# Runs entirely offline: a throwaway test database, a temporary cache and data
+# directory, and the stub market server in place of Yahoo and Stooq. Results
+# are printed (or written) as one JSON document so runs can be diffed.
+RESULT_FORMAT = 1
+# Refreshes see the market an hour after the latest session's open, so cache
+# lifetimes and leader writes are those of an open market whenever it runs.
+SESSION_OFFSET = timedelta(hours=1)
+
+
+def _int_list(value):
+    try:
+        return [int(item) for item in value.split(",") if item]
+    except ValueError:
+        raise CommandError("Expected a comma-separated list of integers: {}".format(value))
+
+
+def _summary(seconds):
+    ordered = sorted(seconds)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def _counter_delta(before, after, name):
+    delta = {}
+    for (metric, labels), value in after["counters"].items():
+        if metric != name:
+            continue
+        change = value - before["counters"].get((metric, labels), 0)
+        if change:
+            delta[",".join("{}={}".format(*label) for label in labels)] = round(change, 6)
+    return delta
+
+
+def _open_market_moment():
+    day = trading_calendar.session_date(datetime.now(timezone.utc))
+    return trading_calendar.session_hours(day)[0] + SESSION_OFFSET
+
+
+@contextmanager
+def _pinned_session(moment):
+    session = trading_calendar.session_info(moment)
+    day = trading_calendar.session_date(moment)
+    timeout = trading_calendar.seconds_until_refresh(moment, services.CACHE_TIMEOUT_SECONDS)
+    with mock.patch.object(trading_calendar, "session_info", return_value=session):
+        with mock.patch.object(trading_calendar, "session_date", return_value=day):
+            with mock.patch.object(
+                trading_calendar, "seconds_until_refresh", return_value=timeout
+            ):
+                yield session
+
+
+def _reset_process_state():
+    # Module-level singletons would otherwise carry paths, validators and
+    # provider health over from before the settings were overridden.
+    services.wait_for_indicator_seeding()
+    services._universe_memo.clear()
+    services._stooq_store = None
+    services._intraday_store = None
+    services._indicator_engine = None
+    http_client._default_client = None
+    for provider in services.PROVIDERS:
+        provider.stats = ProviderStats()
+
+
+def _timed_snapshot():
+    before = metrics.samples()
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        snapshot = services.get_market_snapshot()
+        elapsed = time.perf_counter() - started
+    after = metrics.samples()
+    # Background indicator seeding takes the refresh lock; let it finish
+    # outside the measurement so the next step's rebuild is not skipped.
+    services.wait_for_indicator_seeding()
+    return {
+        "seconds": round(elapsed, 4),
+        "queries": len(queries),
+        "rows": len(snapshot["frame"]),
+        "error": snapshot["error"],
+        "provider_rows": _counter_delta(before, after, "market_provider_rows_total"),
+        "provider_errors": _counter_delta(before, after, "market_provider_errors_total"),
+        "stage_queries": _counter_delta(before, after, "market_stage_queries_total"),
+        "stage_query_seconds": _counter_delta(
+            before, after, "market_stage_query_seconds_total"
+        ),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the market pipeline offline against a local stub of the "
+        "Yahoo and Stooq endpoints and print the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--universe", type=int, default=500, help="Tracked symbols.")
+        parser.add_argument(
+            "--latency-ms", type=float, default=20, help="Stub latency per request."
+        )
+        parser.add_argument(
+            "--failure-rate",
+            type=float,
+            default=0.0,
+            help="Share of stub requests answering 503.",
+        )
+        parser.add_argument(
+            "--missing-rate",
+            type=float,
+            default=0.0,
+            help="Share of symbols the stub quote endpoint leaves out.",
+        )
+        parser.add_argument(
+            "--disable",
+            action="append",
+            choices=ENDPOINTS,
+            default=[],
+            help="Stub endpoint that always fails (repeatable).",
+        )
+        parser.add_argument(
+            "--warm-iterations", type=int, default=200, help="Cache-hit snapshot reads."
+        )
+        parser.add_argument(
+            "--clients",
+            type=_int_list,
+            default=[1, 4, 16],
+            help="Concurrent dashboard clients to measure, e.g. 1,4,16.",
+        )
+        parser.add_argument(
+            "--requests", type=int, default=200, help="Dashboard requests per client level."
+        )
+        parser.add_argument(
+            "--history-days",
+            type=_int_list,
+            default=[10, 1000, 10000],
+            help="Days of leader history to measure the chart at, e.g. 10,1000,10000.",
+        )
+        parser.add_argument("--output", help="Write the JSON here instead of stdout.")
+
+    def handle(self, *args, **options):
+        session_at = _open_market_moment()
+        stub = StubMarketServer(
+            latency=options["latency_ms"] / 1000,
+            failure_rate=options["failure_rate"],
+            missing_rate=options["missing_rate"],
+            disabled=options["disable"],
+            today=trading_calendar.session_date(session_at),
+        )
+        started_at = datetime.now(timezone.utc)
+        with tempfile.TemporaryDirectory() as workdir, stub:
+            workdir = Path(workdir)
+            databases = setup_databases(verbosity=0, interactive=False)
+            try:
+                with override_settings(
+                    MARKET_DATA_DIR=workdir,
+                    CACHES={
+                        "default": {
+                            "BACKEND": "market.tiered_cache.TieredCache",
+                            "LOCATION": "market-benchmark-l1",
+                            "OPTIONS": {
+                                "SHARED": "shared",
+                                "DURABLE": "durable",
+                                "DURABLE_KEYS": [
+                                    services.UNIVERSE_VERSION_KEY,
+                                    services.CACHE_KEY,
+                                    services.STALE_CACHE_KEY,
+                                ],
+                                "MAX_ENTRIES": 256,
+                            },
+                        },
+                        "shared": {
+                            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                            "LOCATION": workdir / "cache",
+                            "OPTIONS": {"MAX_ENTRIES": 20000, "CULL_FREQUENCY": 10},
+                        },
+                        "durable": {
+                            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                            "LOCATION": workdir / "cache-durable",
+                        },
+                    },
+                    MARKET_REFRESH_ON_REQUEST=True,
+                    MARKET_YAHOO_QUOTE_URL=stub.url,
+                    MARKET_YAHOO_CHART_URL=stub.url,
+                    MARKET_STOOQ_URL=stub.url,
+                    ALLOWED_HOSTS=["testserver"],
+                ), _pinned_session(session_at) as session:
+                    _reset_process_state()
+                    results = self._run(options)
+            finally:
+                _reset_process_state()
+                teardown_databases(databases, verbosity=0)
+
+        report = {
+            "format": RESULT_FORMAT,
+            "started_at": started_at.isoformat(),
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "machine": platform.machine(),
+            },
+            "session": dict(session, pinned_at=session_at.isoformat()),
+            "config": {
+                "universe": options["universe"],
+                "latency_ms": options["latency_ms"],
+                "failure_rate": options["failure_rate"],
+                "missing_rate": options["missing_rate"],
+                "disabled": sorted(options["disable"]),
+                "warm_iterations": options["warm_iterations"],
+                "clients": options["clients"],
+                "requests": options["requests"],
+                "history_days": options["history_days"],
+            },
+            "results": results,
+            "stub_requests": dict(stub.requests),
+        }
+        document = json.dumps(report, indent=2, sort_keys=True)
+        if options["output"]:
+            Path(options["output"]).write_text(document + "\n")
+            self.stderr.write("Wrote {}".format(options["output"]))
+        else:
+            self.stdout.write(document)
+
+    def _seed_universe(self, size):
+        existing = TrackedSymbol.objects.count()
+        TrackedSymbol.objects.bulk_create(
+            [
+                TrackedSymbol(symbol="BM{:05d}".format(i), name="Benchmark {}".format(i))
+                for i in range(max(0, size - existing))
+            ]
+        )
+        services.invalidate_universe()
+        return len(services.get_universe())
+
+    def _run(self, options):
+        results = {"universe_size": self._seed_universe(options["universe"])}
+        self.stderr.write("Cold snapshot ...")
+        results["snapshot_cold"] = _timed_snapshot()
+
+        self.stderr.write("Warm snapshot reads ...")
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(options["warm_iterations"]):
+                started = time.perf_counter()
+                services.get_market_snapshot()
+                timings.append(time.perf_counter() - started)
+        results["snapshot_warm"] = dict(_summary(timings), queries=len(queries))
+
+        # A rebuild on warm stores (Stooq history on disk, HTTP validators),
+        # which is what the periodic refresher pays.
+        self.stderr.write("Warm rebuild ...")
+        cache.delete(services.CACHE_KEY)
+        results["snapshot_rebuild"] = _timed_snapshot()
+
+        results["dashboard"] = [
+            self._dashboard_throughput(clients, options["requests"])
+            for clients in options["clients"]
+        ]
+        results["history_chart"] = [
+            self._history_chart_cost(days) for days in options["history_days"]
+        ]
+        return results
+
+    def _dashboard_throughput(self, clients, requests):
+        self.stderr.write("Dashboard with {} client(s) ...".format(clients))
+        Client().get("/")  # render and compress once outside the timed loop
+
+        def worker(count):
+            client = Client(HTTP_ACCEPT_ENCODING="gzip, br")
+            timings = []
+            try:
+                for _ in range(count):
+                    started = time.perf_counter()
+                    response = client.get("/")
+                    timings.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        raise CommandError(
+                            "Dashboard answered {}".format(response.status_code)
+                        )
+            finally:
+                connections.close_all()
+            return timings
+
+        per_client = max(1, requests // clients)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            timings = sum(executor.map(worker, [per_client] * clients), [])
+        elapsed = time.perf_counter() - started
+        return dict(
+            _summary(timings),
+            clients=clients,
+            requests_per_second=round(len(timings) / elapsed, 1),
+        )
+
+    def _history_chart_cost(self, days):
+        self.stderr.write("History chart over {} day(s) ...".format(days))
+        DailyLeaderSnapshot.objects.all().delete()
+        DailyLeaderAggregate.objects.all().delete()
+
+        universe = services.get_universe()
+        today = dj_timezone.localdate()
+        rows_per_group = min(services.LEADER_COUNT, len(universe))
+        started = time.perf_counter()
+        for first in range(0, days, 250):
+            snapshots = []
+            for offset in range(first, min(days, first + 250)):
+                day = today - timedelta(days=offset)
+                for i in range(rows_per_group):
+                    row = {
+                        "symbol": universe[(offset + i) % len(universe)]["symbol"],
+                        "company_name": "",
+                        "price": 100 + i,
+                        "change_pct": (i + 1) * (1 if offset % 2 else -1),
+                    }
+                    snapshots.append(
+                        services.leader_snapshot(day, DailyLeaderSnapshot.GROUP_WINNER, row)
+                    )
+                    snapshots.append(
+                        services.leader_snapshot(
+                            day, DailyLeaderSnapshot.GROUP_LOSER, dict(row, change_pct=-i - 1)
+                        )
+                    )
+            services.save_leader_snapshots(snapshots)
+        load_seconds = time.perf_counter() - started
+
+        timings = []
+        for _ in range(5):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                services._build_history_chart_data(days)
+                timings.append(time.perf_counter() - started)
+        return dict(
+            _summary(timings),
+            days=days,
+            snapshot_rows=DailyLeaderSnapshot.objects.count(),
+            load_seconds=round(load_seconds, 3),
+            queries=len(queries),
+        )
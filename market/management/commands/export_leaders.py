@@ -0,0 +1,59 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from market import exports
+from market.models import DailyLeaderSnapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream DailyLeaderSnapshot rows to CSV, Parquet or Arrow without loading "
+        "the history into memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format", choices=sorted(exports.EXPORT_FORMATS), default="csv", dest="format"
+        )
+        parser.add_argument("--start", type=parse_date, help="First day (YYYY-MM-DD).")
+        parser.add_argument("--end", type=parse_date, help="Last day (YYYY-MM-DD).")
+        parser.add_argument(
+            "--symbol", action="append", default=[], help="Only this symbol (repeatable)."
+        )
+        parser.add_argument(
+            "--group",
+            choices=[DailyLeaderSnapshot.GROUP_WINNER, DailyLeaderSnapshot.GROUP_LOSER],
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=exports.EXPORT_CHUNK_SIZE,
+            help="Rows fetched and encoded per chunk.",
+        )
+        parser.add_argument("--output", default="-", help="File to write, or - for stdout.")
+
+    def handle(self, *args, **options):
+        export_format = options["format"]
+        if export_format in exports.COLUMNAR_FORMATS and exports.pa is None:
+            raise CommandError("The {} export needs pyarrow.".format(export_format))
+
+        queryset = exports.export_queryset(
+            options["start"], options["end"], options["symbol"], options["group"]
+        )
+        chunks = exports.iter_export(queryset, export_format, options["chunk_size"])
+        if options["output"] == "-":
+            self._write(chunks, sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+            return
+        with open(options["output"], "wb") as handle:
+            written = self._write(chunks, handle)
+        self.stderr.write("Wrote {} bytes to {}".format(written, options["output"]))
+
+    def _write(self, chunks, handle):
+        written = 0
+        for chunk in chunks:
+            handle.write(chunk)
+            written += len(chunk)
+        return written
@@ -0,0 +1,66 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from market.models import TrackedSymbol
+from market.services import invalidate_universe
+
+
+class Command(BaseCommand):
+    help = (
+        "Load tracked symbols from a CSV file with symbol,name,exchange,sector "
+        "columns (exchange and sector are optional)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV file with a header row.")
+        parser.add_argument(
+            "--replace",
+            action="store_true",
+            help="Deactivate tracked symbols that are not in the file.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["path"], newline="", encoding="utf-8") as handle:
+                records = list(csv.DictReader(handle))
+        except OSError as exc:
+            raise CommandError(str(exc))
+
+        symbols = {}
+        for record in records:
+            symbol = (record.get("symbol") or "").strip().upper()
+            if not symbol:
+                continue
+            symbols[symbol] = TrackedSymbol(
+                symbol=symbol,
+                name=(record.get("name") or symbol).strip(),
+                exchange=(record.get("exchange") or "").strip(),
+                sector=(record.get("sector") or "").strip(),
+                is_active=True,
+            )
+        if not symbols:
+            raise CommandError("No symbols found in {}.".format(options["path"]))
+
+        with transaction.atomic():
+            TrackedSymbol.objects.bulk_create(
+                list(symbols.values()),
+                batch_size=500,
+                update_conflicts=True,
+                unique_fields=["symbol"],
+                update_fields=["name", "exchange", "sector", "is_active"],
+            )
+            deactivated = 0
+            if options["replace"]:
+                deactivated = (
+                    TrackedSymbol.objects.filter(is_active=True)
+                    .exclude(symbol__in=list(symbols))
+                    .update(is_active=False)
+                )
+
+        # bulk_create and update() bypass the model signals.
+        invalidate_universe()
+        self.stdout.write(
+            "Loaded {} symbols, deactivated {}.".format(len(symbols), deactivated)
+        )
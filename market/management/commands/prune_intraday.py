@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone as dj_timezone
+
+from market.intraday import BAR_1H_RETENTION_DAYS, BAR_5M_RETENTION_DAYS, RAW_RETENTION_DAYS
+from market.services import get_intraday_store
+
+
+class Command(BaseCommand):
+    help = "Roll up old intraday ticks into 5-minute and hourly bars and apply retention."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--raw-days", type=int, default=RAW_RETENTION_DAYS)
+        parser.add_argument("--bar-5m-days", type=int, default=BAR_5M_RETENTION_DAYS)
+        parser.add_argument("--bar-1h-days", type=int, default=BAR_1H_RETENTION_DAYS)
+
+    def handle(self, *args, **options):
+        removed = get_intraday_store().prune(
+            dj_timezone.localdate(),
+            raw_days=options["raw_days"],
+            bar_5m_days=options["bar_5m_days"],
+            bar_1h_days=options["bar_1h_days"],
+        )
+        self.stdout.write(
+            "Rolled up {raw} raw days, dropped {bars_5m} days of 5-minute bars "
+            "and {days} expired days.".format(**removed)
+        )
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Avg, Count
+
+from market.models import DailyLeaderAggregate, DailyLeaderSnapshot
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily winner/loser aggregates from DailyLeaderSnapshot rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Aggregate rows inserted per statement.",
+        )
+
+    def handle(self, *args, **options):
+        totals = (
+            DailyLeaderSnapshot.objects.values("snapshot_date", "group")
+            .annotate(avg=Avg("change_pct"), count=Count("id"))
+            .order_by("snapshot_date", "group")
+        )
+
+        with transaction.atomic():
+            DailyLeaderAggregate.objects.all().delete()
+            created = DailyLeaderAggregate.objects.bulk_create(
+                (
+                    DailyLeaderAggregate(
+                        snapshot_date=item["snapshot_date"],
+                        group=item["group"],
+                        avg_change_pct=item["avg"],
+                        leader_count=item["count"],
+                    )
+                    for item in totals.iterator()
+                ),
+                batch_size=options["batch_size"],
+            )
+
+        self.stdout.write("Rebuilt {} daily aggregates.".format(len(created)))
@@ -0,0 +1,104 @@
+from datetime import timedelta
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.utils import timezone as dj_timezone
+
+from market import metrics, trading_calendar
+from market.services import get_intraday_store, refresh_market_snapshot
+
+# A refresh after the close that fails or is skipped is retried, backing off
+# from POST_CLOSE_RETRY_SECONDS up to POST_CLOSE_RETRY_MAX_SECONDS, until one
+# publishes; otherwise the closing prices would wait for the next open.
+POST_CLOSE_RETRY_SECONDS = 30
+POST_CLOSE_RETRY_MAX_SECONDS = 600
+
+
+def _post_close_retry_at(started_at, failures):
+    day = started_at.astimezone(trading_calendar.EXCHANGE_TZ).date()
+    hours = trading_calendar.session_hours(day)
+    if not failures or not hours or started_at < hours[1]:
+        return None
+    delay = min(POST_CLOSE_RETRY_MAX_SECONDS, POST_CLOSE_RETRY_SECONDS * 2 ** (failures - 1))
+    return started_at + timedelta(seconds=delay)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the market snapshot on a schedule and publish it to the cache. "
+        "Follows the NYSE calendar: every --interval seconds during regular hours, "
+        "once after the close (retried until it publishes), then again at the next "
+        "open."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=settings.MARKET_REFRESH_INTERVAL_SECONDS,
+            help="Seconds between the start of two refreshes while the market is open.",
+        )
+        parser.add_argument(
+            "--ignore-calendar",
+            action="store_true",
+            help="Refresh every --interval seconds around the clock.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Publish a single snapshot and exit.",
+        )
+
+    def handle(self, *args, **options):
+        interval = options["interval"]
+        pruned_on = None
+        failures = 0
+        try:
+            while True:
+                started = time.monotonic()
+                started_at = dj_timezone.now()
+                today = dj_timezone.localdate()
+                if pruned_on != today:
+                    get_intraday_store().prune(today)
+                    pruned_on = today
+
+                snapshot = refresh_market_snapshot()
+                elapsed = time.monotonic() - started
+                metrics.publish_samples(cache, "refresher")
+                published = snapshot is not None and not snapshot["error"]
+                failures = 0 if published else failures + 1
+
+                if snapshot is None:
+                    self.stdout.write("Another refresh is already in progress; skipped.")
+                elif snapshot["error"]:
+                    self.stderr.write(
+                        "Refresh finished in {:.1f}s: {}".format(elapsed, snapshot["error"])
+                    )
+                else:
+                    self.stdout.write(
+                        "Published {} rows in {:.1f}s".format(len(snapshot["frame"]), elapsed)
+                    )
+
+                if options["once"]:
+                    return
+                if options["ignore_calendar"]:
+                    time.sleep(max(0.0, interval - elapsed))
+                    continue
+                next_refresh = trading_calendar.next_refresh_at(started_at, interval)
+                retry_at = _post_close_retry_at(started_at, failures)
+                if retry_at is not None and retry_at < next_refresh:
+                    next_refresh = retry_at
+                    self.stdout.write(
+                        "Closing prices not published; retrying at {:%H:%M:%S %Z}".format(
+                            next_refresh
+                        )
+                    )
+                elif next_refresh - started_at > timedelta(seconds=interval):
+                    self.stdout.write(
+                        "Market closed; next refresh at {:%Y-%m-%d %H:%M %Z}".format(next_refresh)
+                    )
+                time.sleep(max(0.0, (next_refresh - dj_timezone.now()).total_seconds()))
+        except KeyboardInterrupt:
+            self.stdout.write("Refresher stopped.")
@@ -0,0 +1,165 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+import threading
+import time
+
+from django.db import connection
+
+# name: (type, help). Everything is kept in this process; the background
+# refresher publishes its samples through the cache (see publish_samples) so
+# the web process can expose both on /metrics.
+METRICS = {
+    "market_http_request_seconds": ("histogram", "Upstream HTTP request latency by host."),
+    "market_http_errors_total": ("counter", "Upstream HTTP requests that failed, by host."),
+    "market_provider_seconds": ("histogram", "Time for one provider to answer a refresh."),
+    "market_provider_errors_total": ("counter", "Provider calls with no rows or an error."),
+    "market_provider_rows_total": ("counter", "Rows returned by each provider."),
+    "market_provider_circuit_open": ("gauge", "1 while the provider's circuit is open."),
+    "market_snapshot_requests_total": ("counter", "Snapshot lookups by cache outcome."),
+    "market_refresh_seconds": ("histogram", "Duration of a full snapshot rebuild."),
+    "market_stage_seconds": ("histogram", "Time spent in a refresh stage."),
+    "market_stage_queries_total": ("counter", "ORM queries issued by a refresh stage."),
+    "market_stage_query_seconds_total": ("counter", "Time spent in ORM queries per stage."),
+    "market_render_seconds": ("histogram", "Template render time per view."),
+    "market_request_seconds": ("histogram", "Request handling time per view and status."),
+}
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PUBLISHED_SAMPLES_KEY = "market_metrics:{}"
+PUBLISHED_SAMPLES_SECONDS = 3600
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    slot = bisect_left(BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0, 0.0]
+        histogram[0][slot] += 1
+        histogram[1] += 1
+        histogram[2] += seconds
+
+
+@contextmanager
+def timed(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+@contextmanager
+def db_stage(stage):
+    # Counts and times this thread's ORM queries for the stage through a
+    # connection execute wrapper, plus the stage's wall time.
+    totals = [0, 0.0]
+
+    def wrapper(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            totals[0] += 1
+            totals[1] += time.perf_counter() - started
+
+    started = time.perf_counter()
+    try:
+        with connection.execute_wrapper(wrapper):
+            yield
+    finally:
+        observe("market_stage_seconds", time.perf_counter() - started, stage=stage)
+        inc("market_stage_queries_total", totals[0], stage=stage)
+        inc("market_stage_query_seconds_total", totals[1], stage=stage)
+
+
+def samples():
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "histograms": {
+                key: [list(value[0]), value[1], value[2]] for key, value in _histograms.items()
+            },
+        }
+
+
+def publish_samples(cache, source):
+    cache.set(PUBLISHED_SAMPLES_KEY.format(source), samples(), PUBLISHED_SAMPLES_SECONDS)
+
+
+def published_samples(cache, source):
+    return cache.get(PUBLISHED_SAMPLES_KEY.format(source))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{{{}}}".format(
+        ",".join(
+            '{}="{}"'.format(
+                name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            )
+            for name, value in labels
+        )
+    )
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render(sources):
+    # Prometheus text exposition format (version 0.0.4). `sources` maps a
+    # source label ("web", "refresher", ...) to a samples() dict.
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append("# HELP {} {}".format(name, help_text))
+        lines.append("# TYPE {} {}".format(name, kind))
+        for source, data in sources.items():
+            if not data:
+                continue
+            table = data[{"counter": "counters", "gauge": "gauges"}.get(kind, "histograms")]
+            for (metric, labels), value in sorted(table.items()):
+                if metric != name:
+                    continue
+                labels = (("source", source),) + labels
+                if kind != "histogram":
+                    lines.append(
+                        "{}{} {}".format(name, _format_labels(labels), _format_value(value))
+                    )
+                    continue
+                counts, count, total = value
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    lines.append(
+                        "{}_bucket{} {}".format(
+                            name, _format_labels(labels + (("le", bound),)), cumulative
+                        )
+                    )
+                lines.append("{}_count{} {}".format(name, _format_labels(labels), count))
+                lines.append("{}_sum{} {}".format(name, _format_labels(labels), repr(total)))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("market", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="dailyleadersnapshot",
+            index=models.Index(
+                fields=["symbol", "snapshot_date"],
+                name="market_leader_symbol_date_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,64 @@
+from django.db import migrations, models
+from django.db.models import Avg, Count
+
+
+def populate_aggregates(apps, schema_editor):
+    DailyLeaderSnapshot = apps.get_model("market", "DailyLeaderSnapshot")
+    DailyLeaderAggregate = apps.get_model("market", "DailyLeaderAggregate")
+    totals = (
+        DailyLeaderSnapshot.objects.values("snapshot_date", "group")
+        .annotate(avg=Avg("change_pct"), count=Count("id"))
+        .order_by()
+    )
+    DailyLeaderAggregate.objects.bulk_create(
+        (
+            DailyLeaderAggregate(
+                snapshot_date=item["snapshot_date"],
+                group=item["group"],
+                avg_change_pct=item["avg"],
+                leader_count=item["count"],
+            )
+            for item in totals.iterator()
+        ),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("market", "0002_dailyleadersnapshot_symbol_date_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyLeaderAggregate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("snapshot_date", models.DateField()),
+                (
+                    "group",
+                    models.CharField(
+                        choices=[("winner", "Winner"), ("loser", "Loser")],
+                        max_length=10,
+                    ),
+                ),
+                ("avg_change_pct", models.DecimalField(decimal_places=4, max_digits=9)),
+                ("leader_count", models.PositiveIntegerField()),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "ordering": ["-snapshot_date", "group"],
+                "unique_together": {("snapshot_date", "group")},
+            },
+        ),
+        migrations.RunPython(populate_aggregates, migrations.RunPython.noop),
+    ]
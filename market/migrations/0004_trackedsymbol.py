@@ -0,0 +1,68 @@
+from django.db import migrations, models
+
+INITIAL_UNIVERSE = [
+    ("AAPL", "Apple Inc.", "NASDAQ", "Information Technology"),
+    ("MSFT", "Microsoft Corp.", "NASDAQ", "Information Technology"),
+    ("GOOGL", "Alphabet Inc.", "NASDAQ", "Communication Services"),
+    ("AMZN", "Amazon.com Inc.", "NASDAQ", "Consumer Discretionary"),
+    ("NVDA", "NVIDIA Corp.", "NASDAQ", "Information Technology"),
+    ("META", "Meta Platforms Inc.", "NASDAQ", "Communication Services"),
+    ("TSLA", "Tesla Inc.", "NASDAQ", "Consumer Discretionary"),
+    ("JPM", "JPMorgan Chase & Co.", "NYSE", "Financials"),
+    ("V", "Visa Inc.", "NYSE", "Financials"),
+    ("JNJ", "Johnson & Johnson", "NYSE", "Health Care"),
+    ("PG", "Procter & Gamble Co.", "NYSE", "Consumer Staples"),
+    ("MA", "Mastercard Inc.", "NYSE", "Financials"),
+    ("HD", "Home Depot Inc.", "NYSE", "Consumer Discretionary"),
+    ("CVX", "Chevron Corp.", "NYSE", "Energy"),
+    ("MRK", "Merck & Co.", "NYSE", "Health Care"),
+    ("KO", "Coca-Cola Co.", "NYSE", "Consumer Staples"),
+    ("BAC", "Bank of America Corp.", "NYSE", "Financials"),
+    ("WMT", "Walmart Inc.", "NYSE", "Consumer Staples"),
+    ("NFLX", "Netflix Inc.", "NASDAQ", "Communication Services"),
+    ("AMD", "Advanced Micro Devices Inc.", "NASDAQ", "Information Technology"),
+]
+
+
+def seed_universe(apps, schema_editor):
+    TrackedSymbol = apps.get_model("market", "TrackedSymbol")
+    TrackedSymbol.objects.bulk_create(
+        [
+            TrackedSymbol(symbol=symbol, name=name, exchange=exchange, sector=sector)
+            for symbol, name, exchange, sector in INITIAL_UNIVERSE
+        ],
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("market", "0003_dailyleaderaggregate"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TrackedSymbol",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("symbol", models.CharField(max_length=16, unique=True)),
+                ("name", models.CharField(max_length=128)),
+                ("exchange", models.CharField(blank=True, max_length=16)),
+                ("sector", models.CharField(blank=True, max_length=64)),
+                ("is_active", models.BooleanField(db_index=True, default=True)),
+            ],
+            options={
+                "ordering": ["symbol"],
+            },
+        ),
+        migrations.RunPython(seed_universe, migrations.RunPython.noop),
+    ]
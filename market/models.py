@@ -1,6 +1,17 @@
 from django.db import models
 
 
+class TrackedSymbol(models.Model):
+    symbol = models.CharField(max_length=16, unique=True)
+    name = models.CharField(max_length=128)
+    exchange = models.CharField(max_length=16, blank=True)
+    sector = models.CharField(max_length=64, blank=True)
+    is_active = models.BooleanField(default=True, db_index=True)
+
+    class Meta:
+        ordering = ["symbol"]
+
+
 class DailyLeaderSnapshot(models.Model):
     GROUP_WINNER = "winner"
     GROUP_LOSER = "loser"
@@ -19,5 +30,19 @@ class DailyLeaderSnapshot(models.Model):
 
     class Meta:
         unique_together = (("snapshot_date", "symbol", "group"),)
+        indexes = [
+            models.Index(fields=["symbol", "snapshot_date"], name="market_leader_symbol_date_idx"),
+        ]
         ordering = ["-snapshot_date", "group", "symbol"]
 
+
+class DailyLeaderAggregate(models.Model):
+    snapshot_date = models.DateField()
+    group = models.CharField(max_length=10, choices=DailyLeaderSnapshot.GROUP_CHOICES)
+    avg_change_pct = models.DecimalField(max_digits=9, decimal_places=4)
+    leader_count = models.PositiveIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (("snapshot_date", "group"),)
+        ordering = ["-snapshot_date", "group"]
@@ -0,0 +1,96 @@
+import gzip
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # optional: gzip alone is served when brotli is missing
+    brotli = None
+
+PAGE_CACHE_KEY = "market_page:{}"
+PAGE_CACHE_SECONDS = 3600
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+
+def page_key(snapshot, *parts):
+    # Keyed by snapshot version, so publishing a new snapshot moves every
+    # page to a fresh key. The error text is folded in because a stale
+    # snapshot can be re-served with a warning under the same version.
+    error_crc = zlib.crc32(snapshot.get("error", "").encode("utf-8"))
+    return "{}-{}-{:08x}".format(
+        snapshot.get("version", 0), "-".join(str(part) for part in parts), error_crc
+    )
+
+
+def _compress(body):
+    variants = {"identity": body, "gzip": gzip.compress(body, compresslevel=GZIP_LEVEL)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+    return variants
+
+
+def get_page(key, render_body, cacheable=True):
+    if not cacheable:
+        return {"identity": render_body()}
+    cache_key = PAGE_CACHE_KEY.format(key)
+    variants = cache.get(cache_key)
+    if variants is None:
+        variants = _compress(render_body())
+        cache.set(cache_key, variants, PAGE_CACHE_SECONDS)
+    return variants
+
+
+async def aget_page(key, render_body, cacheable=True):
+    # Rendering and compression are CPU work on sync code (templates, ORM),
+    # so only they leave the event loop.
+    if not cacheable:
+        return {"identity": await sync_to_async(render_body)()}
+    cache_key = PAGE_CACHE_KEY.format(key)
+    variants = await cache.aget(cache_key)
+    if variants is None:
+        variants = await sync_to_async(lambda: _compress(render_body()))()
+        await cache.aset(cache_key, variants, PAGE_CACHE_SECONDS)
+    return variants
+
+
+def _accepted_encodings(request):
+    accepted = set()
+    for item in request.headers.get("Accept-Encoding", "").split(","):
+        name, _, params = item.partition(";")
+        params = params.strip().replace(" ", "")
+        quality = 1.0
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if quality > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def page_response(request, key, variants, content_type="text/html; charset=utf-8"):
+    accepted = _accepted_encodings(request)
+    encoding = "identity"
+    for candidate in ("br", "gzip"):
+        if candidate in variants and candidate in accepted:
+            encoding = candidate
+            break
+
+    # Each encoded body is its own representation, so it gets its own ETag.
+    etag = '"{}-{}"'.format(key, encoding)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(variants[encoding], content_type=content_type)
+        if encoding != "identity":
+            response["Content-Encoding"] = encoding
+        response["Content-Length"] = str(len(variants[encoding]))
+    response["ETag"] = etag
+    response["Cache-Control"] = "no-cache"
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
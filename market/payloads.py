@@ -0,0 +1,45 @@
+import json
+
+from .indicators import add_indicators
+from .services import company_names, get_snapshot_frame, get_universe
+
+
+def snapshot_etag(snapshot):
+    return '"{}{}"'.format(snapshot.get("version", 0), "-e" if snapshot.get("error") else "")
+
+
+def snapshot_payload(snapshot, since=None):
+    # JSON-ready view of a published snapshot. With `since`, only rows that
+    # changed after that version are included, when that version is still
+    # known; otherwise the full table is sent and `delta` is False.
+    frame = snapshot.get("frame")
+    names = company_names(get_universe())
+    payload = {
+        "version": snapshot.get("version", 0),
+        "generated_at": snapshot["generated_at"].isoformat(),
+        "error": snapshot.get("error", ""),
+        "session": snapshot.get("session"),
+        "breadth": snapshot.get("breadth"),
+        "sector_breadth": snapshot.get("sector_breadth", []),
+        "top_gainers": snapshot["top_gainers"],
+        "top_losers": snapshot["top_losers"],
+        "history_days": snapshot.get("history_days"),
+        "history_chart": json.loads(snapshot["history_chart_json"]),
+        "delta": False,
+        "removed": [],
+    }
+    if frame is None:
+        payload["stocks"] = snapshot.get("stocks", [])
+        return payload
+
+    base = get_snapshot_frame(since) if since else None
+    if base is not None:
+        changed, removed = frame.changed_since(base)
+        payload["stocks"] = add_indicators(
+            frame.to_rows(names, changed), snapshot.get("indicators"), changed
+        )
+        payload["removed"] = removed
+        payload["delta"] = True
+    else:
+        payload["stocks"] = add_indicators(frame.to_rows(names), snapshot.get("indicators"))
+    return payload
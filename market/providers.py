@@ -0,0 +1,223 @@
+import asyncio
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import threading
+import time
+
+from . import metrics
+from .columnar import SnapshotFrame
+
+STATS_WINDOW = 50
+FAILURE_THRESHOLD = 3
+COOLDOWN_SECONDS = 60
+HEDGE_DEFAULT_SECONDS = 2.0
+HEDGE_MIN_SECONDS = 0.5
+ORCHESTRATION_DEADLINE_SECONDS = 25
+# Errors and timeouts always count as failures. An empty answer only does
+# when at least this many symbols were asked for: a fill-in call for a
+# delisted symbol or two legitimately comes back empty every time.
+EMPTY_FRAME_MIN_SYMBOLS = 10
+
+# Provider calls run here rather than on the caller's thread, so a hedged
+# primary that is still hanging can finish (and be measured) on its own.
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="market-provider")
+
+
+class ProviderStats:
+    # Rolling latency/error window plus a consecutive-failure circuit breaker.
+    # An open circuit skips the provider until COOLDOWN_SECONDS pass; the next
+    # call is a trial, and another failure opens it again.
+
+    def __init__(self, window=STATS_WINDOW):
+        self._latencies = deque(maxlen=window)
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.calls = 0
+        self.failures = 0
+
+    def record(self, latency, ok):
+        with self._lock:
+            self.calls += 1
+            self._latencies.append(latency)
+            self._outcomes.append(ok)
+            if ok:
+                self.consecutive_failures = 0
+                self.open_until = 0.0
+                return
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= FAILURE_THRESHOLD:
+                self.open_until = time.monotonic() + COOLDOWN_SECONDS
+
+    def available(self):
+        return time.monotonic() >= self.open_until
+
+    def p95(self, default=HEDGE_DEFAULT_SECONDS):
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return default
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def error_rate(self):
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return 1 - sum(self._outcomes) / len(self._outcomes)
+
+
+class Provider:
+    def __init__(self, name, fetch, errors, afetch=None):
+        self.name = name
+        self.fetch = fetch
+        self.errors = errors
+        self.afetch = afetch
+        self.stats = ProviderStats()
+
+    def __call__(self, universe):
+        started = time.monotonic()
+        try:
+            frame = self.fetch(universe)
+        except self.errors:
+            self._record(started, None)
+            return SnapshotFrame.empty()
+        except Exception:
+            self._record(started, None)
+            raise
+        self._record(started, frame, len(universe))
+        return frame
+
+    async def acall(self, client, universe):
+        started = time.monotonic()
+        try:
+            frame = await self.afetch(client, universe)
+        except self.errors:
+            self._record(started, None)
+            return SnapshotFrame.empty()
+        except Exception:
+            # Cancellation is not caught: a hedge that lost the race says
+            # nothing about the provider, and fetch_frame_async records the
+            # ones that ran out of time.
+            self._record(started, None)
+            raise
+        self._record(started, frame, len(universe))
+        return frame
+
+    def _record(self, started, frame, requested=0):
+        elapsed = time.monotonic() - started
+        ok = frame is not None and (bool(len(frame)) or requested < EMPTY_FRAME_MIN_SYMBOLS)
+        self.stats.record(elapsed, ok)
+        metrics.observe("market_provider_seconds", elapsed, provider=self.name)
+        if ok:
+            metrics.inc("market_provider_rows_total", len(frame), provider=self.name)
+        else:
+            metrics.inc("market_provider_errors_total", provider=self.name)
+        metrics.set_gauge(
+            "market_provider_circuit_open", int(not self.stats.available()), provider=self.name
+        )
+
+
+def _missing(universe, frame):
+    have = set(frame.symbols.tolist())
+    return [item for item in universe if item["symbol"] not in have]
+
+
+def fetch_frame(providers, universe, deadline=ORCHESTRATION_DEADLINE_SECONDS):
+    # Ask the healthiest provider first. If it has not answered by its own p95
+    # latency, hedge with the next one. Whichever answers first wins per
+    # symbol; every answer that still leaves gaps sends just the missing
+    # symbols to the next fallback, so nothing waits on a hanging provider.
+    symbols = [item["symbol"] for item in universe]
+    stop_at = time.monotonic() + deadline
+    queue = [provider for provider in providers if provider.stats.available()]
+    queue = queue or list(providers)
+    frame = SnapshotFrame.empty()
+    failure = None
+
+    primary = queue.pop(0)
+    pending = {_executor.submit(primary, universe)}
+    done, _ = wait(pending, timeout=max(HEDGE_MIN_SECONDS, primary.stats.p95()))
+    if not done and queue:
+        pending.add(_executor.submit(queue.pop(0), universe))
+
+    while pending and time.monotonic() < stop_at:
+        done, pending = wait(
+            pending, timeout=stop_at - time.monotonic(), return_when=FIRST_COMPLETED
+        )
+        for future in done:
+            try:
+                frame = frame.merged(future.result())
+            except Exception as exc:
+                failure = exc
+        missing = _missing(universe, frame)
+        if not missing:
+            break
+        if done and queue:
+            pending.add(_executor.submit(queue.pop(0), missing))
+
+    if not len(frame) and failure is not None:
+        raise failure
+    return frame.ordered(symbols)
+
+
+async def fetch_frame_async(
+    providers, universe, client, deadline=ORCHESTRATION_DEADLINE_SECONDS
+):
+    # fetch_frame for the event loop: the same hedging and per-symbol filling,
+    # with tasks instead of threads. Anything still running at the end is
+    # cancelled, since `client` is closed once the refresh returns.
+    symbols = [item["symbol"] for item in universe]
+    stop_at = time.monotonic() + deadline
+    providers = [provider for provider in providers if provider.afetch is not None]
+    queue = [provider for provider in providers if provider.stats.available()]
+    queue = queue or providers
+    frame = SnapshotFrame.empty()
+    failure = None
+
+    started = {}
+
+    def start(provider, items):
+        task = asyncio.ensure_future(provider.acall(client, items))
+        started[task] = (provider, time.monotonic())
+        return task
+
+    primary = queue.pop(0)
+    pending = {start(primary, universe)}
+    try:
+        done, _ = await asyncio.wait(
+            pending, timeout=max(HEDGE_MIN_SECONDS, primary.stats.p95())
+        )
+        if not done and queue:
+            pending.add(start(queue.pop(0), universe))
+
+        while pending and time.monotonic() < stop_at:
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=stop_at - time.monotonic(),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                try:
+                    frame = frame.merged(task.result())
+                except Exception as exc:
+                    failure = exc
+            missing = _missing(universe, frame)
+            if not missing:
+                break
+            if done and queue:
+                pending.add(start(queue.pop(0), missing))
+    finally:
+        # Tasks still running past the deadline timed out; the others were
+        # superseded by a faster answer and are not held against anyone.
+        timed_out = time.monotonic() >= stop_at
+        for task in pending:
+            task.cancel()
+            if timed_out:
+                provider, began = started[task]
+                provider._record(began, None)
+
+    if not len(frame) and failure is not None:
+        raise failure
+    return frame.ordered(symbols)
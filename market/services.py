@@ -1,120 +1,344 @@
-import csv
-from datetime import datetime, timezone
-import io
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures import as_completed
+from datetime import date, datetime, timedelta, timezone
 import json
+import math
+import random
 import socket
 import ssl
+import time
 from urllib.error import HTTPError, URLError
 from urllib.parse import quote
-from urllib.request import Request
-from urllib.request import urlopen
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.cache import cache
-from django.db.models import Avg
+from django.db import transaction
+from django.db.models import Avg, Count, F, Window
+from django.db.models.functions import RowNumber
 from django.utils import timezone as dj_timezone
 
-from .models import DailyLeaderSnapshot
-
-UNIVERSE = [
-    "AAPL", "MSFT", "GOOGL", "AMZN", "NVDA",
-    "META", "TSLA", "JPM", "V", "JNJ",
-    "PG", "MA", "HD", "CVX", "MRK",
-    "KO", "BAC", "WMT", "NFLX", "AMD",
-]
-
-COMPANY_NAMES = {
-    "AAPL": "Apple Inc.",
-    "MSFT": "Microsoft Corp.",
-    "GOOGL": "Alphabet Inc.",
-    "AMZN": "Amazon.com Inc.",
-    "NVDA": "NVIDIA Corp.",
-    "META": "Meta Platforms Inc.",
-    "TSLA": "Tesla Inc.",
-    "JPM": "JPMorgan Chase & Co.",
-    "V": "Visa Inc.",
-    "JNJ": "Johnson & Johnson",
-    "PG": "Procter & Gamble Co.",
-    "MA": "Mastercard Inc.",
-    "HD": "Home Depot Inc.",
-    "CVX": "Chevron Corp.",
-    "MRK": "Merck & Co.",
-    "KO": "Coca-Cola Co.",
-    "BAC": "Bank of America Corp.",
-    "WMT": "Walmart Inc.",
-    "NFLX": "Netflix Inc.",
-    "AMD": "Advanced Micro Devices Inc.",
-}
+from . import http_client, metrics, trading_calendar
+from .columnar import SnapshotFrame
+from .indicators import RANGE_MIN_DAYS, WINDOW_DAYS, IndicatorEngine
+from .intraday import IntradayStore
+from .locks import (
+    acquire_cache_lock,
+    acquire_file_lock,
+    release_cache_lock,
+    release_file_lock,
+    supports_atomic_add,
+)
+from .models import DailyLeaderAggregate, DailyLeaderSnapshot, TrackedSymbol
+from .providers import Provider, fetch_frame, fetch_frame_async
+from .stooq_store import StooqHistoryStore, parse_daily_csv
+
+UNIVERSE_VERSION_KEY = "market_universe_version"
+UNIVERSE_CACHE_TIMEOUT_SECONDS = 86400
+LEADER_COUNT = 10
 
 CACHE_KEY = "market_snapshot"
+# While the market is open; otherwise a snapshot stays fresh until the next
+# refresh point of the trading calendar (post-close or next open).
 CACHE_TIMEOUT_SECONDS = 600
+STALE_CACHE_TIMEOUT_SECONDS = 86400
 STALE_CACHE_KEY = "market_snapshot_stale"
+REFRESH_LOCK_KEY = "market_refresh_lock"
+REFRESH_LOCK_FILE = "refresh.lock"
+REFRESH_LOCK_TIMEOUT_SECONDS = 60
+EARLY_EXPIRY_BETA = 1.0
+HISTORY_WINDOW_CHOICES = (30, 90, 365)
+# Recent frames stay addressable by version so clients can ask for the rows
+# that changed since the snapshot they already have.
+FRAME_HISTORY_KEY = "market_snapshot_frame:{}"
+FRAME_HISTORY_SECONDS = 3600
+HISTORY_CHART_CACHE_KEY = "market_history_chart:{}:{}"
+
+# Per-symbol providers fan out over a bounded pool. Each call gets its own
+# socket timeout and the whole refresh gets a hard deadline; symbols that have
+# not answered by then are dropped from this refresh instead of blocking it.
+FETCH_MAX_WORKERS = 8
+STOOQ_TIMEOUT_SECONDS = 4
+YAHOO_TIMEOUT_SECONDS = 6
+REFRESH_DEADLINE_SECONDS = 15
+# Yahoo rejects very long quote URLs, so large universes are split into
+# shards of at most this many symbols, fetched concurrently.
+QUOTE_SYMBOLS_PER_REQUEST = 150
+# Symbols without a year of daily closes get their history (from the Stooq
+# store when it has it, else a one-year Yahoo chart) a batch per refresh, in
+# the background once the snapshot is published.
+INDICATOR_SEED_SYMBOLS = 100
+INDICATOR_SEED_DEADLINE_SECONDS = 5
+INDICATOR_SEED_LOCK_WAIT_SECONDS = 10
+
+FETCH_ERRORS = (HTTPError, URLError, ssl.SSLError, socket.timeout, TimeoutError, ValueError)
+
+
+_universe_memo = {}
+
+
+def _new_universe_version():
+    # Versions start at a random point rather than 1, so a version key that
+    # was lost (evicted, cache cleared) does not reuse the number of a
+    # universe that is still cached.
+    return random.getrandbits(48)
+
+
+def _universe_version():
+    return cache.get_or_set(UNIVERSE_VERSION_KEY, _new_universe_version, None)
+
+
+def get_universe():
+    # Loaded from the database once per universe version; processes keep a
+    # local copy and only re-read the shared cache when the version moves.
+    version = _universe_version()
+    universe = _universe_memo.get(version)
+    if universe is not None:
+        return universe
+
+    key = "market_universe:v{}".format(version)
+    universe = cache.get(key)
+    if universe is None:
+        universe = list(
+            TrackedSymbol.objects.filter(is_active=True)
+            .order_by("symbol")
+            .values("symbol", "name", "exchange", "sector")
+        )
+        cache.set(key, universe, UNIVERSE_CACHE_TIMEOUT_SECONDS)
 
+    _universe_memo.clear()
+    _universe_memo[version] = universe
+    return universe
 
-def _fetch_last_two_closes_stooq(symbol):
-    url = "http://stooq.com/q/d/l/?s={}&i=d".format(symbol.lower() + ".us")
-    with urlopen(url, timeout=4) as resp:
-        text = resp.read().decode("utf-8", errors="ignore")
 
-    parsed_rows = list(csv.DictReader(io.StringIO(text)))
-    parsed_rows = [
-        row for row in parsed_rows if row.get("Close") and row["Close"] != "N/D"
-    ]
-    if len(parsed_rows) < 2:
-        return None
+async def aget_universe():
+    version = await cache.aget_or_set(UNIVERSE_VERSION_KEY, _new_universe_version, None)
+    universe = _universe_memo.get(version)
+    if universe is not None:
+        return universe
+
+    key = "market_universe:v{}".format(version)
+    universe = await cache.aget(key)
+    if universe is None:
+        universe = [
+            item
+            async for item in TrackedSymbol.objects.filter(is_active=True)
+            .order_by("symbol")
+            .values("symbol", "name", "exchange", "sector")
+        ]
+        await cache.aset(key, universe, UNIVERSE_CACHE_TIMEOUT_SECONDS)
+
+    _universe_memo.clear()
+    _universe_memo[version] = universe
+    return universe
+
+
+def invalidate_universe():
+    try:
+        cache.incr(UNIVERSE_VERSION_KEY)
+    except ValueError:
+        cache.set(UNIVERSE_VERSION_KEY, _new_universe_version(), None)
+
+
+def company_names(universe):
+    return {item["symbol"]: item["name"] for item in universe}
+
+
+def _fetch_concurrently(fetch, symbols, timeout, deadline=REFRESH_DEADLINE_SECONDS):
+    results = {}
+    if not symbols:
+        return results
+
+    executor = ThreadPoolExecutor(max_workers=min(FETCH_MAX_WORKERS, len(symbols)))
+    futures = {executor.submit(fetch, symbol, timeout): symbol for symbol in symbols}
+    try:
+        for future in as_completed(futures, timeout=deadline):
+            try:
+                value = future.result()
+            except FETCH_ERRORS:
+                continue
+            if value:
+                results[futures[future]] = value
+    except FuturesTimeoutError:
+        pass
+    finally:
+        # Do not wait for stragglers: their sockets time out on their own.
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
+async def _afetch_concurrently(fetch, symbols, timeout, deadline=REFRESH_DEADLINE_SECONDS):
+    # Same contract as _fetch_concurrently with one task per item instead of a
+    # thread; the client's per-host connection limit bounds the concurrency.
+    results = {}
+    if not symbols:
+        return results
+
+    tasks = {asyncio.ensure_future(fetch(symbol, timeout)): symbol for symbol in symbols}
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in pending:
+        task.cancel()
+    for task in done:
+        try:
+            value = task.result()
+        except FETCH_ERRORS:
+            continue
+        if value:
+            results[tasks[task]] = value
+    return results
+
+
+_stooq_store = None
+
+
+def _get_stooq_store():
+    global _stooq_store
+    if _stooq_store is None:
+        _stooq_store = StooqHistoryStore(settings.MARKET_DATA_DIR / "stooq")
+    return _stooq_store
+
+
+_intraday_store = None
+
+
+def get_intraday_store():
+    global _intraday_store
+    if _intraday_store is None:
+        _intraday_store = IntradayStore(settings.MARKET_DATA_DIR / "intraday")
+    return _intraday_store
+
+
+_indicator_engine = None
+
+
+def get_indicator_engine():
+    # Only used while holding the refresh lock; the engine reloads its files
+    # when another process has saved them since.
+    global _indicator_engine
+    if _indicator_engine is None:
+        _indicator_engine = IndicatorEngine(settings.MARKET_DATA_DIR / "indicators")
+    return _indicator_engine
 
-    parsed_rows.sort(key=lambda row: row["Date"])
-    prev_close = float(parsed_rows[-2]["Close"])
-    last_price = float(parsed_rows[-1]["Close"])
+
+def _last_two_closes(closes):
+    if len(closes) < 2:
+        return None
+    prev_close = float(closes[-2])
+    last_price = float(closes[-1])
     if prev_close == 0:
         return None
     return prev_close, last_price
 
 
-def _build_rows_stooq():
-    rows = []
-    for symbol in UNIVERSE:
+def _stooq_url(symbol, last_day=None):
+    # Closes are kept on disk per symbol; only days from the last stored one
+    # onwards are downloaded, so a warm fetch is a few CSV lines.
+    url = "{}/q/d/l/?s={}&i=d".format(settings.MARKET_STOOQ_URL, symbol.lower() + ".us")
+    if last_day is not None:
+        url += "&d1={}&d2={}".format(
+            last_day.strftime("%Y%m%d"), dj_timezone.localdate().strftime("%Y%m%d")
+        )
+    return url
+
+
+def _stooq_last_two_closes(symbol, body):
+    store = _get_stooq_store()
+    store.merge(symbol, parse_daily_csv(body))
+    return _last_two_closes(store.tail(symbol, 2)["close"])
+
+
+def _stooq_last_days(symbols):
+    store = _get_stooq_store()
+    return {symbol: store.last_day(symbol) for symbol in symbols}
+
+
+def _stooq_fetch_order(last_days):
+    # Stooq is rate limited (MARKET_HTTP_RATE_LIMITS), so one refresh reaches
+    # at most rate x REFRESH_DEADLINE_SECONDS symbols, 150 at the defaults.
+    # The stalest go first, so the ones cut off by the deadline lead the next
+    # refresh instead of the same tail of the universe always missing.
+    return sorted(last_days, key=lambda symbol: last_days[symbol] or date.min)
+
+
+def _stooq_merge_closes(bodies):
+    closes = {}
+    for symbol, body in bodies.items():
         try:
-            values = _fetch_last_two_closes_stooq(symbol)
-            if not values:
-                continue
-            prev_close, last_price = values
-            change_pct = ((last_price - prev_close) / prev_close) * 100
-            rows.append(
-                {
-                    "symbol": symbol,
-                    "company_name": COMPANY_NAMES.get(symbol, symbol),
-                    "price": round(last_price, 2),
-                    "previous_close": round(prev_close, 2),
-                    "change_pct": round(change_pct, 2),
-                }
-            )
-        except (HTTPError, URLError, ssl.SSLError, socket.timeout, TimeoutError, ValueError):
+            value = _stooq_last_two_closes(symbol, body)
+        except FETCH_ERRORS:
             continue
-    return rows
+        if value:
+            closes[symbol] = value
+    return closes
 
 
-def _build_rows_yahoo_quote():
-    symbols = ",".join(UNIVERSE)
-    url = "https://query1.finance.yahoo.com/v7/finance/quote?symbols={}".format(
-        quote(symbols)
+def _fetch_last_two_closes_stooq(symbol, timeout=STOOQ_TIMEOUT_SECONDS):
+    url = _stooq_url(symbol, _get_stooq_store().last_day(symbol))
+    return _stooq_last_two_closes(symbol, http_client.get(url, timeout=timeout))
+
+
+def _build_rows_stooq(universe):
+    symbols = [item["symbol"] for item in universe]
+    closes = _fetch_concurrently(
+        _fetch_last_two_closes_stooq,
+        _stooq_fetch_order(_stooq_last_days(symbols)),
+        timeout=STOOQ_TIMEOUT_SECONDS,
     )
-    req = Request(
-        url,
-        headers={
-            "User-Agent": (
-                "Mozilla/5.0 (X11; Linux x86_64) "
-                "AppleWebKit/537.36 Safari/537.36"
-            )
-        },
+    return SnapshotFrame.from_closes(symbols, closes)
+
+
+async def _abuild_rows_stooq(client, universe):
+    # Only the downloads run on the event loop. The store is read before
+    # them and the CSVs are parsed and merged after them, one batch each in
+    # a worker thread.
+    symbols = [item["symbol"] for item in universe]
+    last_days = await sync_to_async(_stooq_last_days)(symbols)
+
+    async def fetch(symbol, timeout):
+        return await client.get(_stooq_url(symbol, last_days[symbol]), timeout=timeout)
+
+    bodies = await _afetch_concurrently(
+        fetch, _stooq_fetch_order(last_days), timeout=STOOQ_TIMEOUT_SECONDS
     )
-    with urlopen(req, timeout=6) as resp:
-        payload = json.loads(resp.read().decode("utf-8", errors="ignore"))
-
-    results = payload.get("quoteResponse", {}).get("result", [])
-    rows = []
-    for item in results:
-        symbol = item.get("symbol")
-        if symbol not in UNIVERSE:
+    closes = await sync_to_async(_stooq_merge_closes)(bodies)
+    return SnapshotFrame.from_closes(symbols, closes)
+
+
+def _yahoo_quote_url(symbols):
+    return "{}/v7/finance/quote?symbols={}".format(
+        settings.MARKET_YAHOO_QUOTE_URL, quote(",".join(symbols))
+    )
+
+
+def _yahoo_quote_results(body):
+    payload = json.loads(body.decode("utf-8", errors="ignore"))
+    return payload.get("quoteResponse", {}).get("result", [])
+
+
+def _fetch_yahoo_quotes(symbols, timeout=YAHOO_TIMEOUT_SECONDS):
+    return _yahoo_quote_results(http_client.get(_yahoo_quote_url(symbols), timeout=timeout))
+
+
+def _yahoo_quote_shards(universe):
+    symbols = [item["symbol"] for item in universe]
+    return [
+        tuple(symbols[start:start + QUOTE_SYMBOLS_PER_REQUEST])
+        for start in range(0, len(symbols), QUOTE_SYMBOLS_PER_REQUEST)
+    ]
+
+
+def _yahoo_quotes_frame(universe, results):
+    quotes = {}
+    for shard_results in results.values():
+        for item in shard_results:
+            quotes[item.get("symbol")] = item
+
+    present, prices, prev_closes, changes = [], [], [], []
+    for symbol in (item["symbol"] for item in universe):
+        item = quotes.get(symbol)
+        if item is None:
             continue
 
         price = item.get("regularMarketPrice")
@@ -123,92 +347,216 @@ def _build_rows_yahoo_quote():
         if price is None or prev_close in (None, 0) or change_pct is None:
             continue
 
-        rows.append(
-            {
-                "symbol": symbol,
-                "company_name": COMPANY_NAMES.get(symbol, item.get("shortName", symbol)),
-                "price": round(float(price), 2),
-                "previous_close": round(float(prev_close), 2),
-                "change_pct": round(float(change_pct), 2),
-            }
+        present.append(symbol)
+        prices.append(price)
+        prev_closes.append(prev_close)
+        changes.append(change_pct)
+    return SnapshotFrame(present, prices, prev_closes, changes)
+
+
+def _build_rows_yahoo_quote(universe):
+    shards = _yahoo_quote_shards(universe)
+    if len(shards) == 1:
+        results = {shards[0]: _fetch_yahoo_quotes(shards[0])}
+    else:
+        results = _fetch_concurrently(
+            _fetch_yahoo_quotes, shards, timeout=YAHOO_TIMEOUT_SECONDS
         )
-    return rows
+    return _yahoo_quotes_frame(universe, results)
 
 
-def _fetch_last_two_closes_yahoo_chart(symbol):
-    url = "https://query2.finance.yahoo.com/v8/finance/chart/{}?interval=1d&range=10d".format(
-        symbol
-    )
-    req = Request(
-        url,
-        headers={
-            "User-Agent": (
-                "Mozilla/5.0 (X11; Linux x86_64) "
-                "AppleWebKit/537.36 Safari/537.36"
-            )
-        },
+async def _abuild_rows_yahoo_quote(client, universe):
+    async def fetch(shard, timeout):
+        return _yahoo_quote_results(await client.get(_yahoo_quote_url(shard), timeout=timeout))
+
+    shards = _yahoo_quote_shards(universe)
+    if len(shards) == 1:
+        results = {shards[0]: await fetch(shards[0], YAHOO_TIMEOUT_SECONDS)}
+    else:
+        results = await _afetch_concurrently(fetch, shards, timeout=YAHOO_TIMEOUT_SECONDS)
+    return _yahoo_quotes_frame(universe, results)
+
+
+def _yahoo_chart_url(symbol, history_range="10d"):
+    return "{}/v8/finance/chart/{}?interval=1d&range={}".format(
+        settings.MARKET_YAHOO_CHART_URL, symbol, history_range
     )
-    with urlopen(req, timeout=6) as resp:
-        payload = json.loads(resp.read().decode("utf-8", errors="ignore"))
+
+
+def _yahoo_chart_history(body):
+    # (days, closes) of the daily bars with a close; days is None when the
+    # response carries no timestamps.
+    payload = json.loads(body.decode("utf-8", errors="ignore"))
 
     results = payload.get("chart", {}).get("result")
     if not results:
-        return None
+        return None, []
 
     quote = results[0].get("indicators", {}).get("quote", [])
     if not quote or "close" not in quote[0]:
-        return None
+        return None, []
+
+    closes = quote[0]["close"]
+    timestamps = results[0].get("timestamp")
+    if timestamps is None or len(timestamps) != len(closes):
+        return None, [float(value) for value in closes if value is not None]
+    bars = [
+        (datetime.fromtimestamp(stamp, timezone.utc).date(), float(value))
+        for stamp, value in zip(timestamps, closes)
+        if value is not None
+    ]
+    return [day for day, _ in bars], [close for _, close in bars]
 
-    closes = [value for value in quote[0]["close"] if value is not None]
-    if len(closes) < 2:
-        return None
 
-    prev_close = float(closes[-2])
-    last_price = float(closes[-1])
-    if prev_close == 0:
+def _yahoo_chart_last_two_closes(body):
+    return _last_two_closes(_yahoo_chart_history(body)[1])
+
+
+def _seed_from_chart(symbol, body):
+    # Only sessions before the current one go into the indicator history.
+    days, closes = _yahoo_chart_history(body)
+    if days is None:
         return None
-    return prev_close, last_price
+    current = trading_calendar.session_date(dj_timezone.now())
+    get_indicator_engine().seed(
+        symbol, [close for day, close in zip(days, closes) if day < current]
+    )
+    return _last_two_closes(closes)
 
 
-def _build_rows_yahoo_chart():
-    rows = []
-    for symbol in UNIVERSE:
-        try:
-            values = _fetch_last_two_closes_yahoo_chart(symbol)
-            if not values:
-                continue
-            prev_close, last_price = values
-            change_pct = ((last_price - prev_close) / prev_close) * 100
-            rows.append(
-                {
-                    "symbol": symbol,
-                    "company_name": COMPANY_NAMES.get(symbol, symbol),
-                    "price": round(last_price, 2),
-                    "previous_close": round(prev_close, 2),
-                    "change_pct": round(change_pct, 2),
-                }
-            )
-        except (HTTPError, URLError, ssl.SSLError, socket.timeout, TimeoutError, ValueError):
-            continue
-    return rows
+def _chart_history_wanted(symbols):
+    # The chart provider already downloads daily bars per symbol; it asks
+    # for a year instead of 10 days for a batch of the symbols still missing
+    # indicator history, each at most once a day.
+    return set(
+        get_indicator_engine().needs_history(
+            symbols, INDICATOR_SEED_SYMBOLS, dj_timezone.localdate()
+        )
+    )
 
 
-def _build_rows():
-    try:
-        rows = _build_rows_yahoo_quote()
-        if rows:
-            return rows
-    except (HTTPError, URLError, ssl.SSLError, socket.timeout, TimeoutError, ValueError):
-        pass
+def _fetch_last_two_closes_yahoo_chart(
+    symbol, timeout=YAHOO_TIMEOUT_SECONDS, with_history=False
+):
+    if not with_history:
+        body = http_client.get(_yahoo_chart_url(symbol), timeout=timeout)
+        return _yahoo_chart_last_two_closes(body)
+    body = http_client.get(_yahoo_chart_url(symbol, "1y"), timeout=timeout)
+    return _seed_from_chart(symbol, body) or _yahoo_chart_last_two_closes(body)
+
+
+def _build_rows_yahoo_chart(universe):
+    symbols = [item["symbol"] for item in universe]
+    wanted = _chart_history_wanted(symbols)
+
+    def fetch(symbol, timeout):
+        return _fetch_last_two_closes_yahoo_chart(symbol, timeout, symbol in wanted)
+
+    closes = _fetch_concurrently(fetch, symbols, timeout=YAHOO_TIMEOUT_SECONDS)
+    return SnapshotFrame.from_closes(symbols, closes)
+
+
+async def _abuild_rows_yahoo_chart(client, universe):
+    # Loading the indicator engine reads its files, so it happens in a
+    # worker thread before the downloads; seeding it is in memory.
+    symbols = [item["symbol"] for item in universe]
+    wanted = await sync_to_async(_chart_history_wanted)(symbols)
+
+    async def fetch(symbol, timeout):
+        if symbol not in wanted:
+            body = await client.get(_yahoo_chart_url(symbol), timeout=timeout)
+            return _yahoo_chart_last_two_closes(body)
+        body = await client.get(_yahoo_chart_url(symbol, "1y"), timeout=timeout)
+        return _seed_from_chart(symbol, body) or _yahoo_chart_last_two_closes(body)
+
+    closes = await _afetch_concurrently(fetch, symbols, timeout=YAHOO_TIMEOUT_SECONDS)
+    return SnapshotFrame.from_closes(symbols, closes)
+
 
+def _seed_from_stooq(symbols):
+    # Symbols the Stooq store already holds a year of closes for need no
+    # download. Returns the rest.
+    store = _get_stooq_store()
+    engine = get_indicator_engine()
+    current = trading_calendar.session_date(dj_timezone.now()).toordinal()
+    remaining = []
+    for symbol in symbols:
+        history = store.tail(symbol, WINDOW_DAYS + 1)
+        closes = history["close"][history["day"] < current]
+        if len(closes) >= RANGE_MIN_DAYS:
+            engine.seed(symbol, closes)
+        else:
+            remaining.append(symbol)
+    return remaining
+
+
+def _fetch_indicator_history(symbol, timeout=YAHOO_TIMEOUT_SECONDS):
+    body = http_client.get(_yahoo_chart_url(symbol, "1y"), timeout=timeout)
+    return _seed_from_chart(symbol, body)
+
+
+def _seed_indicators(universe):
+    # Runs on _seed_executor once the refresh that queued it has released
+    # the lock, and holds the lock itself like every other user of the
+    # engine. Seeds are committed to the engine's files before it returns.
+    token = _acquire_refresh_lock(wait=INDICATOR_SEED_LOCK_WAIT_SECONDS)
+    if token is None:
+        return  # another process is refreshing; a later refresh queues it again
     try:
-        rows = _build_rows_yahoo_chart()
-        if rows:
-            return rows
-    except (HTTPError, URLError, ssl.SSLError, socket.timeout, TimeoutError, ValueError):
-        pass
+        engine = get_indicator_engine()
+        symbols = engine.needs_history(
+            [item["symbol"] for item in universe],
+            INDICATOR_SEED_SYMBOLS,
+            dj_timezone.localdate(),
+        )
+        remaining = _seed_from_stooq(symbols)
+        if remaining:
+            _fetch_concurrently(
+                _fetch_indicator_history,
+                remaining,
+                timeout=YAHOO_TIMEOUT_SECONDS,
+                deadline=INDICATOR_SEED_DEADLINE_SECONDS,
+            )
+        engine.apply_seeds(trading_calendar.session_date(dj_timezone.now()))
+    finally:
+        _release_refresh_lock(token)
+
+
+_seed_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="market-seed")
+_seed_future = None
 
-    return _build_rows_stooq()
+
+def _queue_indicator_seeding(universe):
+    # At most one batch queued or running per process.
+    global _seed_future
+    if _seed_future is None or _seed_future.done():
+        _seed_future = _seed_executor.submit(_seed_indicators, universe)
+
+
+def wait_for_indicator_seeding(timeout=None):
+    if _seed_future is not None:
+        _seed_future.result(timeout)
+
+
+# In preference order; providers.fetch_frame skips any with an open circuit,
+# hedges a slow primary and fills gaps per symbol from the rest. The async
+# builders serve the same providers (and share their health) under ASGI.
+PROVIDERS = [
+    Provider("yahoo_quote", _build_rows_yahoo_quote, FETCH_ERRORS, _abuild_rows_yahoo_quote),
+    Provider("yahoo_chart", _build_rows_yahoo_chart, FETCH_ERRORS, _abuild_rows_yahoo_chart),
+    Provider("stooq", _build_rows_stooq, FETCH_ERRORS, _abuild_rows_stooq),
+]
+
+
+def _build_rows(universe):
+    return fetch_frame(PROVIDERS, universe)
+
+
+async def _abuild_rows(universe):
+    async with http_client.AsyncHttpClient(
+        rate_limits=getattr(settings, "MARKET_HTTP_RATE_LIMITS", None)
+    ) as client:
+        return await fetch_frame_async(PROVIDERS, universe, client)
 
 
 def _status_label(status_key):
@@ -219,20 +567,27 @@ def _status_label(status_key):
     return "No previous record"
 
 
-def _attach_previous_status(top_gainers, top_losers):
+def _attach_previous_status(top_gainers, top_losers, today=None):
     symbols = [row["symbol"] for row in (top_gainers + top_losers)]
     if not symbols:
         return
 
-    today = dj_timezone.localdate()
-    status_map = {}
-    for symbol in symbols:
-        previous = (
-            DailyLeaderSnapshot.objects.filter(symbol=symbol, snapshot_date__lt=today)
-            .order_by("-snapshot_date", "-captured_at")
-            .first()
+    today = today or dj_timezone.localdate()
+    # Latest earlier record per symbol in one query, served by the
+    # (symbol, snapshot_date) index.
+    latest = (
+        DailyLeaderSnapshot.objects.filter(symbol__in=symbols, snapshot_date__lt=today)
+        .annotate(
+            recency=Window(
+                RowNumber(),
+                partition_by=F("symbol"),
+                order_by=[F("snapshot_date").desc(), F("captured_at").desc()],
+            )
         )
-        status_map[symbol] = previous.group if previous else None
+        .filter(recency=1)
+        .values_list("symbol", "group")
+    )
+    status_map = dict(latest)
 
     for row in top_gainers + top_losers:
         status_key = status_map.get(row["symbol"])
@@ -240,115 +595,353 @@ def _attach_previous_status(top_gainers, top_losers):
         row["previous_status_label"] = _status_label(status_key)
 
 
-def _save_daily_snapshots(top_gainers, top_losers):
-    snapshot_date = dj_timezone.localdate()
+def _refresh_leader_aggregates(start, end):
+    # Recompute the per-day, per-group rollup for the given days only; the
+    # history chart reads these rows instead of aggregating raw snapshots.
+    totals = (
+        DailyLeaderSnapshot.objects.filter(snapshot_date__range=(start, end))
+        .values("snapshot_date", "group")
+        .annotate(avg=Avg("change_pct"), count=Count("id"))
+        .order_by()
+    )
+    DailyLeaderAggregate.objects.bulk_create(
+        [
+            DailyLeaderAggregate(
+                snapshot_date=item["snapshot_date"],
+                group=item["group"],
+                avg_change_pct=item["avg"],
+                leader_count=item["count"],
+            )
+            for item in totals
+        ],
+        update_conflicts=True,
+        unique_fields=["snapshot_date", "group"],
+        update_fields=["avg_change_pct", "leader_count", "updated_at"],
+    )
+
+
+def leader_snapshot(snapshot_date, group, row):
+    return DailyLeaderSnapshot(
+        snapshot_date=snapshot_date,
+        symbol=row["symbol"],
+        company_name=row["company_name"],
+        group=group,
+        close_price=row["price"],
+        change_pct=row["change_pct"],
+    )
 
-    for row in top_gainers:
-        DailyLeaderSnapshot.objects.update_or_create(
-            snapshot_date=snapshot_date,
-            symbol=row["symbol"],
-            group=DailyLeaderSnapshot.GROUP_WINNER,
-            defaults={
-                "company_name": row["company_name"],
-                "close_price": row["price"],
-                "change_pct": row["change_pct"],
-            },
-        )
 
-    for row in top_losers:
-        DailyLeaderSnapshot.objects.update_or_create(
-            snapshot_date=snapshot_date,
-            symbol=row["symbol"],
-            group=DailyLeaderSnapshot.GROUP_LOSER,
-            defaults={
-                "company_name": row["company_name"],
-                "close_price": row["price"],
-                "change_pct": row["change_pct"],
-            },
+def save_leader_snapshots(snapshots, batch_size=500):
+    # One upsert on the (snapshot_date, symbol, group) unique constraint plus
+    # the aggregate refresh, all in a single short write transaction.
+    if not snapshots:
+        return
+    dates = [snapshot.snapshot_date for snapshot in snapshots]
+    with transaction.atomic():
+        DailyLeaderSnapshot.objects.bulk_create(
+            snapshots,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=["snapshot_date", "symbol", "group"],
+            update_fields=["company_name", "close_price", "change_pct"],
         )
+        _refresh_leader_aggregates(min(dates), max(dates))
+
+
+def _save_daily_snapshots(top_gainers, top_losers, snapshot_date=None):
+    snapshot_date = snapshot_date or dj_timezone.localdate()
+    snapshots = [
+        leader_snapshot(snapshot_date, DailyLeaderSnapshot.GROUP_WINNER, row)
+        for row in top_gainers
+    ]
+    snapshots += [
+        leader_snapshot(snapshot_date, DailyLeaderSnapshot.GROUP_LOSER, row)
+        for row in top_losers
+    ]
+    save_leader_snapshots(snapshots)
 
 
-def _build_history_chart_data():
-    all_dates = list(
-        DailyLeaderSnapshot.objects.order_by("snapshot_date")
-        .values_list("snapshot_date", flat=True)
-        .distinct()
+def _build_history_chart_data(days=None):
+    days = days or settings.MARKET_HISTORY_DAYS
+    start = dj_timezone.localdate() - timedelta(days=days - 1)
+    aggregates = (
+        DailyLeaderAggregate.objects.filter(snapshot_date__gte=start)
+        .order_by("snapshot_date")
+        .values_list("snapshot_date", "group", "avg_change_pct")
     )
-    dates = all_dates[-10:]
-
-    labels = [str(day) for day in dates]
-    winners_avg = []
-    losers_avg = []
-
-    for day in dates:
-        winner_avg = (
-            DailyLeaderSnapshot.objects.filter(
-                snapshot_date=day,
-                group=DailyLeaderSnapshot.GROUP_WINNER,
-            ).aggregate(avg=Avg("change_pct"))["avg"]
-        )
-        loser_avg = (
-            DailyLeaderSnapshot.objects.filter(
-                snapshot_date=day,
-                group=DailyLeaderSnapshot.GROUP_LOSER,
-            ).aggregate(avg=Avg("change_pct"))["avg"]
-        )
 
-        winners_avg.append(round(float(winner_avg), 2) if winner_avg is not None else None)
-        losers_avg.append(round(float(loser_avg), 2) if loser_avg is not None else None)
+    by_day = {}
+    for day, group, avg_change in aggregates:
+        by_day.setdefault(day, {})[group] = round(float(avg_change), 2)
 
+    dates = sorted(by_day)
     return {
-        "labels": labels,
-        "winner_avg_change": winners_avg,
-        "loser_avg_change": losers_avg,
+        "labels": [str(day) for day in dates],
+        "winner_avg_change": [
+            by_day[day].get(DailyLeaderSnapshot.GROUP_WINNER) for day in dates
+        ],
+        "loser_avg_change": [
+            by_day[day].get(DailyLeaderSnapshot.GROUP_LOSER) for day in dates
+        ],
     }
 
 
-def get_market_snapshot():
-    cached = cache.get(CACHE_KEY)
-    if cached:
-        return cached
+def get_history_chart_json(days, version=None):
+    if not version:
+        return json.dumps(_build_history_chart_data(days))
+    key = HISTORY_CHART_CACHE_KEY.format(version, days)
+    chart_json = cache.get(key)
+    if chart_json is None:
+        chart_json = json.dumps(_build_history_chart_data(days))
+        cache.set(key, chart_json, FRAME_HISTORY_SECONDS)
+    return chart_json
 
-    stale = cache.get(STALE_CACHE_KEY)
-    context = {
+
+def _empty_snapshot(error=""):
+    return {
         "generated_at": datetime.now(timezone.utc),
-        "stocks": [],
+        "frame": SnapshotFrame.empty(),
+        "breadth": SnapshotFrame.empty().breadth(),
+        "sector_breadth": [],
         "top_gainers": [],
         "top_losers": [],
         "history_chart_json": json.dumps(
             {"labels": [], "winner_avg_change": [], "loser_avg_change": []}
         ),
-        "error": "",
+        "history_days": settings.MARKET_HISTORY_DAYS,
+        "indicators": {},
+        "session": None,
+        "version": 0,
+        "error": error,
     }
 
+
+def _publish_frame(universe, frame, started, stale):
+    # Everything after the upstream fetch: leaders, persistence, aggregates
+    # and publishing to the cache. Shared by the sync and async refreshes.
+    context = _empty_snapshot()
+    if not len(frame) and stale:
+        return dict(stale, error="Live fetch returned no rows. Showing last cached data.")
+    if not len(frame):
+        context["error"] = "No market data returned from source."
+        return context
+    # Partial selection instead of sorting the whole universe twice; the
+    # full table keeps the universe (symbol) order and is only turned into
+    # dicts at render time.
+    names = company_names(universe)
+    top_gainers = frame.to_rows(names, frame.top(LEADER_COUNT))
+    top_losers = frame.to_rows(names, frame.bottom(LEADER_COUNT))
+
+    now = dj_timezone.now()
+    session = trading_calendar.session_info(now)
+    # Leaders belong to the trading session, not the UTC day: an evening
+    # refresh in New York is already the next day in UTC.
+    session_day = date.fromisoformat(session["session_date"])
+    with metrics.db_stage("attach_previous_status"):
+        _attach_previous_status(top_gainers, top_losers, session_day)
+    # Outside a session the leaders are those of the last close, which the
+    # post-close refresh has already saved.
+    if session["state"] in ("open", "after_close"):
+        with metrics.db_stage("save_daily_snapshots"):
+            _save_daily_snapshots(top_gainers, top_losers, session_day)
+
+    context["frame"] = frame
+    context["breadth"] = frame.breadth()
+    context["sector_breadth"] = frame.sector_breadth(
+        {item["symbol"]: item["sector"] for item in universe}
+    )
+    context["top_gainers"] = top_gainers
+    context["top_losers"] = top_losers
+    with metrics.timed("market_stage_seconds", stage="indicators"):
+        context["indicators"] = get_indicator_engine().update(frame, session_day)
+    context["session"] = session
+    with metrics.db_stage("build_history_chart_data"):
+        context["history_chart_json"] = json.dumps(_build_history_chart_data())
+
+    context["version"] = int(time.time() * 1000)
+    cache.set(FRAME_HISTORY_KEY.format(context["version"]), frame, FRAME_HISTORY_SECONDS)
+
+    build_seconds = time.monotonic() - started
+    metrics.observe("market_refresh_seconds", build_seconds)
+    timeout = trading_calendar.seconds_until_refresh(now, CACHE_TIMEOUT_SECONDS)
+    entry = {
+        "snapshot": context,
+        "expires_at": time.time() + timeout,
+        "build_seconds": build_seconds,
+    }
+    cache.set(CACHE_KEY, entry, timeout)
+    cache.set(STALE_CACHE_KEY, context, max(STALE_CACHE_TIMEOUT_SECONDS, timeout))
+
     try:
-        rows = _build_rows()
-        if not rows and stale:
-            stale["error"] = "Live fetch returned no rows. Showing last cached data."
-            return stale
-        if not rows:
-            context["error"] = "No market data returned from source."
-            return context
-        rows.sort(key=lambda x: x["change_pct"], reverse=True)
-        top_gainers = rows[:10]
-        top_losers = sorted(rows, key=lambda x: x["change_pct"])[:10]
+        get_intraday_store().append(frame, context["generated_at"])
+    except OSError:
+        pass  # intraday history is best effort; the snapshot is published
+    return context
 
-        _attach_previous_status(top_gainers, top_losers)
-        _save_daily_snapshots(top_gainers, top_losers)
 
-        context["stocks"] = rows
-        context["top_gainers"] = top_gainers
-        context["top_losers"] = top_losers
-        context["history_chart_json"] = json.dumps(_build_history_chart_data())
+def _failed_snapshot(stale, exc):
+    if stale:
+        return dict(
+            stale,
+            error="Live update is temporarily limited. Showing last cached data.",
+        )
+    return _empty_snapshot(str(exc))
 
-        cache.set(CACHE_KEY, context, CACHE_TIMEOUT_SECONDS)
-        cache.set(STALE_CACHE_KEY, context, 86400)
-        return context
+
+def _rebuild_snapshot():
+    stale = cache.get(STALE_CACHE_KEY)
+    try:
+        started = time.monotonic()
+        universe = get_universe()
+        frame = _build_rows(universe)
+        context = _publish_frame(universe, frame, started, stale)
     except Exception as exc:
-        if stale:
-            stale["error"] = (
-                "Live update is temporarily limited. Showing last cached data."
-            )
-            return stale
-        context["error"] = str(exc)
-        return context
+        return _failed_snapshot(stale, exc)
+    # Indicator history for new symbols is fetched in the background once
+    # the snapshot is out; it shows up from the next refresh on.
+    _queue_indicator_seeding(universe)
+    return context
+
+
+async def _arebuild_snapshot():
+    # Only the upstream fetch runs on the event loop; the short ORM and cache
+    # writes that follow run in a worker thread (they need a transaction).
+    stale = await cache.aget(STALE_CACHE_KEY)
+    try:
+        started = time.monotonic()
+        universe = await aget_universe()
+        frame = await _abuild_rows(universe)
+        context = await sync_to_async(_publish_frame)(universe, frame, started, stale)
+    except Exception as exc:
+        return _failed_snapshot(stale, exc)
+    _queue_indicator_seeding(universe)
+    return context
+
+
+def _refresh_lock_path():
+    return str(settings.MARKET_DATA_DIR / REFRESH_LOCK_FILE)
+
+
+def _lock_cache():
+    # The shared tier when it can take the lock for every host (Redis,
+    # Memcached); None means the per-host lock file.
+    shared = getattr(cache, "shared", cache)
+    return shared if supports_atomic_add(shared) else None
+
+
+def _acquire_refresh_lock(wait=0):
+    lock_cache = _lock_cache()
+    if lock_cache is not None:
+        return acquire_cache_lock(
+            lock_cache, REFRESH_LOCK_KEY, REFRESH_LOCK_TIMEOUT_SECONDS, wait
+        )
+    return acquire_file_lock(_refresh_lock_path(), REFRESH_LOCK_TIMEOUT_SECONDS, wait)
+
+
+def _release_refresh_lock(token):
+    lock_cache = _lock_cache()
+    if lock_cache is not None:
+        release_cache_lock(lock_cache, REFRESH_LOCK_KEY, token)
+    else:
+        release_file_lock(_refresh_lock_path(), token)
+
+
+def refresh_market_snapshot():
+    # Single flight: only the caller holding the lock rebuilds. Returns None
+    # when another thread or process is already refreshing.
+    token = _acquire_refresh_lock()
+    if token is None:
+        return None
+    try:
+        return _rebuild_snapshot()
+    finally:
+        _release_refresh_lock(token)
+
+
+async def arefresh_market_snapshot():
+    # Taking the lock is a cache round trip or file I/O, so it runs off the
+    # event loop.
+    token = await asyncio.to_thread(_acquire_refresh_lock)
+    if token is None:
+        return None
+    try:
+        return await _arebuild_snapshot()
+    finally:
+        await asyncio.to_thread(_release_refresh_lock, token)
+
+
+def _should_refresh_early(entry):
+    # Probabilistic early expiry (XFetch): the closer the entry is to its TTL
+    # and the slower the last rebuild, the more likely a reader volunteers to
+    # refresh, so refreshes spread out instead of piling up at the boundary.
+    remaining = entry["expires_at"] - time.time()
+    jitter = -math.log(1.0 - random.random())
+    return entry["build_seconds"] * EARLY_EXPIRY_BETA * jitter >= remaining
+
+
+def get_snapshot_frame(version):
+    return cache.get(FRAME_HISTORY_KEY.format(version))
+
+
+def get_market_snapshot():
+    entry = cache.get(CACHE_KEY)
+    if entry and not _should_refresh_early(entry):
+        metrics.inc("market_snapshot_requests_total", result="hit")
+        return entry["snapshot"]
+
+    # With the run_market_refresher command publishing snapshots, requests
+    # never fetch upstream themselves; they serve whatever was last published.
+    if settings.MARKET_REFRESH_ON_REQUEST:
+        context = refresh_market_snapshot()
+        if context is not None:
+            metrics.inc("market_snapshot_requests_total", result="refreshed")
+            return context
+
+    if entry:
+        metrics.inc("market_snapshot_requests_total", result="hit")
+        return entry["snapshot"]
+    stale = cache.get(STALE_CACHE_KEY)
+    if stale:
+        metrics.inc("market_snapshot_requests_total", result="stale")
+        return stale
+    metrics.inc("market_snapshot_requests_total", result="miss")
+    if settings.MARKET_REFRESH_ON_REQUEST:
+        return _empty_snapshot("Market data is being refreshed. Please reload shortly.")
+    return _empty_snapshot("Market data has not been published yet.")
+
+
+_background_refreshes = set()
+
+
+async def aget_market_snapshot(background_refresh=False):
+    # Async twin of get_market_snapshot. With background_refresh (only safe
+    # on a long-lived event loop, i.e. under ASGI) an early XFetch refresh
+    # runs as a task and the current entry is served right away, so no
+    # request waits on the network while a cached snapshot exists.
+    entry = await cache.aget(CACHE_KEY)
+    if entry and not _should_refresh_early(entry):
+        metrics.inc("market_snapshot_requests_total", result="hit")
+        return entry["snapshot"]
+
+    if settings.MARKET_REFRESH_ON_REQUEST:
+        if entry and background_refresh:
+            task = asyncio.ensure_future(arefresh_market_snapshot())
+            _background_refreshes.add(task)
+            task.add_done_callback(_background_refreshes.discard)
+        else:
+            context = await arefresh_market_snapshot()
+            if context is not None:
+                metrics.inc("market_snapshot_requests_total", result="refreshed")
+                return context
+
+    if entry:
+        metrics.inc("market_snapshot_requests_total", result="hit")
+        return entry["snapshot"]
+    stale = await cache.aget(STALE_CACHE_KEY)
+    if stale:
+        metrics.inc("market_snapshot_requests_total", result="stale")
+        return stale
+    metrics.inc("market_snapshot_requests_total", result="miss")
+    if settings.MARKET_REFRESH_ON_REQUEST:
+        return _empty_snapshot("Market data is being refreshed. Please reload shortly.")
+    return _empty_snapshot("Market data has not been published yet.")
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import TrackedSymbol
+from .services import invalidate_universe
+
+
+@receiver(post_save, sender=TrackedSymbol)
+@receiver(post_delete, sender=TrackedSymbol)
+def _tracked_symbol_changed(sender, **kwargs):
+    invalidate_universe()
@@ -0,0 +1,96 @@
+from datetime import date
+import io
+import os
+from pathlib import Path
+import threading
+
+import numpy as np
+
+# One append-only file per symbol of fixed-size (day ordinal, close) records,
+# oldest first. Only the tail is ever read on the refresh path.
+RECORD = np.dtype([("day", "<i4"), ("close", "<f8")])
+
+
+def parse_daily_csv(body):
+    # Stream the Stooq "Date,Open,High,Low,Close,Volume" CSV straight into a
+    # record array without building per-row dicts.
+    def records():
+        lines = io.BytesIO(body)
+        header = lines.readline().decode("ascii", errors="ignore").strip().split(",")
+        try:
+            date_column = header.index("Date")
+            close_column = header.index("Close")
+        except ValueError:
+            return
+        for line in lines:
+            fields = line.split(b",")
+            if len(fields) <= close_column:
+                continue
+            close = fields[close_column].strip()
+            if not close or close == b"N/D":
+                continue
+            try:
+                day = date.fromisoformat(fields[date_column].decode("ascii")).toordinal()
+                yield day, float(close)
+            except ValueError:
+                continue
+
+    parsed = np.fromiter(records(), dtype=RECORD)
+    if len(parsed) > 1 and np.any(np.diff(parsed["day"]) <= 0):
+        parsed = parsed[np.argsort(parsed["day"], kind="stable")]
+        last_of_day = np.append(parsed["day"][1:] != parsed["day"][:-1], True)
+        parsed = parsed[last_of_day]
+    return parsed
+
+
+class StooqHistoryStore:
+    def __init__(self, root):
+        self.root = Path(root)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock(self, symbol):
+        with self._locks_guard:
+            return self._locks.setdefault(symbol, threading.Lock())
+
+    def path(self, symbol):
+        return self.root / "{}.bin".format(symbol.upper())
+
+    def read(self, symbol):
+        path = self.path(symbol)
+        if not path.exists() or path.stat().st_size < RECORD.itemsize:
+            return np.empty(0, dtype=RECORD)
+        return np.memmap(path, dtype=RECORD, mode="r")
+
+    def tail(self, symbol, count):
+        path = self.path(symbol)
+        try:
+            with open(path, "rb") as handle:
+                handle.seek(0, os.SEEK_END)
+                size = handle.tell() - handle.tell() % RECORD.itemsize
+                start = max(0, size - count * RECORD.itemsize)
+                handle.seek(start)
+                return np.frombuffer(handle.read(size - start), dtype=RECORD)
+        except FileNotFoundError:
+            return np.empty(0, dtype=RECORD)
+
+    def last_day(self, symbol):
+        tail = self.tail(symbol, 1)
+        if not len(tail):
+            return None
+        return date.fromordinal(int(tail["day"][0]))
+
+    def merge(self, symbol, records):
+        # New records replace everything from their first day onwards (the
+        # latest bar is provisional until the session closes).
+        if not len(records):
+            return
+        path = self.path(symbol)
+        with self._lock(symbol):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            existing = self.read(symbol)
+            keep = int(np.searchsorted(existing["day"], records["day"][0], side="left"))
+            del existing
+            with open(path, "ab") as handle:
+                handle.truncate(keep * RECORD.itemsize)
+                handle.write(np.ascontiguousarray(records, dtype=RECORD).tobytes())
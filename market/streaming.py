@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .payloads import snapshot_payload
+from .services import aget_market_snapshot
+
+SUBSCRIBER_QUEUE_SIZE = 8
+KEEPALIVE_SECONDS = 20
+
+
+def _encode(snapshot, since=None):
+    payload = snapshot_payload(snapshot, since=since)
+    return "event: snapshot\nid: {}\ndata: {}\n\n".format(
+        payload["version"], json.dumps(payload, separators=(",", ":"))
+    ).encode("utf-8")
+
+
+class SnapshotBroadcaster:
+    # One watcher per process notices newly published snapshots and encodes
+    # each update once; every subscriber just receives the same bytes. The
+    # full state new subscribers start from is encoded only when one joins.
+
+    def __init__(self, poll_seconds):
+        self.poll_seconds = poll_seconds
+        self._subscribers = set()
+        self._task = None
+        self._version = None
+        self._snapshot = None
+        self._full_message = None
+
+    def _ensure_watcher(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._watch())
+
+    async def _publish(self, snapshot):
+        version = snapshot.get("version", 0)
+        if self._snapshot is not None and version == self._version:
+            return
+        previous = self._version
+        delta = await sync_to_async(_encode)(snapshot, since=previous)
+        self._version = version
+        self._snapshot = snapshot
+        # Without a previous version the delta already is the full state.
+        self._full_message = delta if previous is None else None
+
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(delta)
+            except asyncio.QueueFull:
+                # A client that cannot keep up is dropped; EventSource
+                # reconnects and starts again from the full state.
+                self._subscribers.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def _watch(self):
+        while self._subscribers:
+            snapshot = await aget_market_snapshot(background_refresh=True)
+            await self._publish(snapshot)
+            await asyncio.sleep(self.poll_seconds)
+
+    async def subscribe(self):
+        if self._snapshot is None:
+            await self._publish(await aget_market_snapshot(background_refresh=True))
+        while self._full_message is None:
+            snapshot = self._snapshot
+            message = await sync_to_async(_encode)(snapshot)
+            if snapshot is self._snapshot:
+                self._full_message = message
+        # No await between registering and reading the full state, so the
+        # first delta this queue sees always follows that state.
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        self._ensure_watcher()
+        return queue, self._full_message
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    async def events(self):
+        queue, initial = await self.subscribe()
+        try:
+            yield initial
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    message = b": keepalive\n\n"
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(queue)
+
+
+broadcaster = SnapshotBroadcaster(settings.MARKET_STREAM_POLL_SECONDS)
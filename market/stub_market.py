@@ -0,0 +1,166 @@
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import random
+import threading
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
+import zlib
+
+# Local stand-in for the Yahoo quote, Yahoo chart and Stooq CSV endpoints, used
+# by the benchmark_market command. Prices are deterministic per symbol and day
+# so runs are comparable; latency, error rate and dropped symbols are knobs.
+HISTORY_DAYS = 400
+ENDPOINTS = ("yahoo_quote", "yahoo_chart", "stooq")
+
+
+def _base_price(symbol):
+    return 20 + zlib.crc32(symbol.encode("utf-8")) % 480
+
+
+def daily_closes(symbol, end, days=HISTORY_DAYS):
+    # (date, close) for weekdays up to `end`, oldest first.
+    base = _base_price(symbol)
+    phase = zlib.crc32(symbol.encode("utf-8")) % 97
+    closes = []
+    day = end - timedelta(days=days)
+    while day <= end:
+        if day.weekday() < 5:
+            ordinal = day.toordinal()
+            closes.append((day, round(base * (1 + 0.05 * math.sin((ordinal + phase) / 9)), 2)))
+        day += timedelta(days=1)
+    return closes
+
+
+class _StubMarketHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        market = self.server.market
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        if parts.path == "/v7/finance/quote":
+            endpoint = "yahoo_quote"
+        elif parts.path.startswith("/v8/finance/chart/"):
+            endpoint = "yahoo_chart"
+        elif parts.path == "/q/d/l/":
+            endpoint = "stooq"
+        else:
+            return self._send(404, b"not found", "text/plain")
+
+        market.count(endpoint)
+        if market.latency:
+            time.sleep(market.latency * (1 + random.uniform(-market.jitter, market.jitter)))
+        if endpoint in market.disabled or random.random() < market.failure_rate:
+            return self._send(503, b"unavailable", "text/plain")
+
+        if endpoint == "yahoo_quote":
+            symbols = query.get("symbols", [""])[0].split(",")
+            body = json.dumps({"quoteResponse": {"result": market.quotes(symbols)}})
+            return self._send(200, body.encode("utf-8"), "application/json")
+        if endpoint == "yahoo_chart":
+            symbol = unquote(parts.path.rsplit("/", 1)[1])
+            body = json.dumps(market.chart(symbol, query.get("range", ["10d"])[0]))
+            return self._send(200, body.encode("utf-8"), "application/json")
+
+        symbol = query.get("s", [""])[0].rsplit(".", 1)[0].upper()
+        start = query.get("d1", [None])[0]
+        start = datetime.strptime(start, "%Y%m%d").date() if start else None
+        return self._send(200, market.stooq_csv(symbol, start), "text/csv")
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubMarketServer:
+    def __init__(
+        self,
+        latency=0.0,
+        jitter=0.2,
+        failure_rate=0.0,
+        missing_rate=0.0,
+        disabled=(),
+        today=None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.missing_rate = missing_rate
+        self.disabled = set(disabled)
+        self.today = today or date.today()
+        self.requests = {endpoint: 0 for endpoint in ENDPOINTS}
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self._server.server_port)
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _StubMarketHandler)
+        self._server.daemon_threads = True
+        self._server.market = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def count(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] += 1
+
+    def _dropped(self, symbol):
+        # The same symbols go missing on every call, like a real partial feed.
+        return zlib.crc32(symbol.encode("utf-8")) % 1000 < self.missing_rate * 1000
+
+    def quotes(self, symbols):
+        results = []
+        for symbol in symbols:
+            if not symbol or self._dropped(symbol):
+                continue
+            (_, previous), (_, price) = daily_closes(symbol, self.today, days=7)[-2:]
+            results.append(
+                {
+                    "symbol": symbol,
+                    "regularMarketPrice": price,
+                    "regularMarketPreviousClose": previous,
+                    "regularMarketChangePercent": (price - previous) / previous * 100,
+                }
+            )
+        return results
+
+    def chart(self, symbol, history_range="10d"):
+        bars = daily_closes(symbol, self.today, days=366 if history_range == "1y" else 14)
+        # Daily bars are stamped at the US open, 14:30 UTC.
+        timestamps = [
+            int(datetime(*day.timetuple()[:3], 14, 30, tzinfo=timezone.utc).timestamp())
+            for day, _ in bars
+        ]
+        result = {
+            "timestamp": timestamps,
+            "indicators": {"quote": [{"close": [close for _, close in bars]}]},
+        }
+        return {"chart": {"result": [result]}}
+
+    def stooq_csv(self, symbol, start=None):
+        lines = ["Date,Open,High,Low,Close,Volume"]
+        for day, close in daily_closes(symbol, self.today):
+            if start is None or day >= start:
+                lines.append("{},{},{},{},{},1000".format(day, close, close, close, close))
+        return ("\n".join(lines) + "\n").encode("ascii")
@@ -0,0 +1,1430 @@
+import asyncio
+from datetime import date, datetime, timedelta
+from datetime import timezone as dt_timezone
+import gzip
+import importlib
+import io
+import os
+import pickle
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
+import warnings
+from urllib.error import HTTPError
+
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.conf import settings as django_settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone as dj_timezone
+import numpy as np
+import pandas as pd
+
+from . import exports, metrics, services, streaming, tiered_cache
+from .columnar import SnapshotFrame
+from .http_client import AsyncHttpClient, HttpClient
+from .indicators import IndicatorEngine
+from .management.commands.backfill_leader_snapshots import _read_closes
+from .intraday import (
+    BAR_1H_RETENTION_DAYS,
+    BAR_1H_SECONDS,
+    BAR_5M_RETENTION_DAYS,
+    BAR_5M_SECONDS,
+    RAW_RETENTION_DAYS,
+    IntradayStore,
+    rollup,
+)
+from .models import DailyLeaderAggregate, DailyLeaderSnapshot, TrackedSymbol
+from .page_cache import page_response
+from .providers import Provider, ProviderStats, fetch_frame, fetch_frame_async
+from .services import _attach_previous_status
+from .stooq_store import StooqHistoryStore, parse_daily_csv
+from .stub_market import StubMarketServer, daily_closes
+from .trading_calendar import EXCHANGE_TZ, next_refresh_at, session_hours, session_state
+
+
+def _row(symbol):
+    return {"symbol": symbol, "company_name": symbol, "price": 10.0, "change_pct": 1.0}
+
+
+class AttachPreviousStatusTests(TestCase):
+    def _snapshot(self, symbol, group, days_ago):
+        return DailyLeaderSnapshot.objects.create(
+            snapshot_date=dj_timezone.localdate() - timedelta(days=days_ago),
+            symbol=symbol,
+            company_name=symbol,
+            group=group,
+            close_price=10,
+            change_pct=1,
+        )
+
+    def test_uses_latest_earlier_record_per_symbol(self):
+        self._snapshot("AAPL", DailyLeaderSnapshot.GROUP_LOSER, days_ago=3)
+        self._snapshot("AAPL", DailyLeaderSnapshot.GROUP_WINNER, days_ago=1)
+        self._snapshot("MSFT", DailyLeaderSnapshot.GROUP_LOSER, days_ago=2)
+        self._snapshot("MSFT", DailyLeaderSnapshot.GROUP_WINNER, days_ago=0)
+
+        gainers = [_row("AAPL"), _row("NVDA")]
+        losers = [_row("MSFT")]
+        _attach_previous_status(gainers, losers)
+
+        self.assertEqual(gainers[0]["previous_status"], "winner")
+        self.assertEqual(gainers[1]["previous_status"], "new")
+        self.assertEqual(gainers[1]["previous_status_label"], "No previous record")
+        self.assertEqual(losers[0]["previous_status"], "loser")
+
+    def test_lookup_is_a_single_query_at_any_universe_size(self):
+        symbols = ["SYM{}".format(i) for i in range(200)]
+        for symbol in symbols:
+            self._snapshot(symbol, DailyLeaderSnapshot.GROUP_WINNER, days_ago=1)
+
+        gainers = [_row(symbol) for symbol in symbols[:100]]
+        losers = [_row(symbol) for symbol in symbols[100:]]
+        with self.assertNumQueries(1):
+            _attach_previous_status(gainers, losers)
+
+        self.assertTrue(all(row["previous_status"] == "winner" for row in gainers + losers))
+
+    def test_evening_refresh_is_dated_by_the_trading_session(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        settings = override_settings(
+            MARKET_DATA_DIR=Path(workdir.name),
+            CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        services._intraday_store = services._indicator_engine = None
+        self.addCleanup(setattr, services, "_intraday_store", None)
+        self.addCleanup(setattr, services, "_indicator_engine", None)
+        DailyLeaderSnapshot.objects.create(
+            snapshot_date=date(2026, 1, 6),
+            symbol="AAA",
+            company_name="AAA",
+            group=DailyLeaderSnapshot.GROUP_LOSER,
+            close_price=10,
+            change_pct=-1,
+        )
+        universe = [{"symbol": "AAA", "name": "AAA", "sector": ""}]
+        frame = SnapshotFrame(["AAA"], [11.0], [10.0])
+
+        # 22:30 in New York on the 7th is already the 8th in UTC.
+        evening = _et(2026, 1, 7, 22, 30).astimezone(dt_timezone.utc)
+        with mock.patch.object(services.dj_timezone, "now", return_value=evening):
+            context = services._publish_frame(universe, frame, time.monotonic(), None)
+
+        self.assertEqual(context["session"]["state"], "after_close")
+        self.assertEqual(context["top_gainers"][0]["previous_status"], "loser")
+        saved = DailyLeaderSnapshot.objects.exclude(snapshot_date=date(2026, 1, 6))
+        self.assertEqual(
+            set(saved.values_list("snapshot_date", flat=True)), {date(2026, 1, 7)}
+        )
+
+
+def _leader(day, group, symbol, change_pct):
+    row = {"symbol": symbol, "company_name": symbol, "price": 10, "change_pct": change_pct}
+    return services.leader_snapshot(day, group, row)
+
+
+class LeaderAggregateTests(TestCase):
+    winner = DailyLeaderSnapshot.GROUP_WINNER
+    loser = DailyLeaderSnapshot.GROUP_LOSER
+
+    def _recount(self):
+        totals = {}
+        for row in DailyLeaderSnapshot.objects.all():
+            totals.setdefault((row.snapshot_date, row.group), []).append(row.change_pct)
+        return {
+            key: (round(float(sum(values) / len(values)), 4), len(values))
+            for key, values in totals.items()
+        }
+
+    def _aggregates(self):
+        return {
+            (row.snapshot_date, row.group): (
+                round(float(row.avg_change_pct), 4),
+                row.leader_count,
+            )
+            for row in DailyLeaderAggregate.objects.all()
+        }
+
+    def test_upsert_keeps_aggregates_in_step(self):
+        day = date(2026, 1, 6)
+        services.save_leader_snapshots(
+            [
+                _leader(day, self.winner, "AAA", 5),
+                _leader(day, self.winner, "BBB", 3),
+                _leader(day, self.loser, "CCC", -4),
+                _leader(day - timedelta(days=1), self.winner, "AAA", 2),
+            ]
+        )
+        self.assertEqual(self._aggregates(), self._recount())
+
+        # A later refresh of the same day updates one leader and adds another.
+        services.save_leader_snapshots(
+            [_leader(day, self.winner, "AAA", 7), _leader(day, self.loser, "DDD", -1)]
+        )
+
+        self.assertEqual(DailyLeaderSnapshot.objects.count(), 5)
+        self.assertEqual(self._aggregates(), self._recount())
+        self.assertEqual(self._aggregates()[(day, self.winner)], (5.0, 2))
+
+    def test_rebuild_command_and_migration_fill_match_recount(self):
+        day = date(2026, 1, 6)
+        DailyLeaderSnapshot.objects.bulk_create(
+            [
+                _leader(day - timedelta(days=offset), group, symbol, change)
+                for offset in range(3)
+                for group, symbol, change in (
+                    (self.winner, "AAA", 4 + offset),
+                    (self.winner, "BBB", 1.25),
+                    (self.loser, "CCC", -2 - offset),
+                )
+            ]
+        )
+        DailyLeaderAggregate.objects.create(
+            snapshot_date=day - timedelta(days=30),
+            group=self.winner,
+            avg_change_pct=9,
+            leader_count=1,
+        )
+
+        call_command("rebuild_leader_aggregates", stdout=io.StringIO())
+        self.assertEqual(self._aggregates(), self._recount())
+
+        DailyLeaderAggregate.objects.all().delete()
+        migration = importlib.import_module("market.migrations.0003_dailyleaderaggregate")
+        migration.populate_aggregates(django_apps, None)
+        self.assertEqual(self._aggregates(), self._recount())
+
+    def test_history_chart_window_is_bounded(self):
+        today = dj_timezone.localdate()
+        DailyLeaderAggregate.objects.bulk_create(
+            [
+                DailyLeaderAggregate(
+                    snapshot_date=today - timedelta(days=offset),
+                    group=group,
+                    avg_change_pct=offset,
+                    leader_count=10,
+                )
+                for offset in range(400)
+                for group in (self.winner, self.loser)
+            ]
+        )
+
+        with self.assertNumQueries(1):
+            chart = services._build_history_chart_data(30)
+
+        self.assertEqual(len(chart["labels"]), 30)
+        self.assertEqual(chart["labels"][0], str(today - timedelta(days=29)))
+        self.assertEqual(chart["labels"][-1], str(today))
+        self.assertEqual(chart["winner_avg_change"][-1], 0.0)
+
+
+class BackfillLeaderSnapshotsTests(TestCase):
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.root = Path(workdir.name)
+        # Per-symbol download layout ...
+        (self.root / "AAA.csv").write_text(
+            "Date,Open,High,Low,Close,Volume\n"
+            "2026-01-05,10,10,10,10,100\n"
+            "2026-01-06,11,11,11,11,100\n"
+            "2026-01-07,11,11,11,11,100\n"
+        )
+        (self.root / "CCC.csv").write_text(
+            "Date,Open,High,Low,Close,Volume\n"
+            "2026-01-05,5,5,5,5,100\n"
+            "2026-01-06,N/D,N/D,N/D,N/D,0\n"
+            "2026-01-07,4,4,4,4,100\n"
+        )
+        # ... and the bulk ASCII dump, unsorted and with an intraday row.
+        self.bulk = self.root / "bbb.us.txt"
+        self._write_bulk(21)
+
+    def _write_bulk(self, last_close):
+        self.bulk.write_text(
+            "<TICKER>,<PER>,<DATE>,<TIME>,<OPEN>,<HIGH>,<LOW>,<CLOSE>,<VOL>,<OPENINT>\n"
+            "BBB.US,D,20260107,000000,1,1,1,{},100,0\n"
+            "BBB.US,D,20260105,000000,1,1,1,20,100,0\n"
+            "BBB.US,5,20260106,153000,1,1,1,99,100,0\n"
+            "BBB.US,D,20260106,000000,1,1,1,19,100,0\n".format(last_close)
+        )
+
+    def _backfill(self):
+        call_command(
+            "backfill_leader_snapshots", str(self.root), "--top", "1", stdout=io.StringIO()
+        )
+        return {
+            (row.snapshot_date, row.group): (row.symbol, float(row.change_pct))
+            for row in DailyLeaderSnapshot.objects.all()
+        }
+
+    def test_reads_both_stooq_layouts(self):
+        symbol, closes = _read_closes(self.root / "AAA.csv")
+        self.assertEqual(symbol, "AAA")
+        self.assertEqual(closes.tolist(), [10.0, 11.0, 11.0])
+
+        symbol, closes = _read_closes(self.bulk)
+        self.assertEqual(symbol, "BBB")
+        self.assertEqual(
+            list(closes.index), [date(2026, 1, 5), date(2026, 1, 6), date(2026, 1, 7)]
+        )
+        self.assertEqual(closes.tolist(), [20.0, 19.0, 21.0])
+
+        self.assertEqual(_read_closes(self.root / "CCC.csv")[1].tolist(), [5.0, 4.0])
+
+    def test_keeps_top_n_per_day_and_reruns_idempotently(self):
+        winner, loser = DailyLeaderSnapshot.GROUP_WINNER, DailyLeaderSnapshot.GROUP_LOSER
+        day, next_day = date(2026, 1, 6), date(2026, 1, 7)
+
+        leaders = self._backfill()
+
+        self.assertEqual(
+            leaders,
+            {
+                (day, winner): ("AAA", 10.0),
+                (day, loser): ("BBB", -5.0),
+                (next_day, winner): ("BBB", 10.53),
+                (next_day, loser): ("CCC", -20.0),
+            },
+        )
+        self.assertEqual(DailyLeaderAggregate.objects.count(), 4)
+
+        self._write_bulk(22)
+        leaders = self._backfill()
+
+        self.assertEqual(DailyLeaderSnapshot.objects.count(), 4)
+        self.assertEqual(leaders[(next_day, winner)], ("BBB", 15.79))
+        aggregate = DailyLeaderAggregate.objects.get(snapshot_date=next_day, group=winner)
+        self.assertEqual(float(aggregate.avg_change_pct), 15.79)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class UniverseTests(TestCase):
+    def setUp(self):
+        services.cache.clear()
+        services._universe_memo.clear()
+        self.addCleanup(services._universe_memo.clear)
+
+    def _symbols(self):
+        return [item["symbol"] for item in services.get_universe()]
+
+    def test_changes_bump_the_version_and_refresh_the_memo(self):
+        with self.assertNumQueries(1):
+            before = self._symbols()
+        with self.assertNumQueries(0):
+            self.assertEqual(self._symbols(), before)
+        version = services._universe_version()
+
+        TrackedSymbol.objects.create(symbol="ZZZZ", name="Zed")
+
+        self.assertEqual(services._universe_version(), version + 1)
+        self.assertEqual(self._symbols(), before + ["ZZZZ"])
+        TrackedSymbol.objects.filter(symbol="ZZZZ").update(is_active=False)
+        services.invalidate_universe()
+        self.assertEqual(self._symbols(), before)
+
+    def test_lost_version_key_does_not_serve_an_old_universe(self):
+        version = services._universe_version()
+        stale = [{"symbol": "OLD", "name": "Old", "exchange": "", "sector": ""}]
+        for old_version in (1, 2, version, version + 1):
+            services.cache.set("market_universe:v{}".format(old_version), stale)
+        services._universe_memo.clear()
+
+        services.cache.delete(services.UNIVERSE_VERSION_KEY)
+        self.assertNotIn("OLD", self._symbols())
+        services.cache.delete(services.UNIVERSE_VERSION_KEY)
+        services.invalidate_universe()
+        self.assertNotIn("OLD", self._symbols())
+
+    def test_load_universe_upserts_and_replaces(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        path = Path(workdir.name) / "symbols.csv"
+        path.write_text(
+            "symbol,name,exchange,sector\n"
+            "aapl,Apple,NASDAQ,Technology\n"
+            "NEWCO,,NYSE,\n"
+            ",Nameless,,\n"
+        )
+        self._symbols()
+
+        call_command("load_universe", str(path), "--replace", stdout=io.StringIO())
+
+        universe = services.get_universe()
+        self.assertEqual([item["symbol"] for item in universe], ["AAPL", "NEWCO"])
+        self.assertEqual(universe[0]["sector"], "Technology")
+        self.assertEqual(universe[1]["name"], "NEWCO")
+        self.assertTrue(TrackedSymbol.objects.filter(is_active=False).exists())
+
+    def test_quote_fetch_is_sharded(self):
+        universe = [{"symbol": "S{:03d}".format(i)} for i in range(320)]
+        requested = []
+
+        def fetch_quotes(symbols, timeout=None):
+            requested.append(len(symbols))
+            return [
+                {
+                    "symbol": symbol,
+                    "regularMarketPrice": 11.0,
+                    "regularMarketPreviousClose": 10.0,
+                    "regularMarketChangePercent": 10.0,
+                }
+                for symbol in symbols
+            ]
+
+        with mock.patch.object(services, "_fetch_yahoo_quotes", fetch_quotes):
+            frame = services._build_rows_yahoo_quote(universe)
+
+        self.assertEqual(sorted(requested), [20, 150, 150])
+        self.assertEqual(frame.symbols.tolist(), [item["symbol"] for item in universe])
+
+
+class SnapshotFrameTests(SimpleTestCase):
+    def _frame(self, changes, symbols=None):
+        symbols = symbols or [chr(ord("A") + i) for i in range(len(changes))]
+        return SnapshotFrame(symbols, [10.0] * len(changes), [10.0] * len(changes), changes)
+
+    def test_top_and_bottom_skip_nan_and_break_ties_by_row_order(self):
+        frame = self._frame([5, 7, 7, np.nan, -3, 7, -3])
+
+        self.assertEqual(frame.symbols.tolist(), ["A", "B", "C", "E", "F", "G"])
+        self.assertEqual(frame.symbols[frame.top(2)].tolist(), ["B", "C"])
+        self.assertEqual(frame.symbols[frame.top(4)].tolist(), ["B", "C", "F", "A"])
+        self.assertEqual(frame.symbols[frame.bottom(1)].tolist(), ["E"])
+        self.assertEqual(
+            frame.symbols[frame.bottom(10)].tolist(), ["E", "G", "A", "B", "C", "F"]
+        )
+        self.assertEqual(len(frame.top(0)), 0)
+        self.assertEqual(len(SnapshotFrame.empty().bottom(3)), 0)
+
+    def test_breadth(self):
+        self.assertEqual(
+            self._frame([1.5, -2, 0, 3, 0.25]).breadth(),
+            {"advancers": 3, "decliners": 1, "unchanged": 1, "median_change": 0.25},
+        )
+        self.assertEqual(SnapshotFrame.empty().breadth()["median_change"], None)
+
+    def test_sector_breadth(self):
+        frame = self._frame([1, 3, -2, 4, 0], symbols=["A", "B", "C", "D", "E"])
+
+        summary = frame.sector_breadth({"A": "Tech", "B": "Tech", "C": "Tech", "D": "Energy"})
+
+        self.assertEqual(
+            summary,
+            [
+                {
+                    "sector": "Energy",
+                    "count": 1,
+                    "advancers": 1,
+                    "decliners": 0,
+                    "avg_change": 4.0,
+                    "median_change": 4.0,
+                },
+                {
+                    "sector": "Tech",
+                    "count": 3,
+                    "advancers": 2,
+                    "decliners": 1,
+                    "avg_change": 0.67,
+                    "median_change": 1.0,
+                },
+                {
+                    "sector": "Other",
+                    "count": 1,
+                    "advancers": 0,
+                    "decliners": 0,
+                    "avg_change": 0.0,
+                    "median_change": 0.0,
+                },
+            ],
+        )
+
+    def test_changed_since(self):
+        base = SnapshotFrame(["AAA", "BBB", "CCC"], [10, 20, 30], [9, 19, 29])
+        frame = SnapshotFrame(["DDD", "AAA", "BBB"], [40, 10, 21], [39, 9, 19])
+
+        changed, removed = frame.changed_since(base)
+
+        self.assertEqual(frame.symbols[changed].tolist(), ["DDD", "BBB"])
+        self.assertEqual(removed, ["CCC"])
+        self.assertEqual(frame.changed_since(SnapshotFrame.empty())[0].tolist(), [0, 1, 2])
+
+    def test_pickle_round_trip(self):
+        frame = SnapshotFrame(["AAA", "BBB"], [10.123, 20], [9, 21])
+
+        restored = pickle.loads(pickle.dumps(frame))
+
+        self.assertEqual(restored.symbols.tolist(), ["AAA", "BBB"])
+        for column in ("price", "previous_close", "change_pct"):
+            np.testing.assert_array_equal(getattr(restored, column), getattr(frame, column))
+        self.assertEqual(restored.to_rows({})[0]["price"], 10.12)
+        self.assertEqual(len(pickle.loads(pickle.dumps(SnapshotFrame.empty()))), 0)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        if self.path == "/missing":
+            self._send(404, b"missing")
+        elif self.path == "/etag":
+            if self.headers.get("If-None-Match") == '"v1"':
+                self._send(304, b"")
+            else:
+                self._send(200, b"fresh body", {"ETag": '"v1"'})
+        elif "gzip" in self.headers.get("Accept-Encoding", ""):
+            self._send(200, gzip.compress(b"hello"), {"Content-Encoding": "gzip"})
+        else:
+            self._send(200, b"hello")
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpClientTests(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+        self.server.connections = 0
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.base_url = "http://127.0.0.1:{}".format(self.server.server_port)
+        self.client = HttpClient()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuses_keep_alive_connection_and_decodes_gzip(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get(self.base_url + "/"), b"hello")
+        self.assertEqual(self.server.connections, 1)
+
+    def test_revalidates_with_etag(self):
+        self.assertEqual(self.client.get(self.base_url + "/etag"), b"fresh body")
+        self.assertEqual(self.client.get(self.base_url + "/etag"), b"fresh body")
+
+    def test_validator_cache_is_capped_by_bytes(self):
+        with mock.patch("market.http_client.MAX_VALIDATOR_BYTES", 100):
+            client = HttpClient()
+            for index in range(5):
+                client._remember(f"/{index}", "etag", None, b"x" * 10)
+            client._remember("/0", "etag", None, b"x" * 10)  # most recently used again
+            client._remember("/big", "etag", None, b"x" * 11)
+            self.assertIsNone(client._cached("/big"))
+            for index in range(5, 12):
+                client._remember(f"/{index}", "etag", None, b"x" * 10)
+            self.assertLessEqual(client._validator_bytes, 100)
+            self.assertEqual(client._validator_bytes, 10 * len(client._validators))
+            self.assertIsNotNone(client._cached("/0"))
+            self.assertIsNone(client._cached("/1"))
+
+    def test_raises_http_error_for_error_status(self):
+        with self.assertRaises(HTTPError):
+            self.client.get(self.base_url + "/missing")
+
+    def test_async_client_reuses_connection_and_revalidates(self):
+        async def fetch():
+            async with AsyncHttpClient() as client:
+                bodies = [await client.get(self.base_url + "/") for _ in range(3)]
+                bodies.append(await client.get(self.base_url + "/etag"))
+                bodies.append(await client.get(self.base_url + "/etag"))
+                with self.assertRaises(HTTPError):
+                    await client.get(self.base_url + "/missing")
+                return bodies
+
+        bodies = asyncio.run(fetch())
+        self.assertEqual(bodies, [b"hello"] * 3 + [b"fresh body"] * 2)
+        self.assertEqual(self.server.connections, 1)
+
+
+class FetchConcurrentlyTests(SimpleTestCase):
+    def test_deadline_returns_partial_results_without_waiting(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def fetch(symbol, timeout):
+            if symbol == "SLOW":
+                release.wait()
+            if symbol == "BAD":
+                raise ValueError("bad payload")
+            return (1.0, 2.0)
+
+        started = time.monotonic()
+        results = services._fetch_concurrently(
+            fetch, ["AAA", "SLOW", "BBB", "BAD"], timeout=1, deadline=0.3
+        )
+
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(results, {"AAA": (1.0, 2.0), "BBB": (1.0, 2.0)})
+
+
+def _frame_provider(name, prices, delay=0.0, error=None):
+    def fetch(universe):
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        symbols = [item["symbol"] for item in universe if item["symbol"] in prices]
+        return SnapshotFrame(
+            symbols, [prices[s] for s in symbols], [100.0] * len(symbols)
+        )
+
+    return Provider(name, fetch, (ValueError,))
+
+
+def _async_frame_provider(name, prices, delay=0.0):
+    async def afetch(client, universe):
+        await asyncio.sleep(delay)
+        symbols = [item["symbol"] for item in universe if item["symbol"] in prices]
+        return SnapshotFrame(
+            symbols, [prices[s] for s in symbols], [100.0] * len(symbols)
+        )
+
+    return Provider(name, None, (ValueError,), afetch=afetch)
+
+
+class ProviderOrchestrationTests(SimpleTestCase):
+    universe = [{"symbol": symbol} for symbol in ("AAA", "BBB", "CCC")]
+
+    def test_fills_symbols_missing_from_primary(self):
+        primary = _frame_provider("primary", {"AAA": 101.0})
+        fallback = _frame_provider("fallback", {"AAA": 90.0, "BBB": 102.0, "CCC": 103.0})
+
+        frame = fetch_frame([primary, fallback], self.universe)
+
+        self.assertEqual(frame.symbols.tolist(), ["AAA", "BBB", "CCC"])
+        self.assertEqual(frame.price.tolist(), [101.0, 102.0, 103.0])
+
+    def test_hedges_slow_primary(self):
+        primary = _frame_provider("primary", {"AAA": 101.0}, delay=2.0)
+        secondary = _frame_provider("secondary", {"AAA": 1.0, "BBB": 2.0, "CCC": 3.0})
+        primary.stats.record(0.1, True)
+
+        started = time.monotonic()
+        frame = fetch_frame([primary, secondary], self.universe)
+
+        self.assertLess(time.monotonic() - started, 1.5)
+        self.assertEqual(len(frame), 3)
+
+    def test_empty_answers_for_a_few_symbols_keep_the_circuit_closed(self):
+        partial = _frame_provider("partial", {"AAA": 1.0, "BBB": 2.0})
+        fallback = _frame_provider("fallback", {"AAA": 1.0, "BBB": 2.0})
+        # CCC is delisted: every refresh asks the fallback for it alone.
+        for _ in range(5):
+            frame = fetch_frame([partial, fallback], self.universe)
+
+        self.assertEqual(frame.symbols.tolist(), ["AAA", "BBB"])
+        self.assertTrue(fallback.stats.available())
+        self.assertEqual((fallback.stats.calls, fallback.stats.failures), (5, 0))
+
+        # An empty answer to a large request still counts against it.
+        empty = _frame_provider("empty", {})
+        universe = [{"symbol": "S{}".format(index)} for index in range(20)]
+        for _ in range(3):
+            empty(universe)
+        self.assertFalse(empty.stats.available())
+
+    def test_circuit_opens_after_repeated_failures(self):
+        broken = _frame_provider("broken", {}, error=ValueError("down"))
+        healthy = _frame_provider("healthy", {"AAA": 1.0, "BBB": 2.0, "CCC": 3.0})
+        for _ in range(3):
+            fetch_frame([broken, healthy], self.universe)
+
+        self.assertFalse(broken.stats.available())
+        self.assertEqual(broken.stats.calls, 3)
+        fetch_frame([broken, healthy], self.universe)
+        self.assertEqual(broken.stats.calls, 3)
+
+    def test_async_superseded_hedge_is_not_a_failure(self):
+        primary = _async_frame_provider("primary", {"AAA": 101.0}, delay=2.0)
+        secondary = _async_frame_provider("secondary", {"AAA": 1.0, "BBB": 2.0, "CCC": 3.0})
+        primary.stats.record(0.1, True)
+
+        frame = asyncio.run(fetch_frame_async([primary, secondary], self.universe, None))
+
+        self.assertEqual(len(frame), 3)
+        self.assertEqual((primary.stats.calls, primary.stats.failures), (1, 0))
+        self.assertEqual((secondary.stats.calls, secondary.stats.failures), (1, 0))
+
+    def test_async_provider_past_the_deadline_is_a_failure(self):
+        hanging = _async_frame_provider("hanging", {"AAA": 1.0}, delay=5.0)
+
+        frame = asyncio.run(
+            fetch_frame_async([hanging], self.universe, None, deadline=0.6)
+        )
+
+        self.assertEqual(len(frame), 0)
+        self.assertEqual((hanging.stats.calls, hanging.stats.failures), (1, 1))
+
+
+class RefreshLockTests(SimpleTestCase):
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        settings = override_settings(MARKET_DATA_DIR=Path(workdir.name))
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def _race(self, callers):
+        rebuilds = []
+
+        def rebuild():
+            rebuilds.append(threading.get_ident())
+            time.sleep(0.2)
+            return {"error": ""}
+
+        start = threading.Barrier(callers)
+        results = []
+
+        def caller():
+            start.wait()
+            results.append(services.refresh_market_snapshot())
+
+        with mock.patch.object(services, "_rebuild_snapshot", rebuild):
+            threads = [threading.Thread(target=caller) for _ in range(callers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(rebuilds), 1)
+        self.assertEqual(results.count(None), callers - 1)
+        # Released afterwards, so the next refresh runs.
+        with mock.patch.object(services, "_rebuild_snapshot", rebuild):
+            self.assertIsNotNone(services.refresh_market_snapshot())
+
+    def test_concurrent_callers_rebuild_once(self):
+        self._race(4)
+
+    def test_lock_is_a_cache_key_when_the_shared_tier_is_atomic(self):
+        tiered = {
+            "BACKEND": "market.tiered_cache.TieredCache",
+            "LOCATION": "lock-test",
+            "OPTIONS": {"SHARED": "shared"},
+        }
+        shared = {"BACKEND": "django.core.cache.backends.redis.RedisCache"}
+        with override_settings(CACHES={"default": tiered, "shared": shared}):
+            self.assertIs(services._lock_cache(), caches["shared"])
+        file_based = {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache"}
+        file_based["LOCATION"] = services.settings.MARKET_DATA_DIR / "cache"
+        with override_settings(CACHES={"default": tiered, "shared": file_based}):
+            self.assertIsNone(services._lock_cache())
+
+        # Any backend with an atomic add() works the same way.
+        locmem = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        with override_settings(CACHES={"default": locmem}):
+            lock_cache = caches["default"]
+            with mock.patch.object(services, "_lock_cache", return_value=lock_cache):
+                self._race(4)
+            self.assertIsNone(lock_cache.get(services.REFRESH_LOCK_KEY))
+        self.assertFalse(Path(services._refresh_lock_path()).exists())
+
+    def test_stale_lock_is_broken(self):
+        path = services._refresh_lock_path()
+        Path(path).write_text("crashed")
+        old = time.time() - services.REFRESH_LOCK_TIMEOUT_SECONDS - 5
+        os.utime(path, (old, old))
+
+        with mock.patch.object(services, "_rebuild_snapshot", lambda: {"error": ""}):
+            self.assertIsNotNone(services.refresh_market_snapshot())
+        self.assertFalse(Path(path).exists())
+
+
+class StooqStoreTests(SimpleTestCase):
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.root = Path(workdir.name)
+
+    def test_parse_skips_missing_closes_and_orders_days(self):
+        body = (
+            b"Date,Open,High,Low,Close,Volume\n"
+            b"2026-01-06,1,1,1,11.5,100\n"
+            b"2026-01-05,1,1,1,N/D,100\n"
+            b"2026-01-02,1,1,1,10.0,100\n"
+            b"2026-01-06,1,1,1,12.0,100\n"
+            b"not a row\n"
+        )
+
+        parsed = parse_daily_csv(body)
+
+        self.assertEqual(
+            [date.fromordinal(int(day)).isoformat() for day in parsed["day"]],
+            ["2026-01-02", "2026-01-06"],
+        )
+        # The later of two rows for the same day wins.
+        self.assertEqual(list(parsed["close"]), [10.0, 12.0])
+
+    def test_merge_replaces_the_provisional_last_bar(self):
+        store = StooqHistoryStore(self.root)
+        store.merge(
+            "AAA",
+            parse_daily_csv(b"Date,Close\n2026-01-02,10\n2026-01-05,11\n2026-01-06,12\n"),
+        )
+        store.merge("AAA", parse_daily_csv(b"Date,Close\n2026-01-06,12.5\n2026-01-07,13\n"))
+
+        self.assertEqual(list(store.read("AAA")["close"]), [10.0, 11.0, 12.5, 13.0])
+        self.assertEqual(store.last_day("AAA"), date(2026, 1, 7))
+        self.assertEqual(list(store.tail("AAA", 2)["close"]), [12.5, 13.0])
+
+    def test_incremental_download_from_the_last_stored_day(self):
+        today = date(2026, 1, 7)
+        stub = StubMarketServer(today=today).start()
+        self.addCleanup(stub.stop)
+        settings = override_settings(MARKET_DATA_DIR=self.root, MARKET_STOOQ_URL=stub.url)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        services._stooq_store = None
+        self.addCleanup(setattr, services, "_stooq_store", None)
+
+        store = services._get_stooq_store()
+        self.assertNotIn("d1=", services._stooq_url("AAA", store.last_day("AAA")))
+        services._fetch_last_two_closes_stooq("AAA")
+        stored = len(store.read("AAA"))
+        self.assertEqual(stored, len(daily_closes("AAA", today)))
+
+        stub.today = today + timedelta(days=1)
+        self.assertIn("d1=20260107", services._stooq_url("AAA", store.last_day("AAA")))
+        closes = services._fetch_last_two_closes_stooq("AAA")
+
+        history = daily_closes("AAA", stub.today)
+        self.assertEqual(closes, (history[-2][1], history[-1][1]))
+        self.assertEqual(len(store.read("AAA")), stored + 1)
+
+        async def build():
+            async with AsyncHttpClient() as client:
+                return await services._abuild_rows_stooq(client, [{"symbol": "AAA"}])
+
+        stub.today = today + timedelta(days=2)
+        frame = asyncio.run(build())
+
+        history = daily_closes("AAA", stub.today)
+        self.assertEqual(frame.price.tolist(), [history[-1][1]])
+        self.assertEqual(len(store.read("AAA")), stored + 2)
+
+    def test_stalest_symbols_are_fetched_first(self):
+        settings = override_settings(MARKET_DATA_DIR=self.root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        services._stooq_store = None
+        self.addCleanup(setattr, services, "_stooq_store", None)
+        store = services._get_stooq_store()
+        store.merge("AAA", parse_daily_csv(b"Date,Close\n2026-01-06,1\n2026-01-07,2\n"))
+        store.merge("CCC", parse_daily_csv(b"Date,Close\n2026-01-05,1\n2026-01-06,2\n"))
+        universe = [{"symbol": symbol} for symbol in ["AAA", "BBB", "CCC", "DDD"]]
+
+        with mock.patch.object(services, "_fetch_concurrently", return_value={}) as fetch:
+            services._build_rows_stooq(universe)
+
+        self.assertEqual(fetch.call_args.args[1], ["BBB", "DDD", "CCC", "AAA"])
+
+
+def _publish_snapshot(frame, version):
+    snapshot = dict(services._empty_snapshot(), frame=frame, version=version)
+    entry = {"snapshot": snapshot, "expires_at": time.time() + 600, "build_seconds": 0.0}
+    services.cache.set(services.CACHE_KEY, entry, 600)
+    services.cache.set(services.FRAME_HISTORY_KEY.format(version), frame, 600)
+    return snapshot
+
+
+@override_settings(
+    MARKET_REFRESH_ON_REQUEST=False,
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class SnapshotApiTests(TestCase):
+    def setUp(self):
+        services.cache.clear()
+        services._universe_memo.clear()
+        self.addCleanup(services._universe_memo.clear)
+        self.url = reverse("snapshot_api")
+
+    def test_etag_and_not_modified(self):
+        _publish_snapshot(SnapshotFrame(["AAA"], [11.0], [10.0]), 1000)
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+
+        again = self.client.get(self.url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(again.status_code, 304)
+
+        _publish_snapshot(SnapshotFrame(["AAA"], [12.0], [10.0]), 2000)
+        changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], first["ETag"])
+
+    def test_since_returns_changed_and_removed_rows(self):
+        before = SnapshotFrame(["AAA", "BBB", "CCC"], [11, 21, 31], [10, 20, 30])
+        after = SnapshotFrame(["AAA", "BBB", "DDD"], [11, 22, 41], [10, 20, 40])
+        _publish_snapshot(before, 1000)
+        _publish_snapshot(after, 2000)
+
+        payload = self.client.get(self.url, {"since": 1000}).json()
+
+        self.assertTrue(payload["delta"])
+        self.assertEqual([row["symbol"] for row in payload["stocks"]], ["BBB", "DDD"])
+        self.assertEqual(payload["removed"], ["CCC"])
+
+    def test_unknown_version_gets_the_full_table(self):
+        _publish_snapshot(SnapshotFrame(["AAA", "BBB"], [11, 21], [10, 20]), 2000)
+
+        payload = self.client.get(self.url, {"since": 1234}).json()
+
+        self.assertFalse(payload["delta"])
+        self.assertEqual([row["symbol"] for row in payload["stocks"]], ["AAA", "BBB"])
+        self.assertEqual(payload["removed"], [])
+
+
+@override_settings(
+    MARKET_REFRESH_ON_REQUEST=False,
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class PageCacheTests(TestCase):
+    def setUp(self):
+        services.cache.clear()
+        services._universe_memo.clear()
+        self.addCleanup(services._universe_memo.clear)
+        self.variants = {"identity": b"page", "gzip": b"gz", "br": b"br"}
+
+    def _response(self, accept_encoding, **headers):
+        request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING=accept_encoding, **headers)
+        return page_response(request, "k", self.variants)
+
+    def test_encoding_follows_accept_encoding(self):
+        self.assertEqual(self._response("gzip, br")["Content-Encoding"], "br")
+        self.assertEqual(self._response("gzip, br;q=0")["Content-Encoding"], "gzip")
+        identity = self._response("br;q=0, gzip;q=0")
+        self.assertFalse(identity.has_header("Content-Encoding"))
+        self.assertEqual(identity.content, b"page")
+        self.assertIn("Accept-Encoding", identity["Vary"])
+
+    def test_etag_per_encoding(self):
+        etag = self._response("gzip")["ETag"]
+        self.assertEqual(self._response("gzip", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self._response("br", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_cached_page_changes_with_snapshot_version(self):
+        _publish_snapshot(SnapshotFrame(["AAA"], [11.0], [10.0]), 1000)
+        first = self.client.get("/", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(first["Content-Encoding"], "gzip")
+        self.assertIn(b"$11.0", gzip.decompress(first.content))
+
+        _publish_snapshot(SnapshotFrame(["AAA"], [12.0], [10.0]), 2000)
+        second = self.client.get("/", HTTP_ACCEPT_ENCODING="gzip")
+
+        self.assertNotEqual(first["ETag"], second["ETag"])
+        self.assertIn(b"$12.0", gzip.decompress(second.content))
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "tiered-shared": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "tiered-shared",
+        },
+        "tiered-durable": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "tiered-durable",
+        },
+    }
+)
+class TieredCacheTests(SimpleTestCase):
+    def _cache(self, location, **options):
+        # Separate L1 locations stand in for separate processes.
+        options = dict({"SHARED": "tiered-shared", "STAMP_CHECK_SECONDS": 0}, **options)
+        tiered_cache._stores.pop(location, None)
+        self.addCleanup(tiered_cache._stores.pop, location, None)
+        return tiered_cache.TieredCache(location, {"OPTIONS": options})
+
+    def setUp(self):
+        caches["tiered-shared"].clear()
+        caches["tiered-durable"].clear()
+
+    def test_writes_are_seen_by_other_processes(self):
+        first, second = self._cache("l1-a"), self._cache("l1-b")
+        first.set("snapshot", 1)
+        self.assertEqual(second.get("snapshot"), 1)
+
+        first.set("snapshot", 2)
+        self.assertEqual(second.get("snapshot"), 2)
+
+        first.delete("snapshot")
+        self.assertIsNone(second.get("snapshot"))
+        # Replaced and deleted values leave nothing behind in L2.
+        self.assertEqual(len(caches["tiered-shared"]._cache), 0)
+
+    def test_a_write_only_invalidates_its_own_key(self):
+        first = self._cache("l1-a")
+        second = self._cache("l1-b", STAMP_CHECK_SECONDS=60)
+        first.set("page", "v1")
+        self.assertEqual(second.get("page"), "v1")
+
+        first.set("other", "x")
+        first.set("page", "v2")
+        # Trusted without an L2 read until the stamp check is due ...
+        self.assertEqual(second.get("page"), "v1")
+        # ... then revalidated against the key's own stamp.
+        second._check_seconds = 0
+        self.assertEqual(second.get("page"), "v2")
+
+    def test_add_is_decided_by_the_shared_tier(self):
+        first, second = self._cache("l1-a"), self._cache("l1-b")
+        self.assertTrue(first.add("lock", "a", 30))
+        self.assertFalse(second.add("lock", "b", 30))
+        self.assertEqual(second.get("lock"), "a")
+
+        first.add("counter", 1)
+        self.assertEqual(second.incr("counter"), 2)
+        self.assertEqual(first.get("counter"), 2)
+
+    def test_l1_evicts_least_recently_used(self):
+        cache = self._cache("l1-a", MAX_ENTRIES=2)
+        for key in ("a", "b", "c"):
+            cache.set(key, key.upper())
+
+        self.assertEqual(len(cache._store.entries), 2)
+        self.assertNotIn(cache.make_key("a"), cache._store.entries)
+        self.assertEqual(cache.get("a"), "A")
+
+    def test_durable_keys_are_kept_out_of_the_shared_tier(self):
+        first = self._cache("l1-a", DURABLE="tiered-durable", DURABLE_KEYS=["snapshot"])
+        second = self._cache("l1-b", DURABLE="tiered-durable", DURABLE_KEYS=["snapshot"])
+        first.set("snapshot", 1)
+        first.set("page", "p")
+
+        # Culling the shared tier cannot take the durable key with it.
+        caches["tiered-shared"].clear()
+        self.assertEqual(second.get("snapshot"), 1)
+        self.assertIsNone(second.get("page"))
+        self.assertEqual(len(caches["tiered-durable"]._cache), 2)
+
+        second.delete("snapshot")
+        self.assertIsNone(first.get("snapshot"))
+        self.assertEqual(len(caches["tiered-durable"]._cache), 0)
+
+    def test_replaces_a_value_written_by_the_older_layout(self):
+        cache = self._cache("l1-a")
+        caches["tiered-shared"].set("universe", ["AAA", "BBB"])
+        self.assertIsNone(cache.get("universe"))
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            self.assertTrue(cache.touch("universe"))
+            cache.set("universe", ["CCC"])
+        self.assertEqual(cache.get("universe"), ["CCC"])
+        self.assertEqual(len(caches["tiered-shared"]._cache), 2)
+
+
+class IntradayStoreTests(SimpleTestCase):
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.store = IntradayStore(Path(workdir.name))
+        self.day = date(2026, 1, 6)
+
+    def _at(self, minutes):
+        return datetime(2026, 1, 6, 15, 0, tzinfo=dt_timezone.utc) + timedelta(minutes=minutes)
+
+    def test_append_widens_rows_when_the_universe_grows(self):
+        self.store.append(SnapshotFrame(["AAA", "BBB"], [10, 20], [9, 19]), self._at(0))
+        grown = SnapshotFrame(["AAA", "BBB", "CCC"], [11, 21, 31], [9, 19, 29])
+        self.store.append(grown, self._at(1))
+        self.store.append(SnapshotFrame(["CCC", "AAA"], [32, 12], [29, 9]), self._at(2))
+
+        times, prices = self.store.read_ticks("AAA", self.day)
+        self.assertEqual(list(prices), [10, 11, 12])
+        self.assertEqual(list(times), [int(self._at(m).timestamp()) for m in range(3)])
+        self.assertEqual(list(self.store.read_ticks("BBB", self.day)[1]), [20, 21])
+        self.assertEqual(list(self.store.read_ticks("CCC", self.day)[1]), [31, 32])
+        self.assertEqual(self.store.first_prices(self.day), {"AAA": 10, "BBB": 20, "CCC": 31})
+
+    def test_rollup_ignores_missing_prices(self):
+        times = np.array([0, 60, 120, 240, 300, 360], dtype=np.int64)
+        prices = np.array(
+            [[np.nan, 1], [5, 2], [7, np.nan], [6, 4], [np.nan, np.nan], [8, np.nan]],
+            dtype=np.float32,
+        )
+
+        bars = rollup(times, prices, 300)
+
+        self.assertEqual(list(bars["times"]), [0, 300])
+        np.testing.assert_array_equal(bars["open"], [[5, 1], [8, np.nan]])
+        np.testing.assert_array_equal(bars["high"], [[7, 4], [8, np.nan]])
+        np.testing.assert_array_equal(bars["low"], [[5, 1], [8, np.nan]])
+        np.testing.assert_array_equal(bars["close"], [[6, 4], [8, np.nan]])
+
+    def test_prune_materializes_bars_before_dropping_ticks(self):
+        for minutes, price in ((0, 10), (2, 12), (4, 9), (6, 11)):
+            self.store.append(SnapshotFrame(["AAA"], [price], [10]), self._at(minutes))
+        day_dir = self.store.day_dir(self.day)
+
+        removed = self.store.prune(self.day + timedelta(days=RAW_RETENTION_DAYS + 1))
+
+        self.assertEqual(removed["raw"], 1)
+        self.assertFalse((day_dir / "times.bin").exists())
+        self.assertFalse((day_dir / "prices.bin").exists())
+        bars = self.store.read_bars("AAA", self.day, self.day)
+        self.assertEqual(list(bars["open"]), [10, 11])
+        self.assertEqual(list(bars["high"]), [12, 11])
+        self.assertEqual(list(bars["low"]), [9, 11])
+        hourly = self.store.read_bars("AAA", self.day, self.day, BAR_1H_SECONDS)
+        self.assertEqual(list(hourly["close"]), [11])
+
+        self.store.prune(self.day + timedelta(days=BAR_5M_RETENTION_DAYS + 1))
+        self.assertFalse((day_dir / "bars_{}".format(BAR_5M_SECONDS)).exists())
+        self.store.prune(self.day + timedelta(days=BAR_1H_RETENTION_DAYS + 1))
+        self.assertFalse(day_dir.exists())
+
+
+class MetricsTests(TestCase):
+    def test_db_stage_counts_queries(self):
+        before = metrics.samples()["counters"].get(
+            ("market_stage_queries_total", (("stage", "test"),)), 0
+        )
+        with metrics.db_stage("test"):
+            list(DailyLeaderSnapshot.objects.all())
+            list(DailyLeaderSnapshot.objects.all())
+        after = metrics.samples()["counters"][
+            ("market_stage_queries_total", (("stage", "test"),))
+        ]
+        self.assertEqual(after - before, 2)
+
+    def test_endpoint_renders_prometheus_text(self):
+        metrics.observe("market_render_seconds", 0.02, view="dashboard")
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        self.assertIn("Server-Timing", response)
+        body = response.content.decode()
+        self.assertIn("# TYPE market_render_seconds histogram", body)
+        self.assertIn(
+            'market_render_seconds_bucket{source="web",view="dashboard",le="0.025"}', body
+        )
+
+
+class AsyncSnapshotTests(TestCase):
+    def setUp(self):
+        self.stub = StubMarketServer(missing_rate=0.2, today=dj_timezone.localdate()).start()
+        self.addCleanup(self.stub.stop)
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        settings = override_settings(
+            MARKET_DATA_DIR=Path(workdir.name),
+            MARKET_YAHOO_QUOTE_URL=self.stub.url,
+            MARKET_YAHOO_CHART_URL=self.stub.url,
+            MARKET_STOOQ_URL=self.stub.url,
+            MARKET_REFRESH_ON_REQUEST=True,
+            CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        services._stooq_store = services._intraday_store = None
+        services._indicator_engine = None
+        services._universe_memo.clear()
+        self.addCleanup(services._universe_memo.clear)
+        self.addCleanup(setattr, services, "_intraday_store", None)
+        self.addCleanup(setattr, services, "_stooq_store", None)
+        self.addCleanup(setattr, services, "_indicator_engine", None)
+        self.addCleanup(services.wait_for_indicator_seeding)
+        for provider in services.PROVIDERS:
+            provider.stats = ProviderStats()
+        services.cache.clear()
+
+    async def test_refresh_fills_quote_gaps_from_chart(self):
+        snapshot = await services.aget_market_snapshot()
+
+        universe = await services.aget_universe()
+        self.assertEqual(snapshot["error"], "")
+        self.assertEqual(len(snapshot["frame"]), len(universe))
+        self.assertEqual(self.stub.requests["yahoo_quote"], 1)
+        self.assertGreater(self.stub.requests["yahoo_chart"], 0)
+
+    async def test_indicator_history_is_seeded_after_the_refresh(self):
+        await services.aget_market_snapshot()
+        await sync_to_async(services.wait_for_indicator_seeding)()
+
+        universe = await services.aget_universe()
+        engine = IndicatorEngine(Path(django_settings.MARKET_DATA_DIR) / "indicators")
+        seeded = [item["symbol"] for item in universe if engine._has_history(item["symbol"])]
+        self.assertEqual(len(seeded), min(len(universe), services.INDICATOR_SEED_SYMBOLS))
+        # Symbols the chart provider already tried today get 10-day bars.
+        wanted = services._chart_history_wanted
+        self.assertEqual(await sync_to_async(wanted)(["ZZZZ", seeded[0]]), {"ZZZZ"})
+        self.assertEqual(await sync_to_async(wanted)(["ZZZZ"]), set())
+
+    async def test_refresh_lock_is_taken_off_the_event_loop(self):
+        loop_thread = threading.get_ident()
+        threads = []
+        acquire, release = services._acquire_refresh_lock, services._release_refresh_lock
+
+        def acquire_lock():
+            threads.append(threading.get_ident())
+            return acquire()
+
+        def release_lock(token):
+            threads.append(threading.get_ident())
+            release(token)
+
+        with mock.patch.multiple(
+            services,
+            _acquire_refresh_lock=acquire_lock,
+            _release_refresh_lock=release_lock,
+            _queue_indicator_seeding=mock.DEFAULT,
+        ):
+            snapshot = await services.arefresh_market_snapshot()
+
+        self.assertEqual(snapshot["error"], "")
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(loop_thread, threads)
+
+    async def test_dashboard_view_is_async(self):
+        response = await self.async_client.get("/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "AAPL")
+
+
+class SnapshotBroadcasterTests(SimpleTestCase):
+    async def test_fans_out_each_new_version_encoded_once(self):
+        published = [{"version": 1}]
+        encoded = []
+
+        def encode(snapshot, since=None):
+            encoded.append((snapshot["version"], since))
+            return "{}:{}".format(snapshot["version"], since).encode()
+
+        async def latest(background_refresh=False):
+            return published[0]
+
+        broadcaster = streaming.SnapshotBroadcaster(0.01)
+        with mock.patch.object(streaming, "_encode", encode), mock.patch.object(
+            streaming, "aget_market_snapshot", latest
+        ):
+            first, first_initial = await broadcaster.subscribe()
+            second, second_initial = await broadcaster.subscribe()
+            self.assertEqual([first_initial, second_initial], [b"1:None"] * 2)
+
+            # The same version polled again is not pushed.
+            await asyncio.sleep(0.05)
+            self.assertTrue(first.empty())
+
+            published[0] = {"version": 2}
+            messages = [await asyncio.wait_for(queue.get(), 1) for queue in (first, second)]
+            self.assertEqual(messages, [b"2:1"] * 2)
+            self.assertEqual(encoded, [(1, None), (2, 1)])
+
+            # A late subscriber gets the full state; leaving removes it.
+            events = broadcaster.events()
+            self.assertEqual(await events.__anext__(), b"2:None")
+            self.assertEqual(len(broadcaster._subscribers), 3)
+            await events.aclose()
+            self.assertEqual(broadcaster._subscribers, {first, second})
+
+            broadcaster.unsubscribe(first)
+            broadcaster.unsubscribe(second)
+            await asyncio.wait_for(broadcaster._task, 1)
+        self.assertEqual(encoded, [(1, None), (2, 1), (2, None)])
+
+
+class IndicatorEngineTests(SimpleTestCase):
+    def _reference(self, closes):
+        # Full recompute over the whole series, as a charting library would.
+        series = pd.Series(closes)
+        changes = series.diff().dropna()
+        gain = changes.clip(lower=0).ewm(alpha=1 / 14, adjust=False).mean().iloc[-1]
+        loss = (-changes).clip(lower=0).ewm(alpha=1 / 14, adjust=False).mean().iloc[-1]
+        returns = np.log(series / series.shift()).iloc[-20:]
+        window = series.iloc[-252:]
+        return {
+            "sma_20": series.iloc[-20:].mean(),
+            "sma_50": series.iloc[-50:].mean(),
+            "ema_20": series.ewm(span=20, adjust=False).mean().iloc[-1],
+            "rsi_14": 100 - 100 / (1 + gain / loss),
+            "volatility_20": returns.std() * np.sqrt(252) * 100,
+            "range_52w_pct": (series.iloc[-1] - window.min())
+            / (window.max() - window.min())
+            * 100,
+        }
+
+    def test_incremental_matches_full_recompute_across_sessions(self):
+        days = np.arange(300)
+        closes = list(np.round(100 + 10 * np.sin(days / 7) + days / 20, 2))
+        engine = IndicatorEngine()
+        engine.seed("AAA", closes)
+        today = dj_timezone.localdate()
+
+        for offset, price in enumerate([closes[-1] * 1.03, closes[-1] * 0.98]):
+            frame = SnapshotFrame.from_closes(["AAA"], {"AAA": (closes[-1], price)})
+            indicators = engine.update(frame, today + timedelta(days=offset))
+            expected = self._reference(closes[len(closes) - 251 :] + [frame.price[0]])
+            for field, value in expected.items():
+                self.assertAlmostEqual(indicators[field][0], value, places=6, msg=field)
+            closes.append(frame.price[0])
+
+        self.assertEqual(len(engine.symbols), 1)
+
+    def test_engines_sharing_files_pick_up_each_others_sessions(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        closes = list(100 + np.arange(260) / 10)
+        first, second = IndicatorEngine(workdir.name), IndicatorEngine(workdir.name)
+        reference = IndicatorEngine()
+        for engine in (first, reference):
+            engine.seed("AAA", closes)
+        today = date(2026, 1, 6)
+
+        def frame(*prices):
+            symbols = ["AAA", "BBB"][: len(prices)]
+            return SnapshotFrame(symbols, list(prices), [100.0] * len(prices))
+
+        for engine in (first, reference):
+            engine.update(frame(130.0), today)
+            engine.update(frame(131.0, 50.0), today)
+        # The other process commits the session written by the first one.
+        indicators = second.update(frame(132.0, 51.0), today + timedelta(days=1))
+        expected = reference.update(frame(132.0, 51.0), today + timedelta(days=1))
+
+        np.testing.assert_allclose(indicators["sma_20"], expected["sma_20"])
+        np.testing.assert_allclose(indicators["rsi_14"], expected["rsi_14"])
+        self.assertEqual(second.closes[second._rows["BBB"], -1], 50.0)
+        # ... and the first one then continues from the second one's files.
+        indicators = first.update(frame(133.0), today + timedelta(days=1))
+        expected = reference.update(frame(133.0), today + timedelta(days=1))
+        np.testing.assert_allclose(indicators["sma_50"], expected["sma_50"])
+
+
+def _et(*args):
+    return datetime(*args, tzinfo=EXCHANGE_TZ)
+
+
+class MarketRefresherTests(SimpleTestCase):
+    def test_retries_after_the_close_until_a_refresh_publishes(self):
+        command = importlib.import_module("market.management.commands.run_market_refresher")
+        clock = [_et(2026, 1, 6, 16, 10)]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) == 4:
+                raise KeyboardInterrupt
+            clock[0] += timedelta(seconds=seconds)
+
+        published = {"error": "", "frame": SnapshotFrame.empty()}
+        refreshes = [None, {"error": "down"}, {"error": "down"}, published]
+        with mock.patch.multiple(
+            command,
+            refresh_market_snapshot=mock.Mock(side_effect=refreshes),
+            get_intraday_store=mock.DEFAULT,
+            metrics=mock.DEFAULT,
+            dj_timezone=mock.Mock(
+                now=lambda: clock[0], localdate=lambda: clock[0].date()
+            ),
+            time=mock.Mock(monotonic=time.monotonic, sleep=sleep),
+        ):
+            call_command("run_market_refresher", stdout=io.StringIO(), stderr=io.StringIO())
+
+        # A skipped and two failed refreshes back off; once the closing
+        # prices are published the refresher waits for the next open.
+        self.assertEqual([round(seconds) for seconds in sleeps[:3]], [30, 60, 120])
+        self.assertEqual(clock[0] + timedelta(seconds=sleeps[3]), _et(2026, 1, 7, 9, 30))
+        self.assertIsNone(command._post_close_retry_at(_et(2026, 1, 6, 15, 0), 2))
+        self.assertEqual(
+            command._post_close_retry_at(_et(2026, 1, 6, 18), 9), _et(2026, 1, 6, 18, 10)
+        )
+
+
+class TradingCalendarTests(SimpleTestCase):
+    def test_holidays_and_early_closes(self):
+        self.assertIsNone(session_hours(date(2026, 4, 3)))  # Good Friday
+        self.assertIsNone(session_hours(date(2027, 6, 18)))  # Juneteenth, observed
+        self.assertIsNone(session_hours(date(2026, 7, 3)))  # Independence Day, observed
+        self.assertIsNotNone(session_hours(date(2021, 12, 31)))  # New Year on a Saturday
+        self.assertEqual(session_hours(date(2026, 11, 27))[1], _et(2026, 11, 27, 13))
+        self.assertEqual(session_hours(date(2026, 10, 16))[1], _et(2026, 10, 16, 16))
+
+    def test_refresh_cadence_follows_the_session(self):
+        self.assertEqual(session_state(_et(2026, 10, 19, 9)), "pre_open")
+        self.assertEqual(
+            next_refresh_at(_et(2026, 10, 19, 10), 120), _et(2026, 10, 19, 10, 2)
+        )
+        # The last refresh of the session waits for the closing prints ...
+        self.assertEqual(
+            next_refresh_at(_et(2026, 10, 19, 16, 1), 120), _et(2026, 10, 19, 16, 10)
+        )
+        # ... and the next one is at the following open, over the weekend.
+        self.assertEqual(
+            next_refresh_at(_et(2026, 10, 16, 16, 10), 120), _et(2026, 10, 19, 9, 30)
+        )
+
+
+class ExportLeadersTests(TestCase):
+    def setUp(self):
+        today = dj_timezone.localdate()
+        for days_ago, symbol, group in (
+            (2, "AAPL", DailyLeaderSnapshot.GROUP_WINNER),
+            (1, "AAPL", DailyLeaderSnapshot.GROUP_LOSER),
+            (1, "MSFT", DailyLeaderSnapshot.GROUP_WINNER),
+        ):
+            DailyLeaderSnapshot.objects.create(
+                snapshot_date=today - timedelta(days=days_ago),
+                symbol=symbol,
+                company_name=symbol,
+                group=group,
+                close_price=10,
+                change_pct=1,
+            )
+        self.url = reverse("export_leaders")
+
+    def test_streams_filtered_csv_in_chunks(self):
+        queryset = exports.export_queryset(symbols=["aapl"])
+        chunks = list(exports.iter_csv(queryset, chunk_size=1))
+
+        self.assertEqual(len(chunks), 2)  # header rides with the first row
+        lines = b"".join(chunks).decode().splitlines()
+        self.assertEqual(lines[0], ",".join(exports.EXPORT_FIELDS))
+        self.assertEqual([line.split(",")[3] for line in lines[1:]], ["winner", "loser"])
+
+    def test_view_streams_csv_with_filters(self):
+        response = self.client.get(self.url, {"group": "winner", "symbol": "MSFT,AAPL"})
+
+        self.assertTrue(response.streaming)
+        self.assertIn("attachment;", response["Content-Disposition"])
+        rows = b"".join(response.streaming_content).decode().splitlines()[1:]
+        self.assertEqual([row.split(",")[1] for row in rows], ["AAPL", "MSFT"])
+
+    def test_view_rejects_bad_parameters(self):
+        self.assertEqual(self.client.get(self.url, {"start": "2024-13-01"}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"format": "xlsx"}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"group": "neutral"}).status_code, 400)
+
+    @skipUnless(exports.pa is not None, "pyarrow is not installed")
+    async def test_view_streams_parquet_under_asgi(self):
+        response = await self.async_client.get(self.url, {"format": "parquet"})
+
+        body = b"".join([chunk async for chunk in response.streaming_content])
+        table = exports.pa.parquet.read_table(io.BytesIO(body))
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(table.column_names, list(exports.EXPORT_FIELDS))
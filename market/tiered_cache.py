@@ -0,0 +1,203 @@
+from collections import OrderedDict
+import threading
+import time
+import uuid
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+_MISSING = object()
+
+# L1 stores are per process, shared by every thread's backend instance (the
+# same approach LocMemCache uses).
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class _LocalStore:
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+
+class TieredCache(BaseCache):
+    # Two-tier cache: a size-bounded in-process L1 in front of a shared L2
+    # cache alias (file-based by default, Redis or Memcached in larger
+    # deployments). In L2 each key holds only a version stamp; the value is
+    # stored under the key plus that stamp. A write stores the value under a
+    # new stamp and then points the key at it, so a reader always gets the
+    # value its stamp names, however writers interleave. An L1 copy is
+    # trusted for STAMP_CHECK_SECONDS and then revalidated by reading the
+    # key's small stamp; writes only ever invalidate their own key.
+    # DURABLE_KEYS live in the DURABLE alias instead of SHARED, so a culling
+    # backend never drops them to make room for the rest.
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self._shared_alias = options.get("SHARED", "shared")
+        self._durable_alias = options.get("DURABLE")
+        self._durable_keys = frozenset(options.get("DURABLE_KEYS", ()))
+        self._check_seconds = float(options.get("STAMP_CHECK_SECONDS", 1.0))
+        self._l1_max_age = float(options.get("L1_MAX_AGE_SECONDS", 60))
+        with _stores_lock:
+            self._store = _stores.setdefault(location, _LocalStore())
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _tier(self, key):
+        if self._durable_alias and key in self._durable_keys:
+            return caches[self._durable_alias]
+        return self.shared
+
+    @staticmethod
+    def _value_key(key, stamp):
+        return "{}@{}".format(key, stamp)
+
+    def _l1_expiry(self, timeout):
+        expiry = time.monotonic() + self._l1_max_age
+        if timeout is not None and timeout is not DEFAULT_TIMEOUT:
+            expiry = min(expiry, time.monotonic() + max(0, timeout))
+        return expiry
+
+    def _remember(self, local_key, stamp, value, timeout=DEFAULT_TIMEOUT):
+        # (value, stamp, expiry, last checked against L2)
+        entry = (value, stamp, self._l1_expiry(timeout), time.monotonic())
+        store = self._store
+        with store.lock:
+            store.entries[local_key] = entry
+            store.entries.move_to_end(local_key)
+            while len(store.entries) > self._max_entries:
+                store.entries.popitem(last=False)
+
+    def _forget(self, local_key):
+        with self._store.lock:
+            self._store.entries.pop(local_key, None)
+
+    def _local_entry(self, local_key):
+        store = self._store
+        with store.lock:
+            entry = store.entries.get(local_key)
+            if entry is None:
+                return None
+            if entry[2] <= time.monotonic():
+                del store.entries[local_key]
+                return None
+            store.entries.move_to_end(local_key)
+            return entry
+
+    def _local_get(self, local_key):
+        # An L1 value checked against L2 within STAMP_CHECK_SECONDS.
+        entry = self._local_entry(local_key)
+        if entry is not None and time.monotonic() - entry[3] < self._check_seconds:
+            return entry[0]
+        return _MISSING
+
+    def _fetch(self, key, version):
+        # (stamp, value) from L2. A reader racing a write can see a stamp
+        # whose value was just replaced; it then re-reads the stamp.
+        tier = self._tier(key)
+        for _ in range(2):
+            stamp = tier.get(key, version=version)
+            if not isinstance(stamp, str):  # missing, or written by an older layout
+                return None, _MISSING
+            value = tier.get(self._value_key(key, stamp), _MISSING, version=version)
+            if value is not _MISSING:
+                return stamp, value
+        return None, _MISSING
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        value = self._local_get(local_key)
+        if value is not _MISSING:
+            return value
+
+        entry = self._local_entry(local_key)
+        if entry is not None:
+            stamp = self._tier(key).get(key, version=version)
+            if stamp == entry[1]:
+                self._remember(local_key, stamp, entry[0])
+                return entry[0]
+
+        stamp, value = self._fetch(key, version)
+        if value is _MISSING:
+            self._forget(local_key)
+            return default
+        self._remember(local_key, stamp, value)
+        return value
+
+    async def aget(self, key, default=None, version=None):
+        # A freshly checked L1 hit is answered on the event loop; anything
+        # that touches the shared tier goes through a thread.
+        local_key = self.make_and_validate_key(key, version=version)
+        value = self._local_get(local_key)
+        if value is not _MISSING:
+            return value
+        return await super().aget(key, default, version=version)
+
+    def _store_value(self, key, value, timeout, version):
+        stamp = uuid.uuid4().hex
+        self._tier(key).set(self._value_key(key, stamp), value, timeout, version=version)
+        return stamp
+
+    def _drop_value(self, key, stamp, version):
+        if isinstance(stamp, str):  # not missing, nor a value of an older layout
+            self._tier(key).delete(self._value_key(key, stamp), version=version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        tier = self._tier(key)
+        previous = tier.get(key, version=version)
+        stamp = self._store_value(key, value, timeout, version)
+        tier.set(key, stamp, timeout, version=version)
+        self._drop_value(key, previous, version)
+        self._remember(local_key, stamp, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        stamp = self._store_value(key, value, timeout, version)
+        if not self._tier(key).add(key, stamp, timeout, version=version):
+            self._drop_value(key, stamp, version)
+            return False
+        self._remember(local_key, stamp, value, timeout)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self.make_and_validate_key(key, version=version)
+        tier = self._tier(key)
+        stamp = tier.get(key, version=version)
+        if stamp is None:
+            return False
+        if isinstance(stamp, str):
+            tier.touch(self._value_key(key, stamp), timeout, version=version)
+        return tier.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        tier = self._tier(key)
+        stamp = tier.get(key, version=version)
+        deleted = tier.delete(key, version=version)
+        self._drop_value(key, stamp, version)
+        self._forget(local_key)
+        return deleted
+
+    def incr(self, key, delta=1, version=None):
+        # Read-modify-write, like the file-based backend's incr.
+        value = self.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            raise ValueError("Key '%s' not found" % key)
+        value += delta
+        self.set(key, value, None, version=version)
+        return value
+
+    def has_key(self, key, version=None):
+        return self.get(key, self, version=version) is not self
+
+    def clear(self):
+        self.shared.clear()
+        if self._durable_alias:
+            caches[self._durable_alias].clear()
+        with self._store.lock:
+            self._store.entries.clear()
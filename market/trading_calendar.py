@@ -0,0 +1,169 @@
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+# NYSE regular sessions: hours, weekends, full holidays and early closes.
+# Refresh cadence and snapshot TTLs follow it, so nothing is refetched while
+# prices cannot change.
+EXCHANGE_TZ = ZoneInfo("America/New_York")
+OPEN_TIME = time(9, 30)
+CLOSE_TIME = time(16, 0)
+EARLY_CLOSE_TIME = time(13, 0)
+# Closing auction prints can arrive a few minutes after the bell; the final
+# refresh of a session waits this long.
+POST_CLOSE_DELAY = timedelta(minutes=10)
+# Exchange closures never run longer than a few days; this bounds the search.
+MAX_CLOSED_DAYS = 14
+
+SESSION_LABELS = {
+    "open": "Market open",
+    "pre_open": "Pre-market",
+    "after_close": "After close",
+    "closed": "Market closed",
+}
+
+
+def _easter(year):
+    # Anonymous Gregorian algorithm.
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    w = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * w) // 451
+    month, day = divmod(h + w - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def _nth_weekday(year, month, weekday, n):
+    first = date(year, month, 1)
+    return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+
+
+def _last_weekday(year, month, weekday):
+    last = date(year, month + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _observed(day):
+    # Saturday holidays close the Friday before, Sunday ones the Monday after.
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+@lru_cache(maxsize=None)
+def holidays(year):
+    days = {
+        _nth_weekday(year, 1, 0, 3),  # Martin Luther King Jr. Day
+        _nth_weekday(year, 2, 0, 3),  # Washington's Birthday
+        _easter(year) - timedelta(days=2),  # Good Friday
+        _last_weekday(year, 5, 0),  # Memorial Day
+        _observed(date(year, 7, 4)),
+        _nth_weekday(year, 9, 0, 1),  # Labor Day
+        _nth_weekday(year, 11, 3, 4),  # Thanksgiving
+        _observed(date(year, 12, 25)),
+    }
+    # New Year's Day on a Saturday is not made up on the last day of the
+    # previous year.
+    if date(year, 1, 1).weekday() != 5:
+        days.add(_observed(date(year, 1, 1)))
+    if year >= 2022:
+        days.add(_observed(date(year, 6, 19)))  # Juneteenth
+    return frozenset(days)
+
+
+@lru_cache(maxsize=None)
+def early_closes(year):
+    candidates = (
+        date(year, 7, 3),
+        _nth_weekday(year, 11, 3, 4) + timedelta(days=1),  # day after Thanksgiving
+        date(year, 12, 24),
+    )
+    return frozenset(day for day in candidates if is_trading_day(day))
+
+
+def is_trading_day(day):
+    return day.weekday() < 5 and day not in holidays(day.year)
+
+
+def session_hours(day):
+    # (open, close) as aware datetimes, or None when the exchange is closed.
+    if not is_trading_day(day):
+        return None
+    close = EARLY_CLOSE_TIME if day in early_closes(day.year) else CLOSE_TIME
+    return (
+        datetime.combine(day, OPEN_TIME, EXCHANGE_TZ),
+        datetime.combine(day, close, EXCHANGE_TZ),
+    )
+
+
+def next_open(moment):
+    day = moment.astimezone(EXCHANGE_TZ).date()
+    for _ in range(MAX_CLOSED_DAYS):
+        hours = session_hours(day)
+        if hours and hours[0] > moment:
+            return hours[0]
+        day += timedelta(days=1)
+    raise ValueError("No NYSE session within {} days of {}".format(MAX_CLOSED_DAYS, moment))
+
+
+def session_date(moment):
+    # The session current prices belong to: today once it has opened,
+    # otherwise the last trading day before.
+    day = moment.astimezone(EXCHANGE_TZ).date()
+    for _ in range(MAX_CLOSED_DAYS):
+        hours = session_hours(day)
+        if hours and hours[0] <= moment:
+            return day
+        day -= timedelta(days=1)
+    raise ValueError("No NYSE session within {} days of {}".format(MAX_CLOSED_DAYS, moment))
+
+
+def session_state(moment):
+    hours = session_hours(moment.astimezone(EXCHANGE_TZ).date())
+    if hours is None:
+        return "closed"
+    if moment < hours[0]:
+        return "pre_open"
+    if moment < hours[1]:
+        return "open"
+    return "after_close"
+
+
+def next_refresh_at(moment, interval):
+    # Every `interval` seconds while the market is open, once more when the
+    # closing prices have settled, then not until the next open.
+    hours = session_hours(moment.astimezone(EXCHANGE_TZ).date())
+    if hours:
+        settled = hours[1] + POST_CLOSE_DELAY
+        if hours[0] <= moment < hours[1]:
+            return min(moment + timedelta(seconds=interval), settled)
+        if hours[1] <= moment < settled:
+            return settled
+    return next_open(moment)
+
+
+def seconds_until_refresh(moment, interval):
+    return max(1.0, (next_refresh_at(moment, interval) - moment).total_seconds())
+
+
+def session_info(moment):
+    # What a published snapshot carries about the market at build time.
+    state = session_state(moment)
+    info = {
+        "state": state,
+        "label": SESSION_LABELS[state],
+        "session_date": session_date(moment).isoformat(),
+        "next_open": None,
+    }
+    if state != "open":
+        opens = next_open(moment)
+        info["next_open"] = opens.isoformat()
+        info["label"] += ", opens {:%a %b %d %H:%M} ET".format(opens)
+    return info
@@ -1,7 +1,17 @@
 from django.urls import path
 
-from .views import dashboard
+from .views import (
+    dashboard,
+    export_leaders,
+    metrics_view,
+    snapshot_api,
+    snapshot_stream,
+)
 
 urlpatterns = [
     path("", dashboard, name="dashboard"),
+    path("api/snapshot/", snapshot_api, name="snapshot_api"),
+    path("api/snapshot/stream/", snapshot_stream, name="snapshot_stream"),
+    path("api/leaders/export/", export_leaders, name="export_leaders"),
+    path("metrics", metrics_view, name="metrics"),
 ]
@@ -1,8 +1,154 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date
 
-from .services import get_market_snapshot
+from . import exports, metrics
+from .indicators import add_indicators
+from .models import DailyLeaderSnapshot
+from .page_cache import aget_page, page_key, page_response
+from .payloads import snapshot_etag, snapshot_payload
+from .services import (
+    HISTORY_WINDOW_CHOICES,
+    aget_market_snapshot,
+    company_names,
+    get_history_chart_json,
+    get_market_snapshot,
+    get_universe,
+)
 
 
-def dashboard(request):
-    context = get_market_snapshot()
-    return render(request, "market/dashboard.html", context)
+def _history_days(request, default):
+    try:
+        days = int(request.GET.get("days", default))
+    except (TypeError, ValueError):
+        return default
+    return days if days in HISTORY_WINDOW_CHOICES else default
+
+
+def _render_dashboard(snapshot, days, default_days):
+    context = dict(snapshot, history_window_choices=HISTORY_WINDOW_CHOICES)
+    if days != default_days:
+        context["history_days"] = days
+        context["history_chart_json"] = get_history_chart_json(days, snapshot.get("version"))
+    if "frame" in context:
+        context["stocks"] = add_indicators(
+            context["frame"].to_rows(company_names(get_universe())), context.get("indicators")
+        )
+    with metrics.timed("market_render_seconds", view="dashboard"):
+        return render_to_string("market/dashboard.html", context).encode("utf-8")
+
+
+async def dashboard(request):
+    # The page does not depend on the visitor, only on the snapshot version
+    # and chart window, so it is rendered and compressed once per version.
+    # Async, so under ASGI a worker keeps serving while a refresh is waiting
+    # on upstream providers.
+    snapshot = await aget_market_snapshot(background_refresh=isinstance(request, ASGIRequest))
+    default_days = snapshot.get("history_days", settings.MARKET_HISTORY_DAYS)
+    days = _history_days(request, default_days)
+    key = page_key(snapshot, "dashboard", days)
+    variants = await aget_page(
+        key,
+        lambda: _render_dashboard(snapshot, days, default_days),
+        cacheable=bool(snapshot.get("version")),
+    )
+    return page_response(request, key, variants)
+
+
+def snapshot_api(request):
+    snapshot = get_market_snapshot()
+    etag = snapshot_etag(snapshot)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        not_modified["Cache-Control"] = "no-cache"
+        return not_modified
+
+    try:
+        since = int(request.GET.get("since", 0))
+    except ValueError:
+        since = 0
+    response = JsonResponse(snapshot_payload(snapshot, since=since))
+    response["ETag"] = etag
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+async def snapshot_stream(request):
+    # Server-Sent Events need a long-lived async response, which only the ASGI
+    # entry point can hold open cheaply; WSGI clients fall back to polling.
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse("Streaming requires the ASGI server.", status=501)
+
+    from .streaming import broadcaster
+
+    response = StreamingHttpResponse(broadcaster.events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def _date_param(request, name):
+    value = request.GET.get(name)
+    if not value:
+        return None
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+def export_leaders(request):
+    # ?format=csv|parquet|arrow&start=YYYY-MM-DD&end=YYYY-MM-DD&symbol=AAPL,MSFT
+    # &group=winner|loser, streamed in chunks whatever the size of the history.
+    export_format = request.GET.get("format", "csv")
+    if export_format not in exports.EXPORT_FORMATS:
+        return HttpResponseBadRequest("Unknown format: {}".format(export_format))
+    if export_format in exports.COLUMNAR_FORMATS and exports.pa is None:
+        return HttpResponse("The {} export needs pyarrow.".format(export_format), status=501)
+
+    try:
+        start = _date_param(request, "start")
+        end = _date_param(request, "end")
+    except ValueError:
+        return HttpResponseBadRequest("Dates must be YYYY-MM-DD.")
+    group = request.GET.get("group") or None
+    if group not in (None, DailyLeaderSnapshot.GROUP_WINNER, DailyLeaderSnapshot.GROUP_LOSER):
+        return HttpResponseBadRequest("Unknown group: {}".format(group))
+    symbols = [
+        symbol.strip()
+        for value in request.GET.getlist("symbol")
+        for symbol in value.split(",")
+        if symbol.strip()
+    ]
+
+    queryset = exports.export_queryset(start, end, symbols, group)
+    chunks = exports.iter_export(queryset, export_format)
+    if isinstance(request, ASGIRequest):
+        chunks = exports.aiter_chunks(chunks)
+    content_type, extension = exports.EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response["Content-Disposition"] = 'attachment; filename="leaders-{}-{}.{}"'.format(
+        start or "all", end or "latest", extension
+    )
+    return response
+
+
+def metrics_view(request):
+    # This process's samples plus whatever the background refresher last
+    # published, told apart by a "source" label.
+    sources = {
+        "web": metrics.samples(),
+        "refresher": metrics.published_samples(cache, "refresher"),
+    }
+    return HttpResponse(
+        metrics.render(sources), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
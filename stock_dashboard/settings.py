@@ -17,6 +17,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "market.middleware.RequestTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -68,9 +69,70 @@ USE_TZ = True
 STATIC_URL = "static/"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Local market data (cache files, price history stores).
+MARKET_DATA_DIR = BASE_DIR / "var"
+
+# The snapshot is shared between the web workers and run_market_refresher,
+# so "default" is a two-tier cache: a small per-process L1 in front of the
+# "shared" L2. Point "shared" and "durable" at Redis for multi-host
+# deployments, e.g.
+# {"BACKEND": "django.core.cache.backends.redis.RedisCache",
+#  "LOCATION": "redis://127.0.0.1:6379"}. The refresh lock then lives in
+# Redis too and covers every host; with the file-based default it is a lock
+# file under MARKET_DATA_DIR and only covers the processes of one host.
+# The file-based cache culls a random 1/CULL_FREQUENCY of its files once it
+# holds MAX_ENTRIES (300 by default), so "shared" gets room for every
+# snapshot frame, chart and page kept at once, and the keys that must never
+# be culled (the universe version and the published snapshot) live in the
+# small "durable" alias, which stays far below its own limit.
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-        "LOCATION": "stock-dashboard-cache",
-    }
+        "BACKEND": "market.tiered_cache.TieredCache",
+        "LOCATION": "market-l1",
+        "OPTIONS": {
+            "SHARED": "shared",
+            "DURABLE": "durable",
+            "DURABLE_KEYS": [
+                "market_universe_version",
+                "market_snapshot",
+                "market_snapshot_stale",
+            ],
+            "MAX_ENTRIES": 256,
+            "STAMP_CHECK_SECONDS": 1,
+        },
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": MARKET_DATA_DIR / "cache",
+        "OPTIONS": {"MAX_ENTRIES": 20000, "CULL_FREQUENCY": 10},
+    },
+    "durable": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": MARKET_DATA_DIR / "cache-durable",
+    },
+}
+
+# Set to False when run_market_refresher is running, so page requests only
+# read the published snapshot and never call upstream providers.
+MARKET_REFRESH_ON_REQUEST = True
+MARKET_REFRESH_INTERVAL_SECONDS = 120
+# Default window of the winners/losers trend chart, in days (30, 90 or 365).
+MARKET_HISTORY_DAYS = 30
+
+# How often each ASGI worker checks for a newly published snapshot to push to
+# its /api/snapshot/stream/ subscribers.
+MARKET_STREAM_POLL_SECONDS = 1
+
+# Requests per second allowed per upstream host by market.http_client. With
+# the 15 s refresh deadline the Stooq fallback covers about 150 symbols per
+# refresh (stalest first, the rest on the next one); raise the limit only as
+# far as Stooq tolerates for larger universes.
+MARKET_HTTP_RATE_LIMITS = {
+    "stooq.com": 10,
 }
+
+# Upstream endpoints; the benchmark_market command points these at its local
+# stub server.
+MARKET_YAHOO_QUOTE_URL = "https://query1.finance.yahoo.com"
+MARKET_YAHOO_CHART_URL = "https://query2.finance.yahoo.com"
+MARKET_STOOQ_URL = "http://stooq.com"